@@ -0,0 +1,380 @@
+"""Actas de entrega en PDF: generación con ReportLab y caché en disco.
+
+Cada acta generada se guarda en ``ACTAS_PDF_DIR``, en una carpeta por acta,
+con un nombre que es una huella (hash) de su contenido: encabezado, líneas y
+versión del formato. Si cambia cualquier línea, la huella cambia y el PDF se
+vuelve a generar; el archivo anterior se elimina. La misma huella sirve como
+ETag, por lo que "Previsualizar" y luego "Descargar" generan el PDF una sola
+vez y las revisitas del navegador se responden con 304 sin leer el archivo.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import cm, inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Flowable, KeepTogether, LongTable, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .models import ActaEntrega
+
+logger = logging.getLogger(__name__)
+
+# Cambiar al modificar el diseño del PDF: invalida todos los archivos en caché
+VERSION_FORMATO = 2
+
+
+RUTA_LOGO = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'images', 'seremi_logo.png')
+AZUL_SEREMI = colors.HexColor('#1a3c5e')
+GRIS_FIRMA = colors.HexColor('#64748b')
+
+
+class LogoActa(Flowable):
+    """Dibuja una imagen ya cargada (ImageReader), sin volver a leerla ni decodificarla."""
+
+    def __init__(self, imagen, ancho, alto):
+        super().__init__()
+        self.imagen = imagen
+        self.ancho = ancho
+        self.alto = alto
+        self.hAlign = 'LEFT'
+
+    def wrap(self, ancho_disponible, alto_disponible):
+        return self.ancho, self.alto
+
+    def draw(self):
+        self.canv.drawImage(self.imagen, 0, 0, self.ancho, self.alto, mask='auto')
+
+
+class ActaRenderer:
+    """
+    Genera el PDF de un acta de entrega. Los estilos de párrafo y de tabla y el
+    logo (decodificado una sola vez) se construyen al crear el objeto, por lo que
+    se usa una única instancia por proceso (RENDERER_ACTAS). La tabla de líneas
+    es una LongTable que repite el encabezado en cada página.
+    """
+    ANCHOS_COLUMNAS = [2.2*inch, 1.8*inch, 0.8*inch, 2.2*inch]
+    ENCABEZADO_LINEAS = ['Descripción', 'Nro. SISCOM', 'Cantidad', 'Observación']
+    RELLENO_CELDA = 8  # LEFTPADDING + RIGHTPADDING de estilo_lineas
+
+    def __init__(self, ruta_logo=RUTA_LOGO):
+        self.estilos = {
+            'TitleCustom': ParagraphStyle(name='TitleCustom', fontName='Helvetica-Bold', fontSize=14, alignment=1, spaceAfter=10, leading=16),
+            'NormalBold': ParagraphStyle(name='NormalBold', fontName='Helvetica-Bold', fontSize=10, spaceAfter=4, leading=12),
+            'NormalCustom': ParagraphStyle(name='NormalCustom', fontName='Helvetica-Bold', fontSize=10, spaceAfter=4, leading=12),
+            'ActaNumber': ParagraphStyle(name='ActaNumber', fontName='Helvetica-Bold', fontSize=20, alignment=1, textColor=colors.black, spaceAfter=0, leading=24),
+            'TableCell': ParagraphStyle(name='TableCell', fontName='Helvetica', fontSize=9, leading=11, alignment=0),
+            # Corte por carácter, sólo para celdas con palabras más anchas que la columna (es mucho más lento)
+            'TableCellCJK': ParagraphStyle(name='TableCellCJK', fontName='Helvetica', fontSize=9, leading=11, wordWrap='CJK', alignment=0),
+            'EncabezadoSeremi': ParagraphStyle(name='EncabezadoSeremi', fontName='Helvetica-Bold', fontSize=16, alignment=0, textColor=AZUL_SEREMI, spaceAfter=0, leading=18),
+            'EncabezadoRegion': ParagraphStyle(name='EncabezadoRegion', fontName='Helvetica', fontSize=13, alignment=0, textColor=AZUL_SEREMI, spaceAfter=10, leading=15),
+            'FirmaNombre': ParagraphStyle(name='FirmaNombre', fontName='Helvetica-Bold', fontSize=11, alignment=1, textColor=AZUL_SEREMI),
+            'FirmaTitulo': ParagraphStyle(name='FirmaTitulo', fontName='Helvetica-Bold', fontSize=10, alignment=1, textColor=AZUL_SEREMI),
+            'FirmaSub': ParagraphStyle(name='FirmaSub', fontName='Helvetica', fontSize=9, alignment=1, textColor=GRIS_FIRMA),
+            'FirmaLinea': ParagraphStyle(name='FirmaLinea', fontName='Helvetica', fontSize=12, alignment=1, textColor=colors.black),
+        }
+
+        if os.path.exists(ruta_logo):
+            self.logo = ImageReader(ruta_logo)
+        else:
+            logger.warning(f"Logo no encontrado en {ruta_logo}, usando texto alternativo.")
+            self.logo = None
+
+        self.estilo_encabezado = TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+            ('ALIGN', (1, 0), (1, 0), 'LEFT'),
+            ('LEFTPADDING', (1, 0), (1, 0), 10),
+        ])
+        self.estilo_numero = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 20),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('BOX', (0, 0), (-1, -1), 1, colors.black),
+        ])
+        self.estilo_cabecera = TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+            ('ALIGN', (1, 0), (1, 0), 'RIGHT')
+        ])
+        self.estilo_lineas = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 1), (-1, -1), 9),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('BOX', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 1), (-1, -1), 'TOP'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 4),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 4),
+        ])
+        self.estilo_firmas = TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('TOPPADDING', (0, 0), (-1, -1), 2),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        ])
+
+    def _cabecera(self, acta):
+        """Logo, textos institucionales y recuadro con el número del acta."""
+        if self.logo:
+            logo = LogoActa(self.logo, 3*cm, 3*cm)
+        else:
+            logo = Paragraph("Logo no encontrado", self.estilos['NormalCustom'])
+            logo.hAlign = 'LEFT'
+
+        encabezado_tabla = Table(
+            [
+                [logo, Table([
+                    [Paragraph("<b>SEREMI DE SALUD</b>", self.estilos['EncabezadoSeremi'])],
+                    [Paragraph("REGIÓN DE LA ARAUCANÍA", self.estilos['EncabezadoRegion'])],
+                ], colWidths=[10*cm])]
+            ],
+            colWidths=[3*cm, 13.5*cm], hAlign='LEFT', style=self.estilo_encabezado
+        )
+        acta_number_table = Table(
+            [[Paragraph(f"N° {acta.numero_acta}", self.estilos['ActaNumber'])]],
+            colWidths=[1.5*inch], rowHeights=[0.5*inch], style=self.estilo_numero
+        )
+        return Table([[encabezado_tabla, acta_number_table]], colWidths=[13.5*cm, 4.5*cm], style=self.estilo_cabecera)
+
+    def _celda(self, texto, columna):
+        """Paragraph de una celda; usa corte por carácter sólo si la palabra más larga no cabe en la columna."""
+        palabra_mas_larga = max(texto.split(), key=len, default='')
+        ancho = stringWidth(palabra_mas_larga, 'Helvetica', 9)
+        no_cabe = ancho > self.ANCHOS_COLUMNAS[columna] - self.RELLENO_CELDA
+        estilo = self.estilos['TableCellCJK' if no_cabe else 'TableCell']
+        return Paragraph(escape(texto).replace('\n', '<br/>'), estilo)
+
+    def _tabla_lineas(self, actas):
+        """Tabla de productos; LongTable reparte las filas en páginas y repite el encabezado."""
+        data = [self.ENCABEZADO_LINEAS]
+        for item in actas:
+            data.append([
+                self._celda((item.producto.descripcion or '')[:100], 0),  # Límite de 100 caracteres
+                self._celda((item.numero_siscom or '')[:100], 1),
+                str(item.cantidad),
+                # Permitir observaciones largas, sin truncar, y respetar saltos de línea
+                self._celda(item.observacion or '-', 3),
+            ])
+        return LongTable(data, colWidths=self.ANCHOS_COLUMNAS, repeatRows=1, style=self.estilo_lineas)
+
+    def _firmas(self, generador_text, responsable_text, num_productos):
+        """Pie de firmas, empujado hacia el final de la página según la cantidad de productos."""
+        responsable_lower = responsable_text.lower()
+        cargo = ("SECRETARIA DEL DEPARTAMENTO" if 'secretaria' in responsable_lower
+                else "JEFE DEL DEPARTAMENTO" if 'jefe' in responsable_lower or 'jefatura' in responsable_lower
+                else "RESPONSABLE DEL DEPARTAMENTO")
+
+        firma_table = Table([
+            [
+                Paragraph('<b>' + escape(generador_text) + '</b>', self.estilos['FirmaNombre']),
+                Paragraph('<b>' + escape(responsable_text) + '</b>', self.estilos['FirmaNombre'])
+            ],
+            [
+                Paragraph('<b>ENCARGADO DE BODEGA</b>', self.estilos['FirmaTitulo']),
+                Paragraph('<b>RECEPCIONA CONFORME</b>', self.estilos['FirmaTitulo'])
+            ],
+            [
+                Paragraph('SEREMI DE SALUD ARAUCANÍA', self.estilos['FirmaSub']),
+                Paragraph(cargo, self.estilos['FirmaSub'])
+            ],
+            [
+                Paragraph('<u>_____________________________</u>', self.estilos['FirmaLinea']),
+                Paragraph('<u>_____________________________</u>', self.estilos['FirmaLinea'])
+            ]
+        ], colWidths=[8*cm, 8*cm], hAlign='CENTER', style=self.estilo_firmas)
+
+        # Spacer adaptativo: pocas líneas empujan las firmas hacia abajo sin crear páginas innecesarias
+        if num_productos <= 3:
+            spacer_firmas = Spacer(1, 6*cm)
+        elif num_productos <= 8:
+            spacer_firmas = Spacer(1, 3*cm)
+        else:
+            spacer_firmas = Spacer(1, 0.8*cm)
+        # KeepTogether asegura que las firmas no se corten
+        return KeepTogether([spacer_firmas, firma_table])
+
+    def _documento(self, destino, titulo):
+        return SimpleDocTemplate(destino, pagesize=letter, leftMargin=0.75*inch, rightMargin=0.75*inch,
+                                 topMargin=0.5*inch, bottomMargin=0.5*inch,
+                                 title=titulo)  # Establecer el título del PDF
+
+    def _contenido(self, actas):
+        """Flowables de un acta completa (encabezado, tabla de líneas y firmas)."""
+        actas = list(actas)
+        if not actas:
+            raise ValueError("No se encontraron actas para generar el PDF.")
+        acta = actas[0]
+
+        departamento_text = acta.departamento[:100]
+        responsable_text = (acta.responsable.nombre if acta.responsable else 'No especificado')[:100]
+        generador_text = (acta.generador.nombre if acta.generador else 'No especificado')[:100]
+        fecha_text = acta.fecha.strftime('%d-%m-%Y')
+        normal = self.estilos['NormalCustom']
+
+        return [
+            self._cabecera(acta),
+            Spacer(1, 0.2*cm),
+            Paragraph("ACTA DE ENTREGA MATERIALES O INSUMOS", self.estilos['TitleCustom']),
+            Spacer(1, 0.3*cm),
+            Paragraph(f"En Temuco con fecha {fecha_text} se procede a realizar la entrega de los siguientes artículos a:", normal),
+            Spacer(1, 0.2*cm),
+            Paragraph(f"Sección: {escape(departamento_text)}", normal),
+            Spacer(1, 0.1*cm),
+            Paragraph(f"Responsable: {escape(responsable_text)}", normal),
+            Spacer(1, 0.5*cm),
+            Paragraph("Datos de Productos", self.estilos['NormalBold']),
+            Spacer(1, 0.2*cm),
+            self._tabla_lineas(actas),
+            self._firmas(generador_text, responsable_text, len(actas)),
+        ]
+
+    def renderizar(self, actas):
+        """PDF (bytes) del acta formada por `actas` (sus líneas, en orden)."""
+        actas = list(actas)
+        contenido = self._contenido(actas)
+        buffer = BytesIO()
+        self._documento(buffer, f"Acta N°{actas[0].numero_acta}").build(contenido)
+        return buffer.getvalue()
+
+    def renderizar_varias(self, grupos, destino, titulo="Actas de entrega", progreso=None):
+        """
+        Escribe en `destino` (ruta o archivo) un solo PDF con varias actas, cada
+        una desde una página nueva. `grupos` son las líneas de cada acta.
+        `progreso(actas_terminadas)` se llama a medida que avanza la maquetación.
+        """
+        contenido, limites = [], []
+        for actas in grupos:
+            if contenido:
+                contenido.append(PageBreak())
+            contenido.extend(self._contenido(actas))
+            limites.append(len(contenido))
+
+        documento = self._documento(destino, titulo)
+        if progreso:
+            def avance(tipo, valor):
+                # PROGRESS informa cuántos flowables se han consumido; se traduce a actas terminadas
+                if tipo == 'PROGRESS':
+                    progreso(bisect.bisect_right(limites, valor))
+            documento.setProgressCallBack(avance)
+        documento.build(contenido)
+        return len(limites)
+
+
+# Una instancia por proceso: estilos y logo se preparan una sola vez
+RENDERER_ACTAS = ActaRenderer()
+
+
+def generar_pdf_acta(actas):
+    """Genera el PDF de un acta de entrega. Devuelve {'pdf', 'numero_acta', 'filename'} o {'error'}."""
+    try:
+        pdf = RENDERER_ACTAS.renderizar(actas)
+    except Exception as e:
+        logger.error(f"Error al generar el PDF: {str(e)}")
+        return {'error': f"Error al generar el PDF: {str(e)}"}
+    numero_acta = next(iter(actas)).numero_acta
+    return {
+        'pdf': pdf,
+        'numero_acta': str(numero_acta),
+        'filename': f"Acta_N°{numero_acta}.pdf"  # Mantener el nombre del archivo consistente
+    }
+
+
+def lineas_acta(numero_acta):
+    """Líneas del acta con los datos que se imprimen, en el orden del PDF."""
+    return list(
+        ActaEntrega.objects.filter(numero_acta=numero_acta)
+        .select_related('producto', 'responsable', 'generador')
+        .order_by('id')
+    )
+
+
+def huella_acta(actas):
+    """Hash del contenido impreso del acta (encabezado, líneas y versión del formato)."""
+    acta = actas[0]
+    contenido = [
+        VERSION_FORMATO, acta.numero_acta, acta.fecha.isoformat(), acta.departamento,
+        acta.responsable.nombre if acta.responsable else None,
+        acta.generador.nombre if acta.generador else None,
+        [
+            [item.producto.codigo_barra, item.producto.descripcion, item.numero_siscom, item.cantidad, item.observacion]
+            for item in actas
+        ],
+    ]
+    return hashlib.sha256(json.dumps(contenido, ensure_ascii=False).encode('utf-8')).hexdigest()[:32]
+
+
+def directorio_actas():
+    directorio = settings.ACTAS_PDF_DIR
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def ruta_pdf_acta(numero_acta, huella):
+    """Ruta en la caché del PDF del acta con esa huella (exista o no el archivo)."""
+    return os.path.join(directorio_actas(), f"acta_{numero_acta}", f"{huella}.pdf")
+
+
+def guardar_pdf(numero_acta, ruta, contenido):
+    """
+    Escribe el PDF en forma atómica y elimina las versiones anteriores del mismo
+    acta. Cada acta tiene su carpeta, por lo que la limpieza sólo recorre sus
+    propios archivos y no toda la caché.
+    """
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+    for nombre in os.listdir(directorio):
+        if nombre.endswith('.pdf') and os.path.join(directorio, nombre) != ruta:
+            try:
+                os.remove(os.path.join(directorio, nombre))
+            except FileNotFoundError:
+                pass
+
+
+def obtener_pdf_acta(numero_acta, actas=None):
+    """
+    PDF del acta desde la caché en disco, generándolo si su contenido cambió.
+    Devuelve None si el acta no existe, {'error': ...} si falla la generación o
+    un diccionario con la ruta del archivo, la huella (ETag) y el nombre de descarga.
+    """
+    actas = actas if actas is not None else lineas_acta(numero_acta)
+    if not actas:
+        return None
+    huella = huella_acta(actas)
+    ruta = ruta_pdf_acta(numero_acta, huella)
+    if not os.path.exists(ruta):
+        resultado = generar_pdf_acta(actas)
+        if 'error' in resultado:
+            return resultado
+        guardar_pdf(numero_acta, ruta, resultado['pdf'])
+    return {
+        'ruta': ruta,
+        'huella': huella,
+        'numero_acta': str(numero_acta),
+        'filename': f"Acta_N°{numero_acta}.pdf",
+    }
@@ -1,12 +1,14 @@
 from django.contrib import admin
-from .models import Producto, Transaccion, ActaEntrega, Funcionario, Categoria, LoteProducto
+from django.shortcuts import redirect
+from .models import Producto, Transaccion, EncabezadoActa, ActaEntrega, Funcionario, Categoria, LoteProducto, Trabajo, AsignacionLote, Secuencia, RecepcionStock, CierreStock
+from .trabajos import TIPO_ARCHIVO_ACTAS, encolar_trabajo
 
 # Personalizar la vista de Producto en el panel de administración
 class ProductoAdmin(admin.ModelAdmin):
     # Define los campos que se mostrarán en la lista de productos en el panel de administración
-    list_display = ('codigo_barra', 'descripcion', 'stock', 'categoria', 'rut_proveedor', 'guia_despacho', 'numero_factura', 'orden_compra')
-    # Agrega un filtro lateral para la categoría, permitiendo filtrar productos por este campo
-    list_filter = ('categoria',)  # Eliminamos 'fecha_ingreso' porque no existe
+    list_display = ('codigo_barra', 'descripcion', 'stock', 'categoria', 'estado_vencimiento', 'proximo_vencimiento', 'rut_proveedor', 'guia_despacho', 'numero_factura', 'orden_compra')
+    # Agrega filtros laterales por categoría y estado de vencimiento
+    list_filter = ('categoria', 'estado_vencimiento')  # Eliminamos 'fecha_ingreso' porque no existe
     # Habilita la búsqueda por código de barras y descripción del producto
     search_fields = ('codigo_barra', 'descripcion')
     # Establece el orden por defecto de los productos según el código de barras
@@ -22,8 +24,53 @@ class TransaccionAdmin(admin.ModelAdmin):
     search_fields = ('producto__descripcion', 'producto__codigo_barra')
     # Ordena las transacciones por fecha en orden descendente (más recientes primero)
     ordering = ('-fecha',)
+    # El saldo lo calcula el sistema (se recalcula al editar o eliminar una transacción)
+    readonly_fields = ('saldo',)
 
-# Personalizar la vista de ActaEntrega
+# Líneas (productos) de un acta, dentro del acta
+class ActaEntregaInline(admin.TabularInline):
+    model = ActaEntrega
+    # Sólo los datos propios de cada línea; el resto está en el encabezado
+    fields = ('producto', 'cantidad', 'numero_siscom', 'observacion')
+    # Las líneas se muestran como registro: cantidad y producto ya se descontaron del stock y del bincard
+    readonly_fields = fields
+    extra = 0
+    # No se agregan ni se eliminan líneas desde aquí (no pasarían por el registro de la salida)
+    max_num = 0
+    can_delete = False
+
+# Personalizar la vista de EncabezadoActa (una fila por acta)
+class EncabezadoActaAdmin(admin.ModelAdmin):
+    # Define los campos que se mostrarán en la lista de actas
+    list_display = ('numero_acta', 'fecha', 'departamento', 'responsable', 'generador')
+    # Permite filtrar actas por departamento y fecha
+    list_filter = ('departamento', 'fecha')
+    # Habilita la búsqueda por número de acta, departamento y responsable
+    search_fields = ('numero_acta', 'departamento', 'responsable__nombre')
+    # Evita una consulta por fila para el responsable y el generador
+    list_select_related = ('responsable', 'generador')
+    # Los datos del encabezado están copiados en cada línea: no se editan aquí para que no se desalineen
+    readonly_fields = ('numero_acta', 'fecha', 'departamento', 'responsable')
+    # Muestra los productos entregados en el acta
+    inlines = (ActaEntregaInline,)
+    # Archivo de las actas seleccionadas (p. ej. todas las de un filtro por fecha), generado en segundo plano
+    actions = ('archivar_actas_zip', 'archivar_actas_pdf')
+
+    def _archivar_actas(self, request, queryset, formato):
+        numeros = list(queryset.order_by('numero_acta').values_list('numero_acta', flat=True))
+        trabajo = encolar_trabajo(TIPO_ARCHIVO_ACTAS, formato, {'numeros': numeros}, request.user)
+        self.message_user(request, f"Se está generando el archivo de {len(numeros)} actas.")
+        return redirect('estado-trabajo', pk=trabajo.pk)
+
+    @admin.action(description="Descargar actas seleccionadas (ZIP, un PDF por acta)")
+    def archivar_actas_zip(self, request, queryset):
+        return self._archivar_actas(request, queryset, 'zip')
+
+    @admin.action(description="Descargar actas seleccionadas (un solo PDF)")
+    def archivar_actas_pdf(self, request, queryset):
+        return self._archivar_actas(request, queryset, 'pdf')
+
+# Personalizar la vista de ActaEntrega (líneas de acta)
 class ActaEntregaAdmin(admin.ModelAdmin):
     # Define los campos que se mostrarán en la lista de actas de entrega, usando 'responsable' y 'fecha' para consistencia
     list_display = ('numero_acta', 'producto', 'departamento', 'responsable', 'fecha', 'generador')
@@ -111,10 +158,66 @@ class LoteProductoAdmin(admin.ModelAdmin):
     get_dias_para_vencer.short_description = 'Días para Vencer'
     get_dias_para_vencer.allow_tags = True
 
+# Personalizar la vista de Trabajo (exportaciones en segundo plano)
+class TrabajoAdmin(admin.ModelAdmin):
+    # Define los campos que se mostrarán en la lista de trabajos
+    list_display = ('id', 'tipo', 'formato', 'estado', 'progreso', 'total', 'usuario', 'creado', 'finalizado')
+    # Permite filtrar trabajos por estado y tipo
+    list_filter = ('estado', 'tipo', 'formato')
+    # Ordena los trabajos del más reciente al más antiguo
+    ordering = ('-creado',)
+    # Los trabajos los crea y actualiza el sistema
+    readonly_fields = ('progreso', 'total', 'archivo', 'nombre_archivo', 'error', 'creado', 'iniciado', 'finalizado')
+
+# Personalizar la vista de AsignacionLote (trazabilidad de lotes entregados)
+class AsignacionLoteAdmin(admin.ModelAdmin):
+    # Define los campos que se mostrarán en la lista de asignaciones
+    list_display = ('acta', 'producto', 'numero_lote', 'fecha_vencimiento', 'cantidad')
+    # Habilita la búsqueda por código de barras del producto, número de lote y número de acta
+    search_fields = ('producto__codigo_barra', 'producto__descripcion', 'numero_lote', 'acta__numero_acta')
+    # Evita cargar todos los productos, lotes y actas en los selectores
+    raw_id_fields = ('acta', 'lote', 'producto')
+    list_select_related = ('acta', 'producto')
+
+# Personalizar la vista de RecepcionStock (entregas de proveedor)
+class RecepcionStockAdmin(admin.ModelAdmin):
+    # Define los campos que se mostrarán en la lista de recepciones
+    list_display = ('numero', 'fecha', 'rut_proveedor', 'guia_despacho', 'numero_factura', 'orden_compra', 'usuario')
+    # Habilita la búsqueda por número, proveedor y documentos
+    search_fields = ('numero', 'rut_proveedor', 'guia_despacho', 'numero_factura', 'orden_compra')
+    # Ordena las recepciones de la más reciente a la más antigua
+    ordering = ('-numero',)
+
+# Personalizar la vista de CierreStock (saldos al cierre de cada mes)
+class CierreStockAdmin(admin.ModelAdmin):
+    # Define los campos que se mostrarán en la lista de cierres
+    list_display = ('fecha', 'producto', 'saldo', 'entradas', 'salidas')
+    # Filtra los cierres por mes
+    list_filter = ('fecha',)
+    # Habilita la búsqueda por código y descripción del producto
+    search_fields = ('producto__codigo_barra', 'producto__descripcion')
+    # Evita cargar la lista completa de productos en el formulario
+    raw_id_fields = ('producto',)
+
+# Personalizar la vista de Secuencia (numeraciones correlativas)
+class SecuenciaAdmin(admin.ModelAdmin):
+    # Define los campos que se mostrarán en la lista de secuencias
+    list_display = ('nombre', 'ultimo')
+    # Habilita la búsqueda por nombre de la secuencia
+    search_fields = ('nombre',)
+    # Los valores los asigna el sistema; sólo se consultan
+    readonly_fields = ('nombre', 'ultimo')
+
 # Registrar los modelos con sus configuraciones personalizadas en el panel de administración de Django
 admin.site.register(Producto, ProductoAdmin)
 admin.site.register(Transaccion, TransaccionAdmin)
+admin.site.register(EncabezadoActa, EncabezadoActaAdmin)
 admin.site.register(ActaEntrega, ActaEntregaAdmin)
 admin.site.register(Funcionario, FuncionarioAdmin)
 admin.site.register(Categoria, CategoriaAdmin)
-admin.site.register(LoteProducto, LoteProductoAdmin)
\ No newline at end of file
+admin.site.register(LoteProducto, LoteProductoAdmin)
+admin.site.register(Trabajo, TrabajoAdmin)
+admin.site.register(AsignacionLote, AsignacionLoteAdmin)
+admin.site.register(Secuencia, SecuenciaAdmin)
+admin.site.register(RecepcionStock, RecepcionStockAdmin)
+admin.site.register(CierreStock, CierreStockAdmin)
@@ -0,0 +1,145 @@
+"""Archivo de actas para auditorías: todas las actas de un período en un ZIP o en un solo PDF.
+
+ZIP: las actas se generan en paralelo con un ``ProcessPoolExecutor`` (un
+proceso por núcleo, cada uno con su ``RENDERER_ACTAS``). El proceso principal
+lee las líneas de la base por bloques, envía a los procesos sólo las actas
+cuyo PDF no está en la caché de ``actas_pdf`` y guarda cada resultado en esa
+caché apenas llega. Un archivo interrumpido se retoma simplemente volviendo a
+ejecutarlo: las actas ya generadas (con la misma huella) no se repiten. Al
+final el ZIP se arma leyendo los PDF desde el disco y se publica con un
+reemplazo atómico.
+
+PDF único: sin una biblioteca para unir PDF, el documento combinado se maqueta
+en un solo proceso con el mismo renderer (una página nueva por acta).
+"""
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from itertools import groupby
+
+import django
+
+from .actas_pdf import RENDERER_ACTAS, guardar_pdf, huella_acta, ruta_pdf_acta
+from .cierres import fin_del_dia
+from .models import ActaEntrega, EncabezadoActa
+
+FORMATOS_ARCHIVO = ('zip', 'pdf')
+
+# Actas cuyas líneas se leen por consulta
+TAMANO_BLOQUE = 200
+
+
+def numeros_actas(desde=None, hasta=None):
+    """Números de las actas con fecha entre `desde` y `hasta` (días, inclusive), en orden."""
+    actas = EncabezadoActa.objects.all()
+    if desde:
+        actas = actas.filter(fecha__gte=fin_del_dia(desde - timedelta(days=1)))
+    if hasta:
+        actas = actas.filter(fecha__lt=fin_del_dia(hasta))
+    return list(actas.order_by('numero_acta').values_list('numero_acta', flat=True))
+
+
+def lineas_por_acta(numeros):
+    """Genera (numero_acta, líneas) en el orden de `numeros`, leyendo las líneas por bloques."""
+    for inicio in range(0, len(numeros), TAMANO_BLOQUE):
+        bloque = numeros[inicio:inicio + TAMANO_BLOQUE]
+        lineas = (
+            ActaEntrega.objects.filter(numero_acta__in=bloque)
+            .select_related('producto', 'responsable', 'generador')
+            .order_by('numero_acta', 'id')
+        )
+        por_numero = {numero: list(grupo) for numero, grupo in groupby(lineas, key=lambda linea: linea.numero_acta)}
+        for numero in bloque:
+            if por_numero.get(numero):
+                yield numero, por_numero[numero]
+
+
+def _renderizar_acta(numero_acta, actas):
+    """Tarea de cada proceso: sólo genera el PDF, sin acceder a la base de datos."""
+    return numero_acta, RENDERER_ACTAS.renderizar(actas)
+
+
+def _generar_pdfs(numeros, procesos=None, progreso=None):
+    """
+    Asegura el PDF en caché de cada acta y devuelve {numero_acta: ruta}.
+    `progreso(terminadas, total)` se llama con cada acta lista.
+    """
+    rutas = {}
+    total = len(numeros)
+
+    def terminada():
+        if progreso:
+            progreso(len(rutas), total)
+
+    procesos = procesos or os.cpu_count() or 1
+    # initializer: con 'spawn' (Windows, macOS) cada proceso debe cargar Django para recibir los modelos
+    with ProcessPoolExecutor(max_workers=procesos, initializer=django.setup) as ejecutor:
+        pendientes = {}
+
+        def recoger(condicion):
+            listas, _ = wait(pendientes, return_when=condicion)
+            for futuro in listas:
+                ruta = pendientes.pop(futuro)
+                numero_acta, pdf = futuro.result()
+                guardar_pdf(numero_acta, ruta, pdf)
+                rutas[numero_acta] = ruta
+                terminada()
+
+        for numero_acta, actas in lineas_por_acta(numeros):
+            ruta = ruta_pdf_acta(numero_acta, huella_acta(actas))
+            if os.path.exists(ruta):
+                rutas[numero_acta] = ruta
+                terminada()
+                continue
+            pendientes[ejecutor.submit(_renderizar_acta, numero_acta, actas)] = ruta
+            # Se limita lo que espera en la cola para no cargar todo el período en memoria
+            if len(pendientes) >= procesos * 4:
+                recoger(FIRST_COMPLETED)
+        if pendientes:
+            recoger(ALL_COMPLETED)
+    return rutas
+
+
+def _publicar(destino, escribir):
+    """Escribe el archivo en un temporal junto a `destino` y lo reemplaza en forma atómica."""
+    directorio = os.path.dirname(os.path.abspath(destino))
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            escribir(archivo)
+        os.replace(temporal, destino)
+    except BaseException:
+        os.remove(temporal)
+        raise
+
+
+def generar_archivo_actas(numeros, destino, formato='zip', procesos=None, progreso=None):
+    """
+    Genera en `destino` el archivo de las actas `numeros`: un ZIP con un PDF
+    por acta o un único PDF. Devuelve la cantidad de actas incluidas.
+    """
+    if formato not in FORMATOS_ARCHIVO:
+        raise ValueError(f"Formato de archivo no válido: {formato}")
+    numeros = list(numeros)
+
+    if formato == 'pdf':
+        def escribir_pdf(archivo):
+            grupos = (actas for _, actas in lineas_por_acta(numeros))
+            avance = (lambda terminadas: progreso(terminadas, len(numeros))) if progreso else None
+            RENDERER_ACTAS.renderizar_varias(grupos, archivo, titulo="Archivo de actas de entrega", progreso=avance)
+        _publicar(destino, escribir_pdf)
+        return len(numeros)
+
+    rutas = _generar_pdfs(numeros, procesos=procesos, progreso=progreso)
+
+    def escribir_zip(archivo):
+        # Los PDF ya vienen comprimidos: se guardan sin volver a comprimir
+        with zipfile.ZipFile(archivo, 'w', compression=zipfile.ZIP_STORED) as contenedor:
+            for numero_acta in numeros:
+                if numero_acta in rutas:
+                    contenedor.write(rutas[numero_acta], f"Acta_N°{numero_acta}.pdf")
+    _publicar(destino, escribir_zip)
+    return len(rutas)
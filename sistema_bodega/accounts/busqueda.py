@@ -0,0 +1,157 @@
+"""Búsqueda de productos por texto con el índice de texto completo (FTS5) de SQLite.
+
+La tabla virtual ``accounts_producto_fts`` (migración 0017) guarda por
+producto su código, descripción y categoría, tokenizados sin mayúsculas ni
+tildes (``unicode61 remove_diacritics 2``). Triggers en la base la mantienen
+al día ante cualquier escritura, incluidas ``bulk_create``/``bulk_update`` y
+el cambio de nombre de una categoría.
+
+Cada palabra buscada se compara por prefijo ("algod" encuentra "Algodón") y
+se le quita el plural ("jeringas" encuentra "jeringa"). Los resultados se
+ordenan por relevancia BM25, con el código con más peso que la descripción y
+ésta más que la categoría. Todas las vistas buscan con ``buscar_productos``.
+
+El autocompletado (``INDICE_AUTOCOMPLETADO``) no consulta la base en cada
+tecla: cada proceso guarda los códigos y descripciones en listas ordenadas y
+responde por prefijo con ``bisect``. Las listas se recargan cuando cambia la
+versión del catálogo (productos nuevos, eliminados o renombrados; no los
+movimientos de stock).
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .cache_inventario import obtener_version_catalogo
+from .models import Producto
+
+TABLA_FTS = 'accounts_producto_fts'
+
+# Pesos BM25 de las columnas del índice: código, descripción y categoría
+PESOS_BM25 = (10.0, 5.0, 1.0)
+
+# Palabras que no restringen la búsqueda ("jeringa de 5 ml" encuentra "Jeringa 5 ml")
+PALABRAS_VACIAS = {'a', 'con', 'de', 'del', 'e', 'el', 'en', 'la', 'las', 'los', 'o', 'para', 'por', 'sin', 'u', 'un', 'una', 'y'}
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes, igual que el tokenizador del índice."""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(caracter for caracter in descompuesto if not unicodedata.combining(caracter))
+
+
+def raiz(termino):
+    """Quita el plural: jeringas -> jeringa, algodones -> algodon."""
+    if len(termino) > 4 and termino.endswith('es'):
+        return termino[:-2]
+    if len(termino) > 3 and termino.endswith('s'):
+        return termino[:-1]
+    return termino
+
+
+def expresion_fts(texto):
+    """Consulta MATCH con todas las palabras de `texto` por prefijo, o '' si no hay palabras."""
+    # Sólo letras y dígitos: las comillas y operadores de FTS5 nunca llegan a la consulta
+    palabras = re.findall(r'\w+', normalizar(texto))
+    terminos = [raiz(palabra) for palabra in palabras if palabra not in PALABRAS_VACIAS] or palabras
+    return ' '.join(f'"{termino}"*' for termino in terminos)
+
+
+def buscar_productos(productos, texto, ordenar_por_relevancia=True):
+    """
+    Filtra el queryset de productos por `texto` (código, descripción o
+    categoría). Con `ordenar_por_relevancia` los ordena por BM25; si no,
+    conserva el orden del queryset.
+    """
+    consulta = expresion_fts(texto or '')
+    if not consulta:
+        return productos
+
+    if connection.vendor != 'sqlite':
+        # Otros motores no tienen el índice FTS5: misma búsqueda por palabras, sin ranking
+        filtro = Q()
+        for termino in re.findall(r'\w+', texto):
+            filtro &= (Q(codigo_barra__icontains=termino) | Q(descripcion__icontains=termino)
+                       | Q(categoria__nombre__icontains=termino))
+        return productos.filter(filtro)
+
+    if not ordenar_por_relevancia:
+        return productos.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s', [consulta])
+        )
+    pesos = ', '.join(str(peso) for peso in PESOS_BM25)
+    tabla_productos = productos.model._meta.db_table
+    # Join con el índice: bm25() sólo se puede calcular en la consulta que hace el MATCH
+    # (una subconsulta correlacionada por fila repetía la búsqueda y era cientos de veces más lenta)
+    productos = productos.extra(
+        tables=[TABLA_FTS],
+        where=[f'{TABLA_FTS}.rowid = {tabla_productos}.id', f'{TABLA_FTS} MATCH %s'],
+        params=[consulta],
+        select={'relevancia': f'bm25({TABLA_FTS}, {pesos})'},
+    )
+    # bm25 es más negativo cuanto más relevante
+    return productos.order_by('relevancia', 'descripcion', 'id')
+
+
+class IndiceAutocompletado:
+    """
+    Códigos de barra y descripciones de todos los productos, ordenados, en la
+    memoria del proceso. Un término se busca por prefijo del código y, si no
+    completa el límite, por prefijo de la descripción (sin mayúsculas ni tildes).
+    """
+
+    def __init__(self):
+        # (versión del catálogo, claves por código, filas por código, claves por descripción, filas por descripción)
+        self._datos = (None, [], [], [], [])
+        self._normalizadas = {}
+        self._bloqueo = threading.Lock()
+
+    def _cargar(self, version):
+        # Se ordena en Python: bisect necesita el mismo orden que la comparación de str, no la collation de la base
+        productos = sorted(Producto.objects.values_list('codigo_barra', 'descripcion'))
+        # Normalizar es lo más caro de la carga: se reutilizan las descripciones ya vistas
+        normalizadas = {descripcion: self._normalizadas.get(descripcion) or normalizar(descripcion)
+                        for _, descripcion in productos}
+        por_descripcion = sorted((normalizadas[descripcion], codigo, descripcion) for codigo, descripcion in productos)
+        self._datos = (
+            version,
+            [codigo for codigo, _ in productos], productos,
+            [clave for clave, _, _ in por_descripcion], [(codigo, descripcion) for _, codigo, descripcion in por_descripcion],
+        )
+        self._normalizadas = normalizadas
+
+    def _vigentes(self):
+        """Las listas de la versión actual del catálogo, recargándolas si quedaron obsoletas."""
+        version = obtener_version_catalogo()
+        if self._datos[0] != version:
+            # Un solo hilo recarga; los demás esperan y usan las listas nuevas
+            with self._bloqueo:
+                if self._datos[0] != version:
+                    self._cargar(version)
+        return self._datos
+
+    @staticmethod
+    def _con_prefijo(claves, filas, prefijo, limite):
+        inicio = bisect_left(claves, prefijo)
+        fin = inicio
+        while fin < len(claves) and fin - inicio < limite and claves[fin].startswith(prefijo):
+            fin += 1
+        return filas[inicio:fin]
+
+    def sugerencias(self, termino, limite=10):
+        """Hasta `limite` pares (codigo_barra, descripcion): primero por código, luego por descripción."""
+        _, claves_codigo, por_codigo, claves_descripcion, por_descripcion = self._vigentes()
+        encontrados = self._con_prefijo(claves_codigo, por_codigo, termino, limite)
+        if len(encontrados) < limite:
+            vistos = {codigo for codigo, _ in encontrados}
+            for codigo, descripcion in self._con_prefijo(claves_descripcion, por_descripcion, normalizar(termino), limite):
+                if codigo not in vistos and len(encontrados) < limite:
+                    encontrados.append((codigo, descripcion))
+        return encontrados
+
+
+INDICE_AUTOCOMPLETADO = IndiceAutocompletado()
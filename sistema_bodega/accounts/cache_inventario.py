@@ -0,0 +1,60 @@
+"""Versión global del inventario almacenada en el caché compartido.
+
+Cada movimiento de stock (transacciones, lotes o productos) reemplaza la
+versión por un valor nuevo. Las entradas de caché que dependen del
+inventario incluyen la versión en su clave, por lo que quedan obsoletas
+sin necesidad de borrarlas una por una.
+
+El catálogo (códigos de barra y descripciones) tiene su propia versión, que
+sólo cambia al crear, eliminar o renombrar productos: lo que depende sólo del
+catálogo, como el autocompletado, no se invalida con cada movimiento de stock.
+"""
+import time
+from datetime import datetime, time as dt_time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+CLAVE_VERSION_INVENTARIO = 'inventario:version'
+CLAVE_VERSION_CATALOGO = 'catalogo:version'
+
+
+def _obtener_version(clave):
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, time.time_ns(), None)
+        version = cache.get(clave)
+    return version
+
+
+def obtener_version_inventario():
+    """Obtiene la versión actual del inventario, inicializándola si no existe."""
+    return _obtener_version(CLAVE_VERSION_INVENTARIO)
+
+
+def obtener_version_catalogo():
+    """Obtiene la versión actual del catálogo de productos, inicializándola si no existe."""
+    return _obtener_version(CLAVE_VERSION_CATALOGO)
+
+
+def _reemplazar_version(clave=CLAVE_VERSION_INVENTARIO):
+    # Un valor único (y no un incremento) evita perder invalidaciones entre procesos
+    cache.set(clave, time.time_ns(), None)
+
+
+def incrementar_version_inventario():
+    """Invalida las entradas versionadas una vez confirmada la transacción en curso."""
+    transaction.on_commit(_reemplazar_version)
+
+
+def incrementar_version_catalogo():
+    """Invalida lo que depende del catálogo (y no del stock) al confirmar la transacción en curso."""
+    transaction.on_commit(lambda: _reemplazar_version(CLAVE_VERSION_CATALOGO))
+
+
+def segundos_hasta_medianoche():
+    """Segundos que faltan para la medianoche local (TIME_ZONE del proyecto)."""
+    ahora = timezone.localtime()
+    medianoche = timezone.make_aware(datetime.combine(ahora.date() + timedelta(days=1), dt_time.min))
+    return max(1, int((medianoche - ahora).total_seconds()))
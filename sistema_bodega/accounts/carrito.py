@@ -0,0 +1,256 @@
+"""Carrito de salida: productos elegidos por un usuario antes de generar el acta.
+
+Cada usuario tiene sus líneas en ``LineaCarritoSalida``. Agregar, quitar o
+editar un producto es una operación sobre su propia fila, en lugar de leer y
+volver a escribir la lista completa en la sesión. El stock no se copia en el
+carrito: se lee junto con las líneas, por lo que la validación de todas ellas
+antes de continuar es una sola consulta.
+
+Las lecturas del escáner llegan en ráfagas: ``agregar_escaneos`` recibe un
+lote de códigos, los busca con una sola consulta y agrega o suma las líneas
+con ``bulk_create``/``bulk_update``. Cada lote trae un identificador generado
+por la pantalla: si un reenvío (tras un error de red) repite un lote ya
+aplicado, se devuelve el resultado guardado en lugar de sumarlo otra vez; si
+el original aún se está aplicando, se lanza ``LoteEnProceso`` para que la
+pantalla lo reenvíe más tarde.
+
+Al generar el acta, ``tomar_carrito`` lee y borra las líneas dentro de la
+transacción de la salida. Un segundo envío del mismo formulario encuentra el
+carrito vacío, sin necesidad de una marca en la sesión.
+"""
+import json
+import re
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .models import LineaCarritoSalida, Producto
+
+# Lecturas aceptadas en una solicitud del modo escáner (la pantalla envía lotes más chicos)
+MAX_ESCANEOS_POR_LOTE = 100
+
+# Segundos que se recuerda un lote del escáner ya aplicado, para ignorar sus reenvíos
+TIEMPO_LOTE_ESCANEOS = 60 * 60
+LOTE_EN_PROCESO = 'en proceso'
+
+
+class LoteEnProceso(Exception):
+    """Otra solicitud está aplicando el mismo lote del escáner; aún no se sabe si se confirmará."""
+
+
+def _como_diccionario(linea):
+    """Línea en el formato que usan las plantillas y ``registrar_salida``."""
+    return {
+        'codigo_barra': linea.producto.codigo_barra,
+        'descripcion': linea.producto.descripcion,
+        'stock': linea.producto.stock,
+        'numero_siscom': linea.numero_siscom,
+        'cantidad': '' if linea.cantidad is None else linea.cantidad,
+        'observacion': linea.observacion,
+    }
+
+
+def lineas_carrito(usuario):
+    """Líneas del carrito del usuario con el stock actual de cada producto (una consulta)."""
+    lineas = LineaCarritoSalida.objects.filter(usuario=usuario).select_related('producto')
+    return [_como_diccionario(linea) for linea in lineas]
+
+
+def agregar_al_carrito(usuario, producto):
+    """Agrega el producto al carrito. Lanza ValidationError si ya está o no tiene stock."""
+    if producto.stock == 0:
+        raise ValidationError('No se puede retirar este producto porque no tiene stock.')
+    try:
+        with transaction.atomic():
+            LineaCarritoSalida.objects.create(usuario=usuario, producto=producto)
+    except IntegrityError:
+        raise ValidationError('Este producto ya está en la lista de salida.')
+
+
+def quitar_del_carrito(usuario, codigo_barra):
+    """Quita el producto del carrito (sin error si no estaba)."""
+    LineaCarritoSalida.objects.filter(usuario=usuario, producto__codigo_barra=codigo_barra).delete()
+
+
+def actualizar_linea_carrito(usuario, codigo_barra, numero_siscom, cantidad, observacion):
+    """
+    Guarda los datos de una línea. `cantidad` puede venir vacía mientras se
+    escribe; si no, debe ser un entero positivo que no supere el stock.
+    Lanza ValidationError si algún dato no es válido o el producto no está en el carrito.
+    """
+    try:
+        linea = LineaCarritoSalida.objects.select_related('producto').get(
+            usuario=usuario, producto__codigo_barra=codigo_barra
+        )
+    except LineaCarritoSalida.DoesNotExist:
+        raise ValidationError(f'No se encontró el producto {codigo_barra} en la lista de salida.')
+
+    if numero_siscom and not numero_siscom.isdigit():
+        raise ValidationError(f'El Número de SISCOM para el producto {codigo_barra} debe ser un número entero.')
+    if cantidad:
+        if not cantidad.isdigit():
+            raise ValidationError(f'La cantidad para el producto {codigo_barra} debe ser un número entero.')
+        if int(cantidad) <= 0:
+            raise ValidationError(f'La cantidad para el producto {codigo_barra} debe ser mayor que 0.')
+        if int(cantidad) > linea.producto.stock:
+            raise ValidationError(
+                f'La cantidad para el producto {codigo_barra} no puede superar el stock ({linea.producto.stock}).'
+            )
+
+    linea.numero_siscom = numero_siscom
+    linea.cantidad = int(cantidad) if cantidad else None
+    linea.observacion = observacion
+    linea.save(update_fields=['numero_siscom', 'cantidad', 'observacion'])
+
+
+def interpretar_escaneos(texto):
+    """
+    Lista de (codigo_barra, cantidad) a partir del JSON enviado por la pantalla:
+    [{"codigo_barra": "...", "cantidad": 3}, ...]; la cantidad es opcional.
+    Lanza ValidationError si el contenido no tiene ese formato.
+    """
+    try:
+        lecturas = json.loads(texto)
+    except ValueError:
+        raise ValidationError('Las lecturas del escáner no tienen un formato válido.')
+    if not isinstance(lecturas, list) or not lecturas:
+        raise ValidationError('No se recibieron lecturas del escáner.')
+    if len(lecturas) > MAX_ESCANEOS_POR_LOTE:
+        raise ValidationError(f'Se pueden enviar hasta {MAX_ESCANEOS_POR_LOTE} lecturas por vez.')
+
+    escaneos = []
+    for lectura in lecturas:
+        codigo = str(lectura.get('codigo_barra', '')).strip() if isinstance(lectura, dict) else ''
+        cantidad = lectura.get('cantidad') if isinstance(lectura, dict) else None
+        if not codigo:
+            raise ValidationError('Hay una lectura del escáner sin código de barra.')
+        if cantidad in (None, ''):
+            cantidad = None
+        elif not str(cantidad).isdigit() or int(cantidad) <= 0:
+            raise ValidationError(f'La cantidad para el producto {codigo} debe ser un número entero mayor que 0.')
+        escaneos.append((codigo, int(cantidad) if cantidad else None))
+    return escaneos
+
+
+def agregar_escaneos(usuario, escaneos, lote=None):
+    """
+    Agrega al carrito un lote de lecturas (codigo_barra, cantidad o None). Cada
+    lectura sin cantidad es una unidad y los códigos repetidos se suman, también
+    a la cantidad que ya tenía la línea. Devuelve por código un diccionario con
+    'success' y la 'cantidad' resultante o el 'error'; los demás códigos del
+    lote se agregan aunque alguno falle.
+
+    `lote` identifica el envío: un lote ya aplicado devuelve el resultado de
+    entonces sin volver a sumar. Si otra solicitud lo está aplicando lanza
+    LoteEnProceso: el original todavía puede fallar, y entonces el reenvío
+    es el que debe aplicarlo.
+    """
+    if lote is None:
+        return _agregar_escaneos(usuario, escaneos)
+    if not re.fullmatch(r'[\w-]{1,64}', lote):
+        raise ValidationError('El identificador del lote de lecturas no es válido.')
+    clave = f'escaneos:{usuario.pk}:{lote}'
+    if not cache.add(clave, LOTE_EN_PROCESO, TIEMPO_LOTE_ESCANEOS):
+        anterior = cache.get(clave)
+        if anterior in (None, LOTE_EN_PROCESO):
+            raise LoteEnProceso(lote)
+        return anterior
+    try:
+        resultados = _agregar_escaneos(usuario, escaneos)
+    except Exception:
+        # No se aplicó: un reenvío debe procesarse
+        cache.delete(clave)
+        raise
+    cache.set(clave, resultados, TIEMPO_LOTE_ESCANEOS)
+    return resultados
+
+
+def _agregar_escaneos(usuario, escaneos):
+    cantidades = {}
+    for codigo, cantidad in escaneos:
+        cantidades[codigo] = cantidades.get(codigo, 0) + (cantidad or 1)
+
+    resultados = {}
+    with transaction.atomic():
+        productos = Producto.objects.in_bulk(list(cantidades), field_name='codigo_barra')
+        lineas = {
+            linea.producto_id: linea
+            for linea in LineaCarritoSalida.objects.select_for_update().filter(
+                usuario=usuario, producto__in=[producto.pk for producto in productos.values()]
+            )
+        }
+        nuevas, modificadas = [], []
+        for codigo, cantidad in cantidades.items():
+            producto = productos.get(codigo)
+            if producto is None:
+                resultados[codigo] = {'success': False, 'error': 'Producto no encontrado.'}
+                continue
+            linea = lineas.get(producto.pk)
+            total = cantidad + ((linea.cantidad or 0) if linea else 0)
+            if producto.stock == 0:
+                resultados[codigo] = {'success': False, 'error': 'No se puede retirar este producto porque no tiene stock.'}
+                continue
+            if total > producto.stock:
+                resultados[codigo] = {
+                    'success': False,
+                    'error': f'La cantidad para el producto {codigo} ({total}) no puede superar el stock ({producto.stock}).'
+                }
+                continue
+            if linea:
+                linea.cantidad = total
+                modificadas.append(linea)
+            else:
+                nuevas.append(LineaCarritoSalida(usuario=usuario, producto=producto, cantidad=total))
+            resultados[codigo] = {'success': True, 'cantidad': total}
+
+        LineaCarritoSalida.objects.bulk_create(nuevas)
+        LineaCarritoSalida.objects.bulk_update(modificadas, ['cantidad'])
+    return resultados
+
+
+def validar_carrito(lineas):
+    """
+    Revisa que las líneas (de ``lineas_carrito``, con el stock ya leído) estén
+    completas y no superen el stock. Lanza ValidationError con el primer problema.
+    """
+    if not lineas:
+        raise ValidationError('Debes agregar al menos un producto para continuar.')
+    for linea in lineas:
+        codigo = linea['codigo_barra']
+        if not linea['numero_siscom']:
+            raise ValidationError(f"El Número de SISCOM para el producto {codigo} no puede estar vacío.")
+        if linea['cantidad'] == '':
+            raise ValidationError(f"La cantidad para el producto {codigo} no puede estar vacía.")
+        if linea['cantidad'] > linea['stock']:
+            raise ValidationError(
+                f"La cantidad a retirar ({linea['cantidad']}) para el producto {codigo} "
+                f"no puede superar el stock actual ({linea['stock']})."
+            )
+
+
+def tomar_carrito(usuario):
+    """
+    Lee y vacía el carrito del usuario; debe llamarse dentro de la transacción
+    que registra la salida, para que el carrito sólo se vacíe si la salida se
+    confirma. Lanza ValidationError si otra solicitud ya lo tomó.
+    """
+    lineas = list(LineaCarritoSalida.objects.select_for_update().filter(usuario=usuario).select_related('producto'))
+    if not lineas:
+        raise ValidationError('No hay productos seleccionados para la salida.')
+    borradas, _ = LineaCarritoSalida.objects.filter(pk__in=[linea.pk for linea in lineas]).delete()
+    if borradas != len(lineas):
+        # Otro envío del mismo formulario registró la salida mientras tanto
+        raise ValidationError('El acta ya ha sido generada. Por favor, inicia una nueva salida.')
+    return [_como_diccionario(linea) for linea in lineas]
+
+
+def vaciar_carrito(usuario):
+    """
+    Descarta el carrito del usuario. Se llama en cada página fuera de la
+    salida: con el carrito vacío (lo habitual) sólo lee, sin tomar el bloqueo
+    de escritura de la base con un DELETE.
+    """
+    lineas = LineaCarritoSalida.objects.filter(usuario=usuario)
+    if lineas.exists():
+        lineas.delete()
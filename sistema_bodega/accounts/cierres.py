@@ -0,0 +1,123 @@
+"""Cierres mensuales de stock y consulta del stock a una fecha.
+
+El comando ``generar_cierres_stock`` guarda en ``CierreStock`` el saldo de
+cada producto al último día de cada mes completo, en forma incremental: cada
+mes nuevo es el cierre anterior más una consulta agrupada con los movimientos
+del mes. El saldo sigue la misma regla que el bincard (entradas menos salidas
+con acta, ver ``Transaccion.variacion_saldo``).
+
+El stock de todos los productos a cualquier fecha se obtiene en una sola
+consulta: saldo del último cierre anterior a la fecha más los movimientos
+posteriores al cierre, ambos como subconsultas por producto sobre índices.
+Sin cierres, la misma consulta suma toda la historia.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CierreStock, Producto, Transaccion
+
+TAMANO_LOTE = 500
+
+
+def fin_de_mes(fecha):
+    """Último día del mes de `fecha`."""
+    siguiente = (fecha.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return siguiente - timedelta(days=1)
+
+
+def fin_del_dia(fecha):
+    """Instante en que termina el día `fecha` en la hora local (inicio del día siguiente)."""
+    return timezone.make_aware(datetime.combine(fecha + timedelta(days=1), time.min))
+
+
+def ultimo_mes_completo(hoy=None):
+    """Fecha de cierre del último mes terminado."""
+    return (hoy or timezone.localdate()).replace(day=1) - timedelta(days=1)
+
+
+def invalidar_cierres_desde(fecha):
+    """Elimina los cierres afectados por un cambio en movimientos de `fecha` (se regeneran con el comando)."""
+    return CierreStock.objects.filter(fecha__gte=fin_de_mes(fecha)).delete()[0]
+
+
+def generar_cierres(hasta=None, reconstruir=False):
+    """
+    Genera los cierres de los meses que faltan hasta `hasta` (por defecto y
+    como máximo el último mes completo: el mes en curso aún recibe movimientos).
+    Devuelve la lista de (fecha de cierre, filas guardadas).
+    """
+    hasta = min(fin_de_mes(hasta), ultimo_mes_completo()) if hasta else ultimo_mes_completo()
+    if reconstruir:
+        CierreStock.objects.all().delete()
+
+    ultimo = CierreStock.objects.aggregate(ultimo=Max('fecha'))['ultimo']
+    if ultimo is None:
+        primera = Transaccion.objects.aggregate(primera=Min('fecha'))['primera']
+        if primera is None:
+            return []
+        mes = fin_de_mes(timezone.localtime(primera).date())
+        saldos = {}
+    else:
+        mes = fin_de_mes(ultimo + timedelta(days=1))
+        saldos = dict(CierreStock.objects.filter(fecha=ultimo).values_list('producto_id', 'saldo'))
+
+    generados = []
+    while mes <= hasta:
+        movimientos = Transaccion.objects.filter(fecha__lt=fin_del_dia(mes))
+        if ultimo is not None:
+            movimientos = movimientos.filter(fecha__gte=fin_del_dia(ultimo))
+        del_mes = movimientos.values('producto_id').annotate(
+            entradas=Coalesce(Sum('cantidad', filter=Q(tipo='entrada')), 0),
+            salidas=Coalesce(Sum('cantidad', filter=Q(tipo='salida', acta_entrega__isnull=False)), 0),
+        )
+        cierres = {
+            producto_id: CierreStock(producto_id=producto_id, fecha=mes, saldo=saldo)
+            for producto_id, saldo in saldos.items() if saldo
+        }
+        for fila in del_mes:
+            cierre = cierres.get(fila['producto_id']) or CierreStock(
+                producto_id=fila['producto_id'], fecha=mes, saldo=saldos.get(fila['producto_id'], 0)
+            )
+            cierre.entradas = fila['entradas']
+            cierre.salidas = fila['salidas']
+            cierre.saldo += fila['entradas'] - fila['salidas']
+            cierres[fila['producto_id']] = cierre
+
+        with transaction.atomic():
+            CierreStock.objects.bulk_create(cierres.values(), batch_size=TAMANO_LOTE)
+        generados.append((mes, len(cierres)))
+
+        saldos = {producto_id: cierre.saldo for producto_id, cierre in cierres.items()}
+        ultimo = mes
+        mes = fin_de_mes(mes + timedelta(days=1))
+    return generados
+
+
+def cierre_anterior(fecha):
+    """Fecha del último cierre guardado hasta `fecha` inclusive, o None."""
+    return CierreStock.objects.filter(fecha__lte=fecha).aggregate(cierre=Max('fecha'))['cierre']
+
+
+def consulta_stock_a_fecha(fecha, cierre=None):
+    """
+    Productos con el saldo que tenían al final del día `fecha` (anotación
+    stock_a_fecha), excluidos los que tenían saldo cero. `cierre` es la fecha
+    del cierre que se usa como base (por defecto, cierre_anterior(fecha)).
+    """
+    if cierre is None:
+        cierre = cierre_anterior(fecha)
+    movimientos = Transaccion.objects.filter(producto=OuterRef('pk'), fecha__lt=fin_del_dia(fecha))
+    base = 0
+    if cierre:
+        movimientos = movimientos.filter(fecha__gte=fin_del_dia(cierre))
+        base = Coalesce(Subquery(
+            CierreStock.objects.filter(producto=OuterRef('pk'), fecha=cierre).values('saldo')[:1]
+        ), 0)
+    variacion = movimientos.values('producto').annotate(total=Sum(Transaccion.expresion_variacion())).values('total')
+    return Producto.objects.annotate(
+        stock_a_fecha=base + Coalesce(Subquery(variacion[:1]), 0)
+    ).exclude(stock_a_fecha=0)
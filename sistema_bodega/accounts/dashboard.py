@@ -0,0 +1,138 @@
+"""Cálculo de métricas del dashboard de inicio.
+
+Las métricas se obtienen con dos consultas: una agregación condicional que
+cuenta los tramos de stock y los estados de vencimiento, y una consulta
+acotada para los productos más críticos. El resultado es un diccionario
+plano reutilizable por la vista ``home`` o por una API.
+
+``obtener_snapshot_dashboard`` guarda ese diccionario en el caché con una
+clave que incluye la fecha local y la versión del inventario, de modo que
+sólo se recalcula tras un movimiento de stock o al cambiar el día. Una sola
+solicitud recalcula cada versión; las demás muestran la anterior mientras tanto.
+"""
+from django.core.cache import cache
+from django.db.models import Case, Count, DateField, F, Q, Value, When
+from django.utils import timezone
+
+from .cache_inventario import obtener_version_inventario, segundos_hasta_medianoche
+from .models import Producto
+
+ESTADOS_CRITICOS = ['Vencido', 'Vence Hoy', 'Crítico']
+
+# Segundos que una solicitud reserva el recálculo del dashboard (por si termina sin liberarlo)
+TIEMPO_BLOQUEO_DASHBOARD = 30
+
+
+def calcular_porcentajes(stock_bajo, stock_medio, stock_alto, total_productos):
+    """Calcula los porcentajes por tramo de stock ajustando el redondeo para que sumen 100."""
+    if total_productos <= 0:
+        return 0, 0, 0
+
+    porcentaje_bajo = round(stock_bajo / total_productos * 100, 2)
+    porcentaje_medio = round(stock_medio / total_productos * 100, 2)
+    porcentaje_alto = round(stock_alto / total_productos * 100, 2)
+
+    suma_porcentajes = porcentaje_bajo + porcentaje_medio + porcentaje_alto
+    if suma_porcentajes != 100.0:
+        if porcentaje_bajo >= porcentaje_medio and porcentaje_bajo >= porcentaje_alto:
+            porcentaje_bajo = round(porcentaje_bajo + (100.0 - suma_porcentajes), 2)
+        elif porcentaje_medio >= porcentaje_bajo and porcentaje_medio >= porcentaje_alto:
+            porcentaje_medio = round(porcentaje_medio + (100.0 - suma_porcentajes), 2)
+        else:
+            porcentaje_alto = round(porcentaje_alto + (100.0 - suma_porcentajes), 2)
+    return porcentaje_bajo, porcentaje_medio, porcentaje_alto
+
+
+def obtener_productos_criticos(limite=5, hoy=None):
+    """Devuelve los productos más críticos (vencidos primero, luego por días restantes)."""
+    hoy = hoy or timezone.localdate()
+    productos = Producto.objects.filter(
+        tiene_vencimiento=True,
+        stock__gt=0,
+        estado_vencimiento__in=ESTADOS_CRITICOS
+    ).annotate(
+        orden_vencimiento=Case(
+            When(proximo_vencimiento__lt=hoy, then=Value(hoy)),
+            default=F('proximo_vencimiento'),
+            output_field=DateField(),
+        )
+    ).order_by('orden_vencimiento', 'descripcion').values(
+        'codigo_barra', 'descripcion', 'stock', 'estado_vencimiento', 'proximo_vencimiento'
+    )[:limite]
+
+    return [
+        {
+            'codigo_barra': producto['codigo_barra'],
+            'descripcion': producto['descripcion'],
+            'stock': producto['stock'],
+            'estado': producto['estado_vencimiento'],
+            'fecha_vencimiento': producto['proximo_vencimiento'],
+            'dias_restantes': (producto['proximo_vencimiento'] - hoy).days if producto['proximo_vencimiento'] else None,
+        } for producto in productos
+    ]
+
+
+def obtener_metricas_dashboard(limite_criticos=5):
+    """Calcula todas las métricas del dashboard y las devuelve como diccionario plano."""
+    Producto.asegurar_estados_vigentes()
+
+    con_vencimiento = Q(tiene_vencimiento=True, stock__gt=0)
+    metricas = Producto.objects.aggregate(
+        total_productos=Count('id', filter=Q(stock__gt=0)),
+        stock_bajo=Count('id', filter=Q(stock__gte=1, stock__lte=10)),
+        stock_medio=Count('id', filter=Q(stock__gt=10, stock__lte=50)),
+        stock_alto=Count('id', filter=Q(stock__gt=50)),
+        total_con_vencimiento=Count('id', filter=con_vencimiento),
+        productos_vencidos=Count('id', filter=con_vencimiento & Q(estado_vencimiento='Vencido')),
+        productos_criticos=Count('id', filter=con_vencimiento & Q(estado_vencimiento__in=['Vence Hoy', 'Crítico'])),
+        productos_precaucion=Count('id', filter=con_vencimiento & Q(estado_vencimiento='Precaución')),
+    )
+
+    metricas['productos_normal'] = (
+        metricas['total_con_vencimiento']
+        - metricas['productos_vencidos']
+        - metricas['productos_criticos']
+        - metricas['productos_precaucion']
+    )
+    metricas['productos_con_vencimiento'] = metricas['total_con_vencimiento'] > 0
+    metricas['porcentaje_bajo'], metricas['porcentaje_medio'], metricas['porcentaje_alto'] = calcular_porcentajes(
+        metricas['stock_bajo'], metricas['stock_medio'], metricas['stock_alto'], metricas['total_productos']
+    )
+    metricas['productos_criticos_top'] = (
+        obtener_productos_criticos(limite_criticos) if metricas['productos_vencidos'] or metricas['productos_criticos'] else []
+    )
+    return metricas
+
+
+def obtener_snapshot_dashboard(limite_criticos=5):
+    """
+    Devuelve las métricas del dashboard desde el caché, recalculándolas sólo si
+    cambió el inventario. Mientras una solicitud las recalcula, las demás
+    reciben las de la versión anterior del mismo día en lugar de repetir las
+    consultas.
+    """
+    # Puede cambiar la versión (cambio de día), por eso se lee después
+    Producto.asegurar_estados_vigentes()
+    fecha = timezone.localdate().isoformat()
+    clave = 'dashboard:{fecha}:{version}:{limite}'.format(
+        fecha=fecha,
+        version=obtener_version_inventario(),
+        limite=limite_criticos,
+    )
+    metricas = cache.get(clave)
+    if metricas is not None:
+        return metricas
+
+    clave_anterior = f'dashboard:{fecha}:ultimo:{limite_criticos}'
+    if not cache.add(f'{clave}:calculando', True, TIEMPO_BLOQUEO_DASHBOARD):
+        metricas = cache.get(clave_anterior)
+        if metricas is not None:
+            return metricas
+        # Sin versión anterior que mostrar: se calcula también aquí
+    try:
+        metricas = obtener_metricas_dashboard(limite_criticos)
+        # Expira a medianoche local para que los tramos por día se actualicen
+        cache.set_many({clave: metricas, clave_anterior: metricas}, segundos_hasta_medianoche())
+    finally:
+        cache.delete(f'{clave}:calculando')
+    return metricas
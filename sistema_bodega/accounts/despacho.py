@@ -0,0 +1,214 @@
+"""Registro de salidas de bodega (actas de entrega) con descuento FIFO por lotes.
+
+Toda la salida se procesa en una sola transacción y con un número fijo de
+consultas, independiente del número de líneas del acta:
+
+1. Se bloquean los productos del carrito y sus lotes con stock
+   (``select_for_update``; en SQLite, que lo ignora, una escritura inicial
+   toma el bloqueo de escritura de la base).
+2. Se valida el stock de todas las líneas y se asignan los lotes FIFO en
+   memoria.
+3. Los descuentos se aplican con ``bulk_update`` y expresiones ``F()``; se
+   crea el encabezado del acta (``EncabezadoActa``) y sus líneas,
+   transacciones (con su saldo de bincard ya calculado) y asignaciones por
+   lote (``AsignacionLote``) se crean con ``bulk_create``.
+
+Si el stock de algún producto o lote queda negativo la transacción se
+revierte completa, por lo que dos salidas simultáneas nunca despachan más
+de lo disponible.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+import pytz
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+
+from .cache_inventario import incrementar_version_inventario
+from .models import (
+    ActaEntrega, AsignacionLote, EncabezadoActa, LoteProducto, Producto, Secuencia, Transaccion, bloquear_productos,
+    calcular_estado_vencimiento
+)
+
+
+def asignar_lotes_fifo(lotes, cantidad):
+    """
+    Reparte `cantidad` entre los lotes (ordenados FIFO) y descuenta el stock en
+    memoria. Devuelve la lista de (lote, cantidad tomada) y lo que no se pudo cubrir.
+    """
+    asignaciones = []
+    restante = cantidad
+    for lote in lotes:
+        if restante <= 0:
+            break
+        tomado = min(lote.stock, restante)
+        if tomado > 0:
+            lote.stock -= tomado
+            restante -= tomado
+            asignaciones.append((lote, tomado))
+    return asignaciones, restante
+
+
+def registrar_salida(lineas, departamento, responsable, generador):
+    """
+    Registra el acta de entrega para las líneas del carrito de salida.
+
+    `lineas` son diccionarios con codigo_barra, cantidad, numero_siscom y
+    observacion (el formato de accounts.carrito). Devuelve un
+    diccionario con el número de acta, el encabezado, las líneas creadas y
+    las asignaciones por lote de cada línea. Lanza ValidationError si alguna
+    cantidad no es un entero positivo o algún producto no existe o no tiene
+    stock suficiente; en ese caso no se guarda nada.
+    """
+    cantidades = {}
+    for linea in lineas:
+        codigo = linea['codigo_barra']
+        if codigo in cantidades:
+            raise ValidationError(f'El producto {codigo} aparece más de una vez en la salida.')
+        try:
+            cantidad = int(linea['cantidad'])
+        except (TypeError, ValueError):
+            raise ValidationError(f'La cantidad para el producto {codigo} debe ser un número entero.')
+        if cantidad <= 0:
+            raise ValidationError(f'La cantidad para el producto {codigo} debe ser mayor que 0.')
+        cantidades[codigo] = cantidad
+
+    with transaction.atomic():
+        bloquear_productos(Producto.objects.filter(codigo_barra__in=list(cantidades)))
+        productos = {
+            producto.codigo_barra: producto
+            for producto in Producto.objects.select_for_update().filter(codigo_barra__in=list(cantidades))
+        }
+        faltantes = [codigo for codigo in cantidades if codigo not in productos]
+        if faltantes:
+            raise ValidationError(f'Producto no encontrado: {", ".join(faltantes)}.')
+
+        for codigo, cantidad in cantidades.items():
+            producto = productos[codigo]
+            if producto.stock < cantidad:
+                raise ValidationError(
+                    f'No hay suficiente stock para {producto.descripcion} (Código: {codigo}). '
+                    f'Stock disponible: {producto.stock}, Solicitado: {cantidad}.'
+                )
+
+        # Lotes con stock de todos los productos con vencimiento, en orden FIFO
+        lotes_por_producto = defaultdict(list)
+        lotes = LoteProducto.objects.select_for_update().filter(
+            producto__in=[producto.pk for producto in productos.values() if producto.tiene_vencimiento],
+            stock__gt=0
+        ).order_by('producto_id', 'fecha_vencimiento', 'id')
+        for lote in lotes:
+            lotes_por_producto[lote.producto_id].append(lote)
+
+        asignaciones = {}
+        descuentos_lotes = {}
+        for codigo, cantidad in cantidades.items():
+            producto = productos[codigo]
+            if not producto.tiene_vencimiento:
+                # Para productos sin vencimiento, reducir del stock principal
+                producto.stock = F('stock') - cantidad
+                continue
+
+            lotes_producto = lotes_por_producto[producto.pk]
+            asignaciones[codigo], restante = asignar_lotes_fifo(lotes_producto, cantidad)
+            if restante > 0:
+                raise ValidationError(f'Error al reducir stock para {producto.descripcion}: los lotes no cubren la cantidad solicitada.')
+            for lote, tomado in asignaciones[codigo]:
+                descuentos_lotes[lote] = tomado
+
+            # El stock del producto con vencimiento es la suma de sus lotes (igual que reducir_stock_fifo)
+            activos = [lote for lote in lotes_producto if lote.stock > 0]
+            producto.stock = sum(lote.stock for lote in lotes_producto)
+            producto.proximo_vencimiento = min(
+                (lote.fecha_vencimiento for lote in activos), default=producto.fecha_vencimiento
+            )
+            producto.estado_vencimiento = calcular_estado_vencimiento(producto.proximo_vencimiento)
+            producto.lotes_activos = len(activos)
+
+        for lote, tomado in descuentos_lotes.items():
+            lote.stock = F('stock') - tomado
+        LoteProducto.objects.bulk_update(list(descuentos_lotes), ['stock'])
+        Producto.objects.bulk_update(
+            list(productos.values()), ['stock', 'proximo_vencimiento', 'estado_vencimiento', 'lotes_activos']
+        )
+
+        # Defensa final: ningún stock puede quedar negativo
+        if (Producto.objects.filter(pk__in=[p.pk for p in productos.values()], stock__lt=0).exists()
+                or LoteProducto.objects.filter(pk__in=[l.pk for l in descuentos_lotes], stock__lt=0).exists()):
+            raise ValidationError('El stock cambió mientras se registraba la salida. Intente nuevamente.')
+
+        # Se reserva dentro de la transacción: si la salida se revierte, el número no se pierde
+        numero_acta = Secuencia.siguiente(Secuencia.NUMERO_ACTA)
+
+        encabezado = EncabezadoActa.objects.create(
+            numero_acta=numero_acta,
+            departamento=departamento,
+            responsable=responsable,
+            generador=generador,
+        )
+        actas = ActaEntrega.objects.bulk_create([
+            ActaEntrega(
+                encabezado=encabezado,
+                numero_acta=numero_acta,
+                departamento=departamento,
+                responsable=responsable,
+                generador=generador,
+                producto=productos[linea['codigo_barra']],
+                cantidad=cantidades[linea['codigo_barra']],
+                numero_siscom=linea['numero_siscom'],
+                observacion=linea['observacion'],
+            ) for linea in lineas
+        ])
+        if actas and actas[0].pk is None:
+            # Motores sin RETURNING en inserciones masivas
+            actas = list(ActaEntrega.objects.filter(numero_acta=numero_acta).select_related('producto'))
+
+        ahora = datetime.now(pytz.UTC)
+        transacciones = [
+            Transaccion(
+                producto=acta.producto,
+                tipo='salida',
+                cantidad=acta.cantidad,
+                acta_entrega=acta,
+                fecha=ahora,
+                observacion=f"Salida asociada al Acta N°{numero_acta}"
+            ) for acta in actas
+        ]
+        Transaccion.asignar_saldos(transacciones)
+        Transaccion.objects.bulk_create(transacciones)
+
+        # Registro de qué lote se entregó en cada línea (trazabilidad para retiros)
+        AsignacionLote.objects.bulk_create([
+            AsignacionLote(
+                acta=acta,
+                lote=lote,
+                producto=acta.producto,
+                numero_lote=lote.numero_lote,
+                fecha_vencimiento=lote.fecha_vencimiento,
+                cantidad=tomado,
+            )
+            for acta in actas
+            for lote, tomado in asignaciones.get(acta.producto.codigo_barra, [])
+        ])
+
+        # bulk_update/bulk_create no emiten señales
+        incrementar_version_inventario()
+
+    return {
+        'numero_acta': numero_acta,
+        'encabezado': encabezado,
+        'actas': actas,
+        'asignaciones': {acta: asignaciones.get(acta.producto.codigo_barra, []) for acta in actas},
+    }
+
+
+def consultar_trazabilidad_lote(codigo_barra, numero_lote):
+    """
+    Entregas de un lote (acta, departamento, responsable y cantidad) en una sola
+    consulta sobre el índice (producto, numero_lote) de AsignacionLote.
+    """
+    return AsignacionLote.objects.filter(
+        producto__codigo_barra=codigo_barra,
+        numero_lote=numero_lote
+    ).select_related('acta', 'acta__responsable', 'acta__generador').order_by('acta__fecha', 'acta__numero_acta')
@@ -0,0 +1,175 @@
+"""Motor de exportación a Excel con memoria acotada.
+
+Además de XLSX se ofrecen CSV y NDJSON (una línea JSON por fila) generados
+fila a fila con ``StreamingHttpResponse``, pensados para proyecciones con
+``values_list()`` y consumo desde scripts.
+
+El libro se escribe en modo ``write_only`` de openpyxl: cada fila se
+serializa a disco a medida que llega, por lo que las filas pueden provenir
+de un generador o de ``QuerySet.iterator()`` sin cargarse completas. El
+ancho de las columnas se calcula con una muestra acotada de las primeras
+filas, y el archivo final se entrega desde un ``SpooledTemporaryFile``
+mediante ``FileResponse``, que lo envía por bloques.
+"""
+import csv
+import json
+import tempfile
+import urllib.parse
+from datetime import date, datetime
+from itertools import chain, islice
+
+from django.db.models.query import QuerySet
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+TIPO_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+FORMATOS_STREAMING = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+# Tamaño de bloque para recorrer querysets con iterator()
+TAMANO_BLOQUE = 2000
+
+# Filas usadas para estimar el ancho de las columnas
+FILAS_MUESTRA = 500
+
+# Máximo de memoria antes de que el archivo temporal pase a disco
+MAX_MEMORIA_ARCHIVO = 5 * 1024 * 1024
+
+ESTILO_ENCABEZADO = {
+    'font': Font(bold=True),
+    'fill': PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid'),
+    'alignment': Alignment(horizontal='center'),
+}
+
+
+def iterar_datos(datos, tamano_bloque=TAMANO_BLOQUE):
+    """Recorre un queryset por bloques (sin caché de resultados) o cualquier otro iterable tal cual."""
+    if isinstance(datos, QuerySet):
+        return datos.iterator(chunk_size=tamano_bloque)
+    return iter(datos)
+
+
+def calcular_anchos(columnas, muestra):
+    """Ancho de cada columna según el texto más largo del encabezado y de la muestra."""
+    anchos = []
+    for indice, columna in enumerate(columnas):
+        valores = [columna] + [fila[indice] for fila in muestra if indice < len(fila)]
+        anchos.append(max((len(str(valor)) for valor in valores if valor not in (None, '')), default=0) + 2)
+    return anchos
+
+
+def _celda(ws, valor, font=None, fill=None, alignment=None):
+    celda = WriteOnlyCell(ws, value=valor)
+    if font:
+        celda.font = font
+    if fill:
+        celda.fill = fill
+    if alignment:
+        celda.alignment = alignment
+    return celda
+
+
+def escribir_xlsx(destino, titulo, columnas, filas, anchos=None, estilo_encabezado=None,
+                  relleno_fila=None, filas_muestra=FILAS_MUESTRA):
+    """
+    Escribe un libro de una hoja en `destino` (ruta o archivo binario).
+
+    `filas` es un iterable de listas de valores que se consume una sola vez.
+    `anchos` permite fijar el ancho de cada columna (None en una posición la
+    deja calculada desde la muestra). `relleno_fila` recibe cada fila y
+    devuelve un PatternFill o None para colorearla.
+    """
+    filas = iter(filas)
+    # En modo write_only los anchos deben definirse antes de la primera fila
+    muestra = list(islice(filas, filas_muestra))
+    anchos_muestra = calcular_anchos(columnas, muestra)
+    anchos = [fijo or calculado for fijo, calculado in zip(anchos or [None] * len(columnas), anchos_muestra)]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=titulo[:31])
+    for indice, ancho in enumerate(anchos, start=1):
+        ws.column_dimensions[get_column_letter(indice)].width = ancho
+
+    estilo_encabezado = estilo_encabezado or ESTILO_ENCABEZADO
+    ws.append([_celda(ws, columna, **estilo_encabezado) for columna in columnas])
+
+    for fila in chain(muestra, filas):
+        relleno = relleno_fila(fila) if relleno_fila else None
+        if relleno:
+            ws.append([_celda(ws, valor, fill=relleno) for valor in fila])
+        else:
+            ws.append(fila)
+
+    wb.save(destino)
+
+
+def respuesta_xlsx(nombre_archivo, titulo, columnas, filas, **opciones):
+    """Genera el libro en un archivo temporal y lo devuelve como descarga por bloques."""
+    archivo = tempfile.SpooledTemporaryFile(max_size=MAX_MEMORIA_ARCHIVO)
+    escribir_xlsx(archivo, titulo, columnas, filas, **opciones)
+    archivo.seek(0)
+    return FileResponse(archivo, as_attachment=True, filename=nombre_archivo, content_type=TIPO_XLSX)
+
+
+def escribir_archivo(formato, destino, titulo, columnas, campos, filas, **opciones):
+    """Escribe las filas completas en un archivo binario abierto, en formato XLSX, CSV o NDJSON."""
+    if formato == 'xlsx':
+        escribir_xlsx(destino, titulo, columnas, filas, **opciones)
+        return
+    lineas = lineas_csv(columnas, filas) if formato == 'csv' else lineas_ndjson(campos, filas)
+    for linea in lineas:
+        destino.write(linea.encode('utf-8'))
+
+
+def nombre_con_fecha(nombre_base, extension):
+    """Nombre de archivo con la fecha del día, ej. Productos_2025-01-31.xlsx."""
+    return f"{nombre_base}_{datetime.now().strftime('%Y-%m-%d')}.{extension}"
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve cada línea en lugar de almacenarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _valor_plano(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+def lineas_csv(columnas, filas):
+    """Genera el CSV línea por línea, comenzando por el encabezado."""
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(columnas)
+    for fila in filas:
+        yield escritor.writerow([_valor_plano(valor) for valor in fila])
+
+
+def lineas_ndjson(campos, filas):
+    """Genera un objeto JSON por línea con las claves de `campos`."""
+    for fila in filas:
+        yield json.dumps(dict(zip(campos, map(_valor_plano, fila))), ensure_ascii=False, default=str) + '\n'
+
+
+def respuesta_streaming(formato, nombre_base, columnas, campos, filas):
+    """
+    Descarga CSV o NDJSON enviada a medida que se generan las filas.
+
+    El CSV usa `columnas` como encabezado y el NDJSON usa `campos` como claves.
+    """
+    if formato == 'csv':
+        lineas = lineas_csv(columnas, filas)
+    else:
+        lineas = lineas_ndjson(campos, filas)
+    response = StreamingHttpResponse(lineas, content_type=FORMATOS_STREAMING[formato])
+    filename = urllib.parse.quote(nombre_con_fecha(nombre_base, formato))
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -1,7 +1,8 @@
 from django import forms
-from django.core.validators import RegexValidator, MinValueValidator
+from django.core.validators import FileExtensionValidator, RegexValidator, MinValueValidator
 from django.core.exceptions import ValidationError
-from .models import Producto, Transaccion, ActaEntrega, Funcionario, Departamento, Responsable, CustomUser, clean_rut, validate_rut, Categoria, LoteProducto
+from django.db import transaction
+from .models import Producto, Transaccion, ActaEntrega, Funcionario, Departamento, Responsable, CustomUser, clean_rut, validate_rut, Categoria, LoteProducto, RecepcionStock
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.contrib.auth.models import Group
 
@@ -204,6 +205,23 @@ def calcularDigitoVerificador(rut):
         return '0'
     return str(dv)
 
+def normalizar_rut(rut):
+    """
+    Valida el formato y el dígito verificador de un RUT y lo devuelve
+    normalizado (sin puntos ni espacios, DV en mayúscula: 76123456-K).
+    Lanza ValidationError si no es válido.
+    """
+    rut = rut.replace('.', '').replace(' ', '').upper()
+    partes = rut.split('-')
+    if len(partes) != 2:
+        raise ValidationError('El RUT debe incluir un guion (formato XXXXXXXX-X).')
+    cuerpo, dv = partes
+    if not cuerpo.isdigit() or len(cuerpo) > 8:
+        raise ValidationError('El cuerpo del RUT debe contener entre 1 y 8 dígitos.')
+    if dv != calcularDigitoVerificador(cuerpo):
+        raise ValidationError('El dígito verificador no es válido para este RUT.')
+    return rut
+
 class ProductoForm(forms.ModelForm):
     # El campo código de barra será solo lectura y se autocompleta
     codigo_barra = forms.CharField(
@@ -325,17 +343,18 @@ class ProductoForm(forms.ModelForm):
         """Guarda el producto y crea automáticamente un lote si tiene vencimiento y stock."""
         # El código de barra se asigna automáticamente en el modelo, ignorar el del formulario
         self.instance.codigo_barra = None
-        producto = super().save(commit=commit)
-        if commit and producto.tiene_vencimiento and producto.stock > 0 and producto.fecha_vencimiento:
-            # CORRECCIÓN CRÍTICA: Crear lote inicial SIN duplicar stock
-            # El stock ya está asignado al producto, solo crear el lote
-            LoteProducto.objects.create(
-                producto=producto,
-                numero_lote=producto.get_proximo_numero_lote(),
-                fecha_vencimiento=producto.fecha_vencimiento,
-                stock=producto.stock
-            )
-            # NO sumar stock adicional - ya está asignado al producto
+        with transaction.atomic():
+            producto = super().save(commit=commit)
+            if commit and producto.tiene_vencimiento and producto.stock > 0 and producto.fecha_vencimiento:
+                # CORRECCIÓN CRÍTICA: Crear lote inicial SIN duplicar stock
+                # El stock ya está asignado al producto, solo crear el lote
+                LoteProducto.objects.create(
+                    producto=producto,
+                    numero_lote=producto.reservar_numero_lote(),
+                    fecha_vencimiento=producto.fecha_vencimiento,
+                    stock=producto.stock
+                )
+                # NO sumar stock adicional - ya está asignado al producto
         return producto
 
 class TransaccionForm(forms.ModelForm):
@@ -412,27 +431,7 @@ class TransaccionForm(forms.ModelForm):
     def clean_rut_proveedor(self):
         """Valida el formato y el dígito verificador del RUT del proveedor."""
         rut = self.cleaned_data.get('rut_proveedor')
-        if not rut:
-            return rut
-
-        rut = rut.replace('.', '').replace(' ', '').upper()
-        print(f"Raw RUT input (TransaccionForm): {rut}")
-
-        parts = rut.split('-')
-        if len(parts) != 2:
-            raise ValidationError('El RUT debe incluir un guion (formato XXXXXXXX-X).')
-        body = parts[0]
-        dv = parts[1]
-
-        if not body.isdigit() or len(body) < 1 or len(body) > 8:
-            raise ValidationError('El cuerpo del RUT debe contener entre 1 y 8 dígitos.')
-
-        calculated_dv = calcularDigitoVerificador(body)
-        print(f"Body: {body}, Calculated DV: {calculated_dv}, Input DV: {dv}")
-        if dv not in '0123456789K' or dv != calculated_dv:
-            raise ValidationError('El dígito verificador no es válido para este RUT.')
-
-        return rut
+        return normalizar_rut(rut) if rut else rut
 
 class ActaEntregaForm(forms.ModelForm):
     # Campo para seleccionar el departamento
@@ -955,4 +954,66 @@ class AgregarStockConVencimientoForm(forms.Form):
                 observacion="Stock agregado sin fecha de vencimiento"
             )
             
-            return None, transaccion
\ No newline at end of file
+            return None, transaccion
+
+class RecepcionStockForm(forms.ModelForm):
+    """Datos del documento de la entrega (se registran una sola vez por recepción)."""
+
+    class Meta:
+        model = RecepcionStock
+        fields = ['rut_proveedor', 'guia_despacho', 'numero_factura', 'orden_compra', 'observacion']
+        labels = {
+            'rut_proveedor': 'RUT del Proveedor',
+            'guia_despacho': 'Guía de Despacho',
+            'numero_factura': 'Número de Factura',
+            'orden_compra': 'Orden de Compra',
+            'observacion': 'Observación',
+        }
+        widgets = {
+            'rut_proveedor': forms.TextInput(attrs={'class': 'form-control form-control-sm', 'placeholder': 'Ej. 76123456-7'}),
+            'guia_despacho': forms.TextInput(attrs={'class': 'form-control form-control-sm'}),
+            'numero_factura': forms.TextInput(attrs={'class': 'form-control form-control-sm'}),
+            'orden_compra': forms.TextInput(attrs={'class': 'form-control form-control-sm'}),
+            'observacion': forms.Textarea(attrs={'class': 'form-control form-control-sm', 'rows': 2}),
+        }
+
+    def clean_rut_proveedor(self):
+        """Valida el formato y el dígito verificador del RUT del proveedor."""
+        rut = self.cleaned_data.get('rut_proveedor')
+        return normalizar_rut(rut) if rut else rut
+
+class LineaRecepcionForm(forms.Form):
+    """Una línea de la recepción: producto, cantidad y vencimiento del lote (si corresponde)."""
+    codigo_barra = forms.CharField(
+        max_length=50,
+        label='Código de Barra',
+        widget=forms.TextInput(attrs={'class': 'form-control form-control-sm codigo-linea', 'autocomplete': 'off'})
+    )
+    cantidad = forms.IntegerField(
+        validators=[MinValueValidator(1, message='La cantidad debe ser un número positivo.')],
+        label='Cantidad',
+        widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'min': 1})
+    )
+    fecha_vencimiento = forms.DateField(
+        label='Fecha de Vencimiento',
+        required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control form-control-sm', 'type': 'date'})
+    )
+
+# Las filas vacías del formulario se ignoran (empty_permitted)
+LineaRecepcionFormSet = forms.formset_factory(LineaRecepcionForm, extra=5, max_num=200, validate_max=True)
+
+class ImportarProductosForm(forms.Form):
+    # Archivo Excel o CSV con una fila por producto (o por lote)
+    archivo = forms.FileField(
+        label='Archivo (.xlsx o .csv)',
+        validators=[FileExtensionValidator(allowed_extensions=['xlsx', 'csv'])],
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control-file', 'accept': '.xlsx,.csv'})
+    )
+    # Por defecto solo se valida; se importa al desmarcar la opción
+    simular = forms.BooleanField(
+        required=False,
+        initial=True,
+        label='Solo validar (no guardar cambios)',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
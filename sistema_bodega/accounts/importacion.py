@@ -0,0 +1,383 @@
+"""Importación masiva de productos y lotes desde XLSX o CSV.
+
+El archivo se recorre una sola vez (openpyxl en modo ``read_only`` o
+``csv.reader``, en UTF-8 o Windows-1252) y todas las filas se validan antes de escribir: formato
+de cada campo, RUT del proveedor, categoría existente y códigos de barra
+repetidos en el archivo o ya registrados (los existentes se consultan en
+bloques con ``codigo_barra__in``). Si hay errores no se guarda nada y se
+devuelve el reporte fila por fila; con ``simular=True`` sólo se valida.
+
+Las filas válidas se guardan en una única transacción: los códigos de
+barra automáticos se reservan en bloque en la secuencia y productos,
+lotes y transacciones de stock inicial se crean con ``bulk_create`` por
+lotes de ``TAMANO_LOTE`` filas.
+
+Columnas reconocidas (sin distinguir mayúsculas ni tildes; ver ALIAS_COLUMNAS):
+codigo_barra (opcional, se asigna automáticamente), descripcion, categoria,
+stock, fecha_vencimiento, rut_proveedor, guia_despacho, numero_factura y
+orden_compra. Varias filas con el mismo código de barra y distinta fecha de
+vencimiento crean un producto con un lote por fila.
+"""
+import codecs
+import csv
+import io
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import date, datetime
+
+import pytz
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from openpyxl import load_workbook
+
+from .cache_inventario import incrementar_version_catalogo, incrementar_version_inventario
+from .forms import normalizar_rut
+from .models import Categoria, LoteProducto, Producto, Secuencia, Transaccion, calcular_estado_vencimiento
+
+# Filas por INSERT en bulk_create
+TAMANO_LOTE = 500
+
+# Máximo de variables por consulta en SQLite (para los filtros __in)
+TAMANO_CONSULTA = 900
+
+COLUMNAS_IMPORTACION = [
+    'Código de Barra', 'Descripción', 'Categoría', 'Stock', 'Fecha Vencimiento',
+    'RUT Proveedor', 'Guía Despacho', 'Número Factura', 'Orden Compra',
+]
+
+ALIAS_COLUMNAS = {
+    'codigo_barra': ['codigo_barra', 'codigo_de_barra', 'codigo', 'codigo_barras'],
+    'descripcion': ['descripcion', 'nombre_del_producto', 'producto', 'nombre'],
+    'categoria': ['categoria'],
+    'stock': ['stock', 'cantidad', 'stock_actual', 'stock_inicial'],
+    'fecha_vencimiento': ['fecha_vencimiento', 'fecha_de_vencimiento', 'vencimiento'],
+    'rut_proveedor': ['rut_proveedor', 'rut_del_proveedor', 'proveedor_rut', 'proveedor'],
+    'guia_despacho': ['guia_despacho', 'guia_de_despacho', 'guia'],
+    'numero_factura': ['numero_factura', 'numero_de_factura', 'n_factura', 'factura'],
+    'orden_compra': ['orden_compra', 'orden_de_compra'],
+}
+
+FORMATOS_FECHA = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y']
+
+# Codificaciones aceptadas para CSV, en orden de preferencia (cp1252 es la de Excel en Windows)
+CODIFICACIONES_CSV = ['utf-8-sig', 'cp1252']
+
+
+def normalizar_encabezado(texto):
+    """'Código de Barra' -> 'codigo_de_barra' (sin tildes, minúsculas, separador _)."""
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
+
+
+def mapear_columnas(encabezado):
+    """Índice de cada campo conocido en la fila de encabezado."""
+    nombres = {alias: campo for campo, alias_campo in ALIAS_COLUMNAS.items() for alias in alias_campo}
+    indices = {}
+    for indice, columna in enumerate(encabezado):
+        campo = nombres.get(normalizar_encabezado(columna))
+        if campo and campo not in indices:
+            indices[campo] = indice
+    return indices
+
+
+def codificacion_csv(archivo):
+    """
+    Codificación del CSV: UTF-8 (con o sin BOM) o, si no lo es, Windows-1252
+    (la de Excel en español al guardar "CSV"). Recorre el archivo por bloques
+    sin cargarlo completo y lo deja al inicio. Lanza ValueError si no es
+    ninguna de las dos.
+    """
+    for codificacion in CODIFICACIONES_CSV:
+        decodificador = codecs.getincrementaldecoder(codificacion)()
+        archivo.seek(0)
+        try:
+            for bloque in iter(lambda: archivo.read(64 * 1024), b''):
+                decodificador.decode(bloque)
+            decodificador.decode(b'', final=True)
+        except UnicodeDecodeError:
+            continue
+        finally:
+            archivo.seek(0)
+        return codificacion
+    raise ValueError(
+        'La codificación del CSV no es UTF-8 ni Windows-1252 (Latin-1). '
+        'Guárdelo como "CSV UTF-8" e inténtelo de nuevo.'
+    )
+
+
+def leer_filas(archivo, nombre_archivo):
+    """Filas del archivo como tuplas de valores (la primera es el encabezado)."""
+    if nombre_archivo.lower().endswith('.csv'):
+        contenido = io.TextIOWrapper(archivo, encoding=codificacion_csv(archivo), newline='')
+        muestra = contenido.read(4096)
+        contenido.seek(0)
+        delimitador = ';' if muestra.count(';') > muestra.count(',') else ','
+        yield from csv.reader(contenido, delimiter=delimitador)
+        return
+    wb = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        # Excel guarda los números como float: 100123.0 -> '100123'
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = _texto(valor)
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha de vencimiento inválida: '{texto}' (use dd/mm/aaaa).")
+
+
+def validar_fila(valores, indices, categorias):
+    """
+    Convierte una fila en un diccionario de datos validados.
+    Devuelve (datos, errores) donde errores es una lista de mensajes.
+    """
+    def valor(campo):
+        indice = indices.get(campo)
+        return valores[indice] if indice is not None and indice < len(valores) else None
+
+    datos, errores = {}, []
+    datos['codigo_barra'] = _texto(valor('codigo_barra'))
+    if len(datos['codigo_barra']) > 50:
+        errores.append('El código de barra no puede superar 50 caracteres.')
+
+    datos['descripcion'] = _texto(valor('descripcion'))
+    if not datos['descripcion']:
+        errores.append('La descripción es obligatoria.')
+    elif len(datos['descripcion']) > 200:
+        errores.append('La descripción no puede superar 200 caracteres.')
+
+    nombre_categoria = _texto(valor('categoria'))
+    datos['categoria'] = categorias.get(nombre_categoria.lower())
+    if not nombre_categoria:
+        errores.append('La categoría es obligatoria.')
+    elif datos['categoria'] is None:
+        errores.append(f"La categoría '{nombre_categoria}' no existe o no está activa.")
+
+    stock = _texto(valor('stock')) or '0'
+    if not stock.isdigit():
+        errores.append(f"El stock debe ser un número entero no negativo (valor: '{stock}').")
+    else:
+        datos['stock'] = int(stock)
+
+    datos['fecha_vencimiento'] = None
+    if _texto(valor('fecha_vencimiento')):
+        try:
+            datos['fecha_vencimiento'] = _fecha(valor('fecha_vencimiento'))
+        except ValueError as e:
+            errores.append(str(e))
+
+    datos['rut_proveedor'] = _texto(valor('rut_proveedor'))
+    if datos['rut_proveedor']:
+        try:
+            datos['rut_proveedor'] = normalizar_rut(datos['rut_proveedor'])
+        except ValidationError as e:
+            errores.extend(e.messages)
+
+    for campo, etiqueta in [('guia_despacho', 'La guía de despacho'), ('numero_factura', 'El número de factura')]:
+        datos[campo] = _texto(valor(campo))
+        if datos[campo] and not datos[campo].isdigit():
+            errores.append(f'{etiqueta} solo puede contener números enteros.')
+
+    datos['orden_compra'] = _texto(valor('orden_compra'))
+    if datos['orden_compra'] and not re.match(r'^[a-zA-Z0-9\-]+$', datos['orden_compra']):
+        errores.append('La orden de compra solo puede contener letras, números y guiones.')
+
+    for campo in ('guia_despacho', 'numero_factura', 'orden_compra'):
+        if len(datos[campo]) > 50:
+            errores.append(f'El campo {campo} no puede superar 50 caracteres.')
+
+    return datos, errores
+
+
+def codigos_existentes(codigos):
+    """Códigos de la lista que ya están registrados, consultados en bloques."""
+    codigos = list(codigos)
+    existentes = set()
+    for inicio in range(0, len(codigos), TAMANO_CONSULTA):
+        existentes.update(
+            Producto.objects.filter(codigo_barra__in=codigos[inicio:inicio + TAMANO_CONSULTA])
+            .values_list('codigo_barra', flat=True)
+        )
+    return existentes
+
+
+def validar_archivo(archivo, nombre_archivo):
+    """
+    Lee y valida todo el archivo. Devuelve (productos, errores): cada producto
+    es una lista de filas (fila, datos) que lo componen y cada error es un
+    diccionario con fila y mensaje.
+    """
+    categorias = {c.nombre.lower(): c for c in Categoria.objects.filter(activo=True)}
+    filas = leer_filas(archivo, nombre_archivo)
+    encabezado = next(filas, None)
+    if encabezado is None:
+        return [], [{'fila': 1, 'mensaje': 'El archivo está vacío.'}]
+    indices = mapear_columnas(encabezado)
+    faltantes = [campo for campo in ('descripcion', 'categoria') if campo not in indices]
+    if faltantes:
+        return [], [{'fila': 1, 'mensaje': f"Faltan columnas obligatorias: {', '.join(faltantes)}."}]
+
+    errores = []
+    productos = []
+    por_codigo = defaultdict(list)
+    for numero_fila, valores in enumerate(filas, start=2):
+        if not any(_texto(v) for v in valores):
+            continue  # Filas vacías al final de la hoja
+        datos, errores_fila = validar_fila(valores, indices, categorias)
+        errores.extend({'fila': numero_fila, 'mensaje': mensaje} for mensaje in errores_fila)
+        if errores_fila:
+            continue
+        if datos['codigo_barra']:
+            por_codigo[datos['codigo_barra']].append((numero_fila, datos))
+        else:
+            productos.append([(numero_fila, datos)])
+
+    for codigo in codigos_existentes(por_codigo):
+        for numero_fila, _ in por_codigo.pop(codigo):
+            errores.append({'fila': numero_fila, 'mensaje': f'El código de barra {codigo} ya está registrado.'})
+
+    for codigo, filas_codigo in por_codigo.items():
+        # Un código repetido sólo es válido como varios lotes (con vencimiento) del mismo producto
+        if len(filas_codigo) > 1 and any(datos['fecha_vencimiento'] is None for _, datos in filas_codigo):
+            for numero_fila, _ in filas_codigo:
+                errores.append({
+                    'fila': numero_fila,
+                    'mensaje': f'El código de barra {codigo} está repetido en el archivo y no todas sus filas tienen fecha de vencimiento.'
+                })
+            continue
+        productos.append(filas_codigo)
+
+    errores.sort(key=lambda error: error['fila'])
+    return productos, errores
+
+
+def _construir_producto(codigo, filas_producto):
+    """Producto (con su resumen de vencimiento) y lotes a partir de sus filas."""
+    _, datos = filas_producto[0]
+    fechas = [d['fecha_vencimiento'] for _, d in filas_producto if d['fecha_vencimiento']]
+    tiene_vencimiento = bool(fechas)
+    # Un lote por fila con vencimiento y stock, numerados desde 1 (el producto es nuevo)
+    con_stock = [d for _, d in filas_producto if d['fecha_vencimiento'] and d['stock'] > 0]
+    lotes = [
+        LoteProducto(numero_lote=numero, fecha_vencimiento=d['fecha_vencimiento'], stock=d['stock'])
+        for numero, d in enumerate(con_stock, start=1)
+    ]
+    producto = Producto(
+        codigo_barra=codigo,
+        descripcion=datos['descripcion'],
+        categoria=datos['categoria'],
+        stock=sum(d['stock'] for _, d in filas_producto),
+        rut_proveedor=datos['rut_proveedor'],
+        guia_despacho=datos['guia_despacho'],
+        numero_factura=datos['numero_factura'],
+        orden_compra=datos['orden_compra'],
+        tiene_vencimiento=tiene_vencimiento,
+        fecha_vencimiento=min(fechas) if fechas else None,
+    )
+    # bulk_create no llama a save(): el resumen se calcula aquí con los lotes en memoria
+    if tiene_vencimiento:
+        producto.proximo_vencimiento = min((lote.fecha_vencimiento for lote in lotes), default=producto.fecha_vencimiento)
+        producto.estado_vencimiento = calcular_estado_vencimiento(producto.proximo_vencimiento)
+        producto.lotes_activos = len(lotes)
+    return producto, lotes
+
+
+def guardar_productos(productos, nombre_archivo=''):
+    """Crea productos, lotes y transacciones de stock inicial en una transacción. Devuelve los totales."""
+    with transaction.atomic():
+        # Los códigos manuales numéricos adelantan la secuencia antes de reservar los automáticos
+        manuales = [filas[0][1]['codigo_barra'] for filas in productos if filas[0][1]['codigo_barra']]
+        numericos = [int(codigo) for codigo in manuales if Secuencia.es_codigo_numerico(codigo)]
+        if numericos:
+            Secuencia.asegurar_minimo(Secuencia.CODIGO_BARRA, max(numericos))
+        automaticos = sum(1 for filas in productos if not filas[0][1]['codigo_barra'])
+        codigos_nuevos = iter(Secuencia.reservar(Secuencia.CODIGO_BARRA, automaticos) if automaticos else [])
+
+        nuevos, lotes_por_codigo = [], {}
+        for filas in productos:
+            codigo = filas[0][1]['codigo_barra'] or str(next(codigos_nuevos))
+            producto, lotes = _construir_producto(codigo, filas)
+            nuevos.append(producto)
+            lotes_por_codigo[codigo] = lotes
+
+        creados = Producto.objects.bulk_create(nuevos, batch_size=TAMANO_LOTE)
+        if creados and creados[0].pk is None:
+            # Motores sin RETURNING en inserciones masivas
+            pks = {}
+            codigos = [producto.codigo_barra for producto in creados]
+            for inicio in range(0, len(codigos), TAMANO_CONSULTA):
+                pks.update(Producto.objects.filter(
+                    codigo_barra__in=codigos[inicio:inicio + TAMANO_CONSULTA]
+                ).values_list('codigo_barra', 'pk'))
+            for producto in creados:
+                producto.pk = pks[producto.codigo_barra]
+
+        lotes = []
+        for producto in creados:
+            for lote in lotes_por_codigo[producto.codigo_barra]:
+                lote.producto = producto
+                lotes.append(lote)
+        LoteProducto.objects.bulk_create(lotes, batch_size=TAMANO_LOTE)
+
+        ahora = datetime.now(pytz.UTC)
+        observacion = 'Stock inicial al importar productos' + (f' ({nombre_archivo})' if nombre_archivo else '')
+        Transaccion.objects.bulk_create([
+            Transaccion(
+                producto=producto,
+                tipo='entrada',
+                cantidad=producto.stock,
+                fecha=ahora,
+                rut_proveedor=producto.rut_proveedor,
+                guia_despacho=producto.guia_despacho,
+                numero_factura=producto.numero_factura,
+                orden_compra=producto.orden_compra,
+                observacion=observacion,
+                # Productos nuevos: el primer movimiento es todo su saldo
+                saldo=producto.stock,
+            ) for producto in creados if producto.stock > 0
+        ], batch_size=TAMANO_LOTE)
+
+        # bulk_create no emite señales
+        incrementar_version_inventario()
+        incrementar_version_catalogo()
+
+    return {'productos': len(creados), 'lotes': len(lotes)}
+
+
+def importar_archivo_productos(archivo, nombre_archivo, simular=False):
+    """
+    Valida e importa el archivo. Devuelve un diccionario con los errores
+    encontrados, el número de productos y lotes válidos y si se guardaron.
+    No guarda nada si hay errores o si `simular` es True.
+    """
+    productos, errores = validar_archivo(archivo, nombre_archivo)
+    resultado = {
+        'errores': errores,
+        'productos': len(productos),
+        'lotes': sum(1 for filas in productos for _, datos in filas if datos['fecha_vencimiento'] and datos['stock'] > 0),
+        'guardado': False,
+    }
+    if errores or simular or not productos:
+        return resultado
+    resultado.update(guardar_productos(productos, nombre_archivo))
+    resultado['guardado'] = True
+    return resultado
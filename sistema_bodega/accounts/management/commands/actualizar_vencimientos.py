@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from accounts.models import Producto
+
+
+class Command(BaseCommand):
+    help = ('Actualiza el estado de vencimiento desnormalizado de los productos. '
+            'Debe programarse una vez al día (ej. cron a las 00:05) para el cambio de fecha.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recalcular',
+            action='store_true',
+            help='Recalcula también próximo vencimiento y lotes activos desde los lotes (reparación completa).'
+        )
+
+    def handle(self, *args, **options):
+        if options['recalcular']:
+            productos = Producto.objects.filter(tiene_vencimiento=True)
+            total = 0
+            for producto in productos.iterator():
+                producto.actualizar_resumen_vencimiento()
+                total += 1
+            self.stdout.write(self.style.SUCCESS(f'✅ Resumen de vencimiento recalculado para {total} productos'))
+            return
+
+        actualizados = Producto.actualizar_estados_vencimiento()
+        self.stdout.write(self.style.SUCCESS(f'✅ Estados de vencimiento actualizados: {actualizados} productos'))
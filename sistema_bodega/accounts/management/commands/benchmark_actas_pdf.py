@@ -0,0 +1,50 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.actas_pdf import RENDERER_ACTAS
+from accounts.models import ActaEntrega, CustomUser, Producto, Responsable
+
+
+def actas_de_prueba(lineas):
+    """Acta en memoria (sin guardar en la base) con `lineas` productos."""
+    responsable = Responsable(nombre='Jefe de Prueba')
+    generador = CustomUser(nombre='Encargado de Prueba')
+    fecha = timezone.now()
+    return [
+        ActaEntrega(
+            numero_acta=1,
+            departamento='Departamento de Pruebas',
+            responsable=responsable,
+            generador=generador,
+            fecha=fecha,
+            producto=Producto(codigo_barra=str(100000 + i), descripcion=f'Producto de prueba número {i} con descripción larga'),
+            cantidad=i + 1,
+            numero_siscom=f'S-{i}',
+            observacion='Observación\nen dos líneas' if i % 3 == 0 else '',
+        )
+        for i in range(lineas)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Mide el tiempo de generación del PDF de actas de distinto tamaño (no usa ni modifica la base de datos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lineas', type=int, nargs='+', default=[1, 50, 500], help='Cantidad de líneas de cada acta')
+        parser.add_argument('--repeticiones', type=int, default=5, help='Veces que se genera cada acta')
+
+    def handle(self, *args, **options):
+        for lineas in options['lineas']:
+            actas = actas_de_prueba(lineas)
+            tiempos = []
+            for _ in range(max(options['repeticiones'], 1)):
+                inicio = time.perf_counter()
+                pdf = RENDERER_ACTAS.renderizar(actas)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            self.stdout.write(
+                f'{lineas:>5} líneas: mínimo {min(tiempos):.0f} ms, mediana {statistics.median(tiempos):.0f} ms, '
+                f'{pdf.count(b"/Type /Page") - pdf.count(b"/Type /Pages")} páginas, {len(pdf) / 1024:.1f} KB'
+            )
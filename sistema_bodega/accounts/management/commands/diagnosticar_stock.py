@@ -76,7 +76,7 @@ class Command(BaseCommand):
                     # Crear un lote con todo el stock actual
                     lote = LoteProducto.objects.create(
                         producto=producto,
-                        numero_lote=1,
+                        numero_lote=producto.reservar_numero_lote(),
                         fecha_vencimiento=producto.fecha_vencimiento,
                         stock=producto.stock
                     )
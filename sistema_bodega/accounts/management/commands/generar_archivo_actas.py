@@ -0,0 +1,53 @@
+import os
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from accounts.archivo_actas import FORMATOS_ARCHIVO, generar_archivo_actas, numeros_actas
+
+
+class Command(BaseCommand):
+    help = ('Genera el archivo de las actas de un período (ZIP con un PDF por acta o un único PDF) '
+            'usando todos los núcleos. Si se interrumpe, al volver a ejecutarlo se retoma: '
+            'las actas ya generadas se toman de la caché de PDF')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=str, help='Primer día, en formato AAAA-MM-DD')
+        parser.add_argument('--hasta', type=str, help='Último día, en formato AAAA-MM-DD')
+        parser.add_argument('--formato', choices=FORMATOS_ARCHIVO, default='zip', help='zip (por defecto) o pdf')
+        parser.add_argument('--salida', type=str, help='Ruta del archivo a generar (por defecto Actas_<desde>_<hasta>.<formato>)')
+        parser.add_argument('--procesos', type=int, help='Procesos en paralelo (por defecto, uno por núcleo)')
+
+    def _fecha(self, valor):
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date() if valor else None
+        except ValueError:
+            raise CommandError('Las fechas deben tener el formato AAAA-MM-DD')
+
+    def handle(self, *args, **options):
+        desde = self._fecha(options['desde'])
+        hasta = self._fecha(options['hasta'])
+        formato = options['formato']
+        salida = options['salida'] or f"Actas_{desde or 'inicio'}_{hasta or 'hoy'}.{formato}"
+
+        numeros = numeros_actas(desde, hasta)
+        if not numeros:
+            raise CommandError('No hay actas en el período indicado')
+        self.stdout.write(f'{len(numeros)} actas a archivar en {salida}')
+
+        inicio = time.monotonic()
+        ultimo = {'porcentaje': -1}
+
+        def progreso(terminadas, total):
+            porcentaje = terminadas * 100 // total
+            if porcentaje != ultimo['porcentaje']:
+                ultimo['porcentaje'] = porcentaje
+                self.stdout.write(f'\r  {terminadas}/{total} actas ({porcentaje}%)', ending='')
+                self.stdout.flush()
+
+        incluidas = generar_archivo_actas(numeros, salida, formato, procesos=options['procesos'], progreso=progreso)
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {incluidas} actas archivadas en {os.path.abspath(salida)} '
+            f'({os.path.getsize(salida) / 1024 / 1024:.1f} MB) en {time.monotonic() - inicio:.1f} s'
+        ))
@@ -0,0 +1,34 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from accounts.cierres import generar_cierres
+
+
+class Command(BaseCommand):
+    help = ('Genera los cierres mensuales de stock (saldo por producto al fin de cada mes completo) '
+            'que faltan. Programar una vez al mes, p. ej. el día 1 con cron')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hasta', type=str, help='Último mes a cerrar, en formato AAAA-MM (por defecto el mes anterior)')
+        parser.add_argument(
+            '--reconstruir',
+            action='store_true',
+            help='Elimina los cierres existentes y los genera de nuevo desde el primer movimiento',
+        )
+
+    def handle(self, *args, **options):
+        hasta = None
+        if options['hasta']:
+            try:
+                hasta = datetime.strptime(options['hasta'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('El mes debe tener el formato AAAA-MM')
+
+        inicio = time.monotonic()
+        generados = generar_cierres(hasta=hasta, reconstruir=options['reconstruir'])
+        for fecha, filas in generados:
+            self.stdout.write(f'Cierre al {fecha:%d-%m-%Y}: {filas} productos')
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {len(generados)} cierres mensuales generados en {time.monotonic() - inicio:.1f} s'
+        ))
@@ -0,0 +1,55 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from accounts.importacion import importar_archivo_productos
+
+
+class Command(BaseCommand):
+    help = 'Importa productos y lotes en forma masiva desde un archivo Excel (.xlsx) o CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', type=str, help='Ruta del archivo .xlsx o .csv')
+        parser.add_argument(
+            '--simular',
+            action='store_true',
+            help='Solo valida el archivo y muestra los errores, sin guardar cambios',
+        )
+        parser.add_argument('--reporte', type=str, help='Guarda los errores encontrados en un archivo CSV')
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        if not ruta.lower().endswith(('.xlsx', '.csv')):
+            raise CommandError('El archivo debe ser .xlsx o .csv')
+
+        inicio = time.monotonic()
+        try:
+            with open(ruta, 'rb') as archivo:
+                resultado = importar_archivo_productos(archivo, ruta, simular=options['simular'])
+        except OSError as e:
+            raise CommandError(f'No se pudo abrir el archivo: {e}')
+        duracion = time.monotonic() - inicio
+
+        errores = resultado['errores']
+        for error in errores[:50]:
+            self.stdout.write(self.style.ERROR(f"Fila {error['fila']}: {error['mensaje']}"))
+        if len(errores) > 50:
+            self.stdout.write(self.style.ERROR(f'... y {len(errores) - 50} errores más'))
+
+        if options['reporte'] and errores:
+            with open(options['reporte'], 'w', newline='', encoding='utf-8') as salida:
+                escritor = csv.writer(salida)
+                escritor.writerow(['Fila', 'Error'])
+                escritor.writerows([error['fila'], error['mensaje']] for error in errores)
+            self.stdout.write(f"Reporte de errores guardado en {options['reporte']}")
+
+        if errores:
+            self.stdout.write(self.style.WARNING(f'🚨 {len(errores)} errores: no se importó ningún producto ({duracion:.1f} s)'))
+        elif resultado['guardado']:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Importados {resultado['productos']} productos y {resultado['lotes']} lotes en {duracion:.1f} s"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Archivo válido: {resultado['productos']} productos y {resultado['lotes']} lotes ({duracion:.1f} s)"
+            ))
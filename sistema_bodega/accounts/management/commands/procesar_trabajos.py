@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from accounts.trabajos import eliminar_trabajos_antiguos, procesar_pendientes, reiniciar_trabajos_interrumpidos
+
+
+class Command(BaseCommand):
+    help = ('Worker de trabajos en segundo plano (exportaciones pesadas). Queda consultando la cola; '
+            'con --una-vez procesa los pendientes y termina (apto para cron). Al iniciar devuelve a la cola '
+            'los trabajos interrumpidos por un reinicio.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa los trabajos pendientes y termina.')
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos entre consultas a la cola (por defecto 2).')
+        parser.add_argument(
+            '--reiniciar-en-proceso',
+            action='store_true',
+            help='Devuelve a pendiente todos los trabajos en proceso, aunque sean recientes.'
+        )
+        parser.add_argument('--limpiar-dias', type=int, help='Elimina los trabajos terminados hace más de N días y sus archivos.')
+
+    def handle(self, *args, **options):
+        if options['reiniciar_en_proceso'] or not options['una_vez']:
+            # Worker continuo: se asume uno solo, por lo que lo que está en proceso al iniciar quedó interrumpido.
+            # Con --una-vez (cron) otra ejecución puede seguir trabajando: sólo se reinician los que superan
+            # TRABAJOS_TIEMPO_MAXIMO.
+            reiniciados = reiniciar_trabajos_interrumpidos(timezone.now())
+        else:
+            reiniciados = reiniciar_trabajos_interrumpidos()
+        if reiniciados:
+            self.stdout.write(f'Trabajos devueltos a la cola: {reiniciados}')
+
+        if options['limpiar_dias'] is not None:
+            eliminados = eliminar_trabajos_antiguos(options['limpiar_dias'])
+            self.stdout.write(f'Trabajos antiguos eliminados: {eliminados}')
+
+        if options['una_vez']:
+            procesados = procesar_pendientes()
+            self.stdout.write(self.style.SUCCESS(f'✅ Trabajos procesados: {procesados}'))
+            return
+
+        self.stdout.write('Esperando trabajos... (Ctrl+C para detener)')
+        try:
+            while True:
+                procesados = procesar_pendientes()
+                if procesados:
+                    self.stdout.write(self.style.SUCCESS(f'✅ Trabajos procesados: {procesados}'))
+                else:
+                    time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write('Worker detenido.')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from accounts.models import Producto, Transaccion, bloquear_productos
+
+
+class Command(BaseCommand):
+    help = ('Calcula el saldo almacenado en las transacciones (bincard) de todos los productos o de uno. '
+            'Ejecutar una vez tras actualizar y después de corregir movimientos por fuera del sistema')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codigo', type=str, help='Código de barra de un producto específico')
+        parser.add_argument(
+            '--solo-pendientes',
+            action='store_true',
+            help='Sólo productos con movimientos sin saldo calculado',
+        )
+
+    def handle(self, *args, **options):
+        transacciones = Transaccion.objects.all()
+        if options['codigo']:
+            if not Producto.objects.filter(codigo_barra=options['codigo']).exists():
+                raise CommandError(f"Producto {options['codigo']} no encontrado")
+            transacciones = transacciones.filter(producto__codigo_barra=options['codigo'])
+        if options['solo_pendientes']:
+            transacciones = transacciones.filter(saldo__isnull=True)
+
+        ids = list(transacciones.order_by('producto_id').values_list('producto_id', flat=True).distinct())
+        total = len(ids)
+        for numero, producto_id in enumerate(ids, start=1):
+            # Cada producto en su propia transacción, bloqueado mientras se recalcula
+            with transaction.atomic():
+                bloquear_productos(Producto.objects.filter(pk=producto_id))
+                Transaccion.recalcular_saldos(producto_id)
+            if numero % 100 == 0 or numero == total:
+                self.stdout.write(f'{numero}/{total} productos procesados')
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Saldos recalculados para {total} productos'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from accounts.models import Secuencia
+
+
+class Command(BaseCommand):
+    help = ('Adelanta las secuencias de códigos de barra, actas y lotes hasta el mayor valor usado '
+            '(ejecutar tras restaurar un respaldo o cargar datos por fuera del sistema)')
+
+    def handle(self, *args, **options):
+        ajustadas = Secuencia.sincronizar()
+        for secuencia in Secuencia.objects.exclude(nombre__startswith=Secuencia.PREFIJO_LOTE):
+            self.stdout.write(f"{secuencia.nombre}: próximo valor {secuencia.ultimo + 1}")
+        self.stdout.write(self.style.SUCCESS(f'✅ Secuencias ajustadas: {ajustadas}'))
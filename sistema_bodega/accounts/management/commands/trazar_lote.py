@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import Producto
+from accounts.reportes import COLUMNAS_TRAZABILIDAD, CAMPOS_TRAZABILIDAD, filas_trazabilidad_lote
+from accounts.exportacion import iterar_datos, lineas_csv, lineas_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Lista las actas, departamentos y responsables que recibieron unidades de un lote (retiro de lotes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('codigo_barra', type=str, help='Código de barra del producto')
+        parser.add_argument('numero_lote', type=int, help='Número de lote del producto')
+        parser.add_argument(
+            '--formato',
+            choices=['texto', 'csv', 'ndjson'],
+            default='texto',
+            help='Formato de salida (por defecto texto legible)'
+        )
+
+    def handle(self, *args, **options):
+        codigo = options['codigo_barra']
+        numero_lote = options['numero_lote']
+        if not Producto.objects.filter(codigo_barra=codigo).exists():
+            raise CommandError(f'Producto no encontrado: {codigo}')
+
+        filas = iterar_datos(filas_trazabilidad_lote(codigo, numero_lote))
+        if options['formato'] != 'texto':
+            if options['formato'] == 'csv':
+                lineas = lineas_csv(COLUMNAS_TRAZABILIDAD, filas)
+            else:
+                lineas = lineas_ndjson(CAMPOS_TRAZABILIDAD, filas)
+            for linea in lineas:
+                self.stdout.write(linea, ending='')
+            return
+
+        self.stdout.write(f"=== TRAZABILIDAD PRODUCTO {codigo} - LOTE #{numero_lote} ===")
+        total = 0
+        actas = set()
+        for numero_acta, fecha, departamento, responsable, generador, _, _, cantidad in filas:
+            self.stdout.write(
+                f"Acta N°{numero_acta} | {fecha:%d/%m/%Y %H:%M} | {departamento} | "
+                f"Responsable: {responsable or '-'} | Generador: {generador or '-'} | Cantidad: {cantidad}"
+            )
+            total += cantidad
+            actas.add(numero_acta)
+        if not actas:
+            self.stdout.write(self.style.WARNING('No hay entregas registradas para este lote.'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} unidades entregadas en {len(actas)} actas'))
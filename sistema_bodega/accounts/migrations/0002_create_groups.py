@@ -1,7 +1,14 @@
 from django.db import migrations
+from django.contrib.auth.management import create_permissions
 from django.contrib.auth.models import Group, Permission
 
 def create_groups(apps, schema_editor):
+    # En una base nueva (p. ej. la de las pruebas) los permisos se crean recién al terminar de migrar
+    app_config = apps.get_app_config('accounts')
+    app_config.models_module = True
+    create_permissions(app_config, verbosity=0, apps=apps)
+    app_config.models_module = None
+
     # Crear grupos
     admin_group, _ = Group.objects.get_or_create(name='Administrador')
     bodega_group, _ = Group.objects.get_or_create(name='Usuario de Bodega')
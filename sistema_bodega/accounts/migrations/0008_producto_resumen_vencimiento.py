@@ -0,0 +1,79 @@
+# Generated by Django 5.0.3 on 2026-10-17 17:42
+
+from datetime import date
+
+from django.db import migrations, models
+
+
+def calcular_estado(fecha, hoy):
+    if fecha is None:
+        return 'Sin Vencimiento'
+    dias = (fecha - hoy).days
+    if dias < 0:
+        return 'Vencido'
+    elif dias == 0:
+        return 'Vence Hoy'
+    elif dias <= 7:
+        return 'Crítico'
+    elif dias <= 30:
+        return 'Precaución'
+    return 'Normal'
+
+
+def poblar_resumen_vencimiento(apps, schema_editor):
+    """Calcula el resumen de vencimiento de los productos existentes con una consulta agrupada."""
+    Producto = apps.get_model('accounts', 'Producto')
+    LoteProducto = apps.get_model('accounts', 'LoteProducto')
+    hoy = date.today()
+
+    resumen_lotes = {
+        fila['producto_id']: fila
+        for fila in LoteProducto.objects.filter(stock__gt=0).order_by().values('producto_id').annotate(
+            proximo=models.Min('fecha_vencimiento'),
+            activos=models.Count('id'),
+        )
+    }
+
+    productos = list(Producto.objects.filter(tiene_vencimiento=True))
+    for producto in productos:
+        fila = resumen_lotes.get(producto.pk)
+        producto.proximo_vencimiento = (fila['proximo'] if fila else None) or producto.fecha_vencimiento
+        producto.estado_vencimiento = calcular_estado(producto.proximo_vencimiento, hoy)
+        producto.lotes_activos = fila['activos'] if fila else 0
+    Producto.objects.bulk_update(
+        productos, ['proximo_vencimiento', 'estado_vencimiento', 'lotes_activos'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_alter_loteproducto_numero_lote_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='estado_vencimiento',
+            field=models.CharField(choices=[('Vencido', 'Vencido'), ('Vence Hoy', 'Vence Hoy'), ('Crítico', 'Crítico'), ('Precaución', 'Precaución'), ('Normal', 'Normal'), ('Sin Vencimiento', 'Sin Vencimiento')], default='Sin Vencimiento', editable=False, max_length=20, verbose_name='Estado de vencimiento'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='lotes_activos',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Lotes activos'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='proximo_vencimiento',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Próximo vencimiento'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['tiene_vencimiento', 'estado_vencimiento'], name='idx_producto_estado_venc'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['proximo_vencimiento'], name='idx_producto_prox_venc'),
+        ),
+        migrations.RunPython(poblar_resumen_vencimiento, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.3 on 2026-10-17 17:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_producto_resumen_vencimiento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trabajo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50, verbose_name='Tipo de trabajo')),
+                ('formato', models.CharField(choices=[('xlsx', 'Excel'), ('csv', 'CSV'), ('ndjson', 'NDJSON')], default='xlsx', max_length=10)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('progreso', models.PositiveIntegerField(default=0, verbose_name='Filas procesadas')),
+                ('total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Filas estimadas')),
+                ('archivo', models.CharField(blank=True, max_length=255, verbose_name='Archivo generado')),
+                ('nombre_archivo', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('finalizado', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo en segundo plano',
+                'verbose_name_plural': 'Trabajos en segundo plano',
+                'ordering': ['-creado'],
+                'indexes': [models.Index(fields=['estado', 'creado'], name='idx_trabajo_estado')],
+            },
+        ),
+    ]
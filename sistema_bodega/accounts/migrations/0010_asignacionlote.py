@@ -0,0 +1,31 @@
+# Generated by Django 5.0.3 on 2026-10-17 17:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_trabajo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AsignacionLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero_lote', models.IntegerField(verbose_name='Número de lote')),
+                ('fecha_vencimiento', models.DateField(verbose_name='Fecha de vencimiento del lote')),
+                ('cantidad', models.PositiveIntegerField()),
+                ('acta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asignaciones_lote', to='accounts.actaentrega')),
+                ('lote', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='asignaciones', to='accounts.loteproducto')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asignaciones_lote', to='accounts.producto')),
+            ],
+            options={
+                'verbose_name': 'Asignación de lote',
+                'verbose_name_plural': 'Asignaciones de lotes',
+                'indexes': [models.Index(fields=['producto', 'numero_lote'], name='idx_asignacion_lote')],
+            },
+        ),
+    ]
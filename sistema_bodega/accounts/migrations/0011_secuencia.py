@@ -0,0 +1,24 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_asignacionlote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Secuencia',
+            fields=[
+                ('nombre', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('ultimo', models.BigIntegerField(default=0, verbose_name='Último valor asignado')),
+            ],
+            options={
+                'verbose_name': 'Secuencia',
+                'verbose_name_plural': 'Secuencias',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_secuencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecepcionStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero', models.PositiveIntegerField(unique=True, verbose_name='N° de recepción')),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('rut_proveedor', models.CharField(blank=True, max_length=12)),
+                ('guia_despacho', models.CharField(blank=True, max_length=50)),
+                ('numero_factura', models.CharField(blank=True, max_length=50)),
+                ('orden_compra', models.CharField(blank=True, max_length=50)),
+                ('observacion', models.TextField(blank=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recepciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Recepción de Stock',
+                'verbose_name_plural': 'Recepciones de Stock',
+                'ordering': ['-numero'],
+            },
+        ),
+        migrations.AddField(
+            model_name='transaccion',
+            name='recepcion',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transacciones', to='accounts.recepcionstock'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_recepcionstock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaccion',
+            name='saldo',
+            field=models.IntegerField(blank=True, help_text='Saldo del bincard del producto después de este movimiento', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaccion',
+            index=models.Index(fields=['producto', 'fecha', 'tipo'], name='idx_transaccion_bincard'),
+        ),
+    ]
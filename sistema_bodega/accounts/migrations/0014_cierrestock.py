@@ -0,0 +1,45 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_transaccion_saldo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CierreStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Último día del mes')),
+                ('saldo', models.IntegerField()),
+                ('entradas', models.PositiveIntegerField(default=0, verbose_name='Entradas del mes')),
+                ('salidas', models.PositiveIntegerField(default=0, verbose_name='Salidas del mes')),
+            ],
+            options={
+                'verbose_name': 'Cierre de stock',
+                'verbose_name_plural': 'Cierres de stock',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transaccion',
+            index=models.Index(fields=['fecha'], name='idx_transaccion_fecha'),
+        ),
+        migrations.AddField(
+            model_name='cierrestock',
+            name='producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cierres', to='accounts.producto'),
+        ),
+        migrations.AddIndex(
+            model_name='cierrestock',
+            index=models.Index(fields=['fecha'], name='idx_cierre_fecha'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cierrestock',
+            unique_together={('producto', 'fecha')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_cierrestock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajo',
+            name='formato',
+            field=models.CharField(choices=[('xlsx', 'Excel'), ('csv', 'CSV'), ('ndjson', 'NDJSON'), ('zip', 'ZIP'), ('pdf', 'PDF')], default='xlsx', max_length=10),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def crear_encabezados(apps, schema_editor):
+    """Un encabezado por número de acta, con los datos de su primera línea, y enlace de todas las líneas."""
+    ActaEntrega = apps.get_model('accounts', 'ActaEntrega')
+    EncabezadoActa = apps.get_model('accounts', 'EncabezadoActa')
+
+    primeras = ActaEntrega.objects.order_by().values('numero_acta').annotate(primera=models.Min('id')).values('primera')
+    datos = (
+        ActaEntrega.objects.filter(id__in=primeras)
+        .order_by('numero_acta')
+        .values('numero_acta', 'fecha', 'departamento', 'responsable_id', 'generador_id')
+    )
+    EncabezadoActa.objects.bulk_create((EncabezadoActa(**fila) for fila in datos.iterator()), batch_size=500)
+
+    ActaEntrega.objects.update(encabezado=models.Subquery(
+        EncabezadoActa.objects.filter(numero_acta=models.OuterRef('numero_acta')).values('pk')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_formatos_archivo_actas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncabezadoActa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero_acta', models.IntegerField(unique=True, verbose_name='N° de acta')),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('departamento', models.CharField(max_length=100)),
+                ('generador', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='encabezados_acta_generados', to=settings.AUTH_USER_MODEL, verbose_name='Generador')),
+                ('responsable', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='encabezados_acta', to='accounts.responsable', verbose_name='Responsable')),
+            ],
+            options={
+                'verbose_name': 'Acta de entrega',
+                'verbose_name_plural': 'Actas de entrega',
+                'ordering': ['-numero_acta'],
+            },
+        ),
+        migrations.AlterModelOptions(
+            name='actaentrega',
+            options={'verbose_name': 'Línea de acta', 'verbose_name_plural': 'Líneas de acta'},
+        ),
+        migrations.AddField(
+            model_name='actaentrega',
+            name='encabezado',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lineas', to='accounts.encabezadoacta', verbose_name='Acta'),
+        ),
+        migrations.AddIndex(
+            model_name='encabezadoacta',
+            index=models.Index(fields=['fecha'], name='idx_encabezado_acta_fecha'),
+        ),
+        migrations.RunPython(crear_encabezados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+from django.db import migrations
+
+CREAR_INDICE = [
+    """
+    CREATE VIRTUAL TABLE accounts_producto_fts USING fts5(
+        codigo_barra, descripcion, categoria,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO accounts_producto_fts (rowid, codigo_barra, descripcion, categoria)
+    SELECT p.id, p.codigo_barra, p.descripcion, c.nombre
+    FROM accounts_producto p LEFT JOIN accounts_categoria c ON c.id = p.categoria_id
+    """,
+    """
+    CREATE TRIGGER accounts_producto_fts_insert AFTER INSERT ON accounts_producto BEGIN
+        INSERT INTO accounts_producto_fts (rowid, codigo_barra, descripcion, categoria)
+        VALUES (new.id, new.codigo_barra, new.descripcion,
+                (SELECT nombre FROM accounts_categoria WHERE id = new.categoria_id));
+    END
+    """,
+    # Sólo cuando cambian los campos indexados (no en cada cambio de stock)
+    """
+    CREATE TRIGGER accounts_producto_fts_update AFTER UPDATE OF codigo_barra, descripcion, categoria_id
+    ON accounts_producto
+    WHEN old.codigo_barra IS NOT new.codigo_barra
+      OR old.descripcion IS NOT new.descripcion
+      OR old.categoria_id IS NOT new.categoria_id
+    BEGIN
+        UPDATE accounts_producto_fts
+        SET codigo_barra = new.codigo_barra,
+            descripcion = new.descripcion,
+            categoria = (SELECT nombre FROM accounts_categoria WHERE id = new.categoria_id)
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER accounts_producto_fts_delete AFTER DELETE ON accounts_producto BEGIN
+        DELETE FROM accounts_producto_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER accounts_categoria_fts_update AFTER UPDATE OF nombre ON accounts_categoria
+    WHEN old.nombre IS NOT new.nombre
+    BEGIN
+        UPDATE accounts_producto_fts SET categoria = new.nombre
+        WHERE rowid IN (SELECT id FROM accounts_producto WHERE categoria_id = new.id);
+    END
+    """,
+]
+
+ELIMINAR_INDICE = [
+    "DROP TRIGGER IF EXISTS accounts_categoria_fts_update",
+    "DROP TRIGGER IF EXISTS accounts_producto_fts_delete",
+    "DROP TRIGGER IF EXISTS accounts_producto_fts_update",
+    "DROP TRIGGER IF EXISTS accounts_producto_fts_insert",
+    "DROP TABLE IF EXISTS accounts_producto_fts",
+]
+
+
+def ejecutar(sentencias):
+    def operacion(apps, schema_editor):
+        # El índice de texto completo es propio de SQLite; en otros motores la búsqueda usa icontains
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sentencia in sentencias:
+            schema_editor.execute(sentencia)
+    return operacion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_encabezadoacta'),
+    ]
+
+    operations = [
+        migrations.RunPython(ejecutar(CREAR_INDICE), ejecutar(ELIMINAR_INDICE)),
+    ]
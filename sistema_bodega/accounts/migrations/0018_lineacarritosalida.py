@@ -0,0 +1,33 @@
+# Generated by Django 5.0.3 on 2026-10-17 18:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_busqueda_productos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LineaCarritoSalida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero_siscom', models.CharField(blank=True, max_length=50)),
+                ('cantidad', models.PositiveIntegerField(blank=True, null=True)),
+                ('observacion', models.TextField(blank=True)),
+                ('agregado', models.DateTimeField(auto_now_add=True)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineas_carrito', to='accounts.producto')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='carrito_salida', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Línea del carrito de salida',
+                'verbose_name_plural': 'Líneas del carrito de salida',
+                'ordering': ['agregado', 'id'],
+                'unique_together': {('usuario', 'producto')},
+            },
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Cast, Greatest
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .cache_inventario import incrementar_version_inventario
 
 # Funciones para RUT
 def clean_rut(rut):
@@ -62,26 +66,140 @@ class CustomUser(AbstractUser):
             ("can_edit", "Edición de registros"),
         ]
 
+# Estados de vencimiento ordenados de más a menos crítico
+ESTADOS_VENCIMIENTO = [
+    ('Vencido', 'Vencido'),
+    ('Vence Hoy', 'Vence Hoy'),
+    ('Crítico', 'Crítico'),
+    ('Precaución', 'Precaución'),
+    ('Normal', 'Normal'),
+    ('Sin Vencimiento', 'Sin Vencimiento'),
+]
+
+def calcular_estado_vencimiento(fecha_vencimiento, hoy=None):
+    """Determina el estado de vencimiento de una fecha respecto al día actual."""
+    if fecha_vencimiento is None:
+        return "Sin Vencimiento"
+    hoy = hoy or timezone.localdate()
+    dias_restantes = (fecha_vencimiento - hoy).days
+
+    if dias_restantes < 0:
+        return "Vencido"
+    elif dias_restantes == 0:
+        return "Vence Hoy"
+    elif dias_restantes <= 7:
+        return "Crítico"
+    elif dias_restantes <= 30:
+        return "Precaución"
+    return "Normal"
+
+def expresion_estado_vencimiento(campo, hoy=None):
+    """Expresión SQL (Case/When) equivalente a calcular_estado_vencimiento sobre un campo de fecha."""
+    from datetime import timedelta
+    hoy = hoy or timezone.localdate()
+    return models.Case(
+        models.When(**{f'{campo}__isnull': True}, then=models.Value('Sin Vencimiento')),
+        models.When(**{f'{campo}__lt': hoy}, then=models.Value('Vencido')),
+        models.When(**{campo: hoy}, then=models.Value('Vence Hoy')),
+        models.When(**{f'{campo}__lte': hoy + timedelta(days=7)}, then=models.Value('Crítico')),
+        models.When(**{f'{campo}__lte': hoy + timedelta(days=30)}, then=models.Value('Precaución')),
+        default=models.Value('Normal'),
+        output_field=models.CharField(),
+    )
+
+def filtro_estado_vencimiento(estado, campo, hoy=None):
+    """Filtro Q por rango de fechas equivalente a un estado de vencimiento (aprovecha el índice del campo)."""
+    from datetime import timedelta
+    hoy = hoy or timezone.localdate()
+    rangos = {
+        'Sin Vencimiento': {f'{campo}__isnull': True},
+        'Vencido': {f'{campo}__lt': hoy},
+        'Vence Hoy': {campo: hoy},
+        'Crítico': {f'{campo}__gt': hoy, f'{campo}__lte': hoy + timedelta(days=7)},
+        'Precaución': {f'{campo}__gt': hoy + timedelta(days=7), f'{campo}__lte': hoy + timedelta(days=30)},
+        'Normal': {f'{campo}__gt': hoy + timedelta(days=30)},
+    }
+    return models.Q(**rangos[estado])
+
+def bloquear_productos(productos):
+    """
+    Bloquea las filas del queryset de productos hasta el fin de la transacción.
+    En SQLite, que ignora select_for_update, una escritura sin efecto toma el
+    bloqueo de escritura de la base.
+    """
+    if transaction.get_connection().vendor == 'sqlite':
+        productos.update(stock=models.F('stock'))
+    else:
+        list(productos.select_for_update().values_list('pk', flat=True))
+
+class ProductoQuerySet(models.QuerySet):
+    """Consultas de productos con precarga de lotes para evitar N+1."""
+
+    def con_estado_vencimiento(self, hoy=None):
+        """
+        Anota `estado_vencimiento_actual` y `orden_vencimiento` calculados en SQL
+        desde `proximo_vencimiento`, sin depender de la actualización diaria.
+        """
+        hoy = hoy or timezone.localdate()
+        return self.annotate(
+            estado_vencimiento_actual=expresion_estado_vencimiento('proximo_vencimiento', hoy),
+            # Vencidos y sin fecha comparten el primer lugar, como en el orden por días restantes
+            orden_vencimiento=models.Case(
+                models.When(proximo_vencimiento__isnull=True, then=models.Value(hoy)),
+                models.When(proximo_vencimiento__lt=hoy, then=models.Value(hoy)),
+                default=models.F('proximo_vencimiento'),
+                output_field=models.DateField(),
+            ),
+        )
+
+    def por_estado_vencimiento(self, estados, hoy=None):
+        """Filtra por uno o varios estados de vencimiento usando rangos sobre `proximo_vencimiento`."""
+        filtro = models.Q(pk__in=[])
+        for estado in estados:
+            filtro |= filtro_estado_vencimiento(estado, 'proximo_vencimiento', hoy)
+        return self.filter(filtro)
+
+    def con_lotes_activos(self):
+        """Precarga en `lotes_activos_precargados` los lotes con stock, ordenados FIFO."""
+        return self.prefetch_related(Producto.prefetch_lotes_activos())
+
+    def con_lotes(self):
+        """Precarga en `lotes_precargados` todos los lotes (incluidos los vacíos)."""
+        return self.prefetch_related(Producto.prefetch_lotes())
+
 # Modelos de inventario
 class Producto(models.Model):
     codigo_barra = models.CharField(max_length=50, unique=True)
 
+    objects = ProductoQuerySet.as_manager()
+
     @staticmethod
     def get_next_codigo_barra():
-        """Obtiene el siguiente código de barra correlativo, partiendo desde 100000."""
-        ultimo = Producto.objects.order_by('-codigo_barra').first()
-        try:
-            ultimo_num = int(ultimo.codigo_barra)
-            if ultimo_num < 100000:
-                return '100000'
-            return str(ultimo_num + 1)
-        except (AttributeError, ValueError):
-            return '100000'
+        """Obtiene el siguiente código de barra correlativo (desde 100000) sin reservarlo."""
+        return str(Secuencia.consultar_siguiente(Secuencia.CODIGO_BARRA))
 
-    def save(self, *args, **kwargs):
-        # Asignar automáticamente el código de barra si no está definido
+    def registrar_codigo_barra(self):
+        """Asigna el próximo código correlativo si no tiene uno; si se ingresó uno numérico, adelanta la secuencia."""
         if not self.codigo_barra:
-            self.codigo_barra = Producto.get_next_codigo_barra()
+            self.codigo_barra = str(Secuencia.siguiente(Secuencia.CODIGO_BARRA))
+        elif Secuencia.es_codigo_numerico(self.codigo_barra):
+            Secuencia.asegurar_minimo(Secuencia.CODIGO_BARRA, int(self.codigo_barra))
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            # El código se reserva en la misma transacción del INSERT: si éste falla, el número no se pierde
+            with transaction.atomic():
+                self.registrar_codigo_barra()
+                self._guardar(*args, **kwargs)
+        else:
+            self._guardar(*args, **kwargs)
+
+    def _guardar(self, *args, **kwargs):
+        # Mantener sincronizado el resumen de vencimiento desnormalizado
+        self.calcular_resumen_vencimiento()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'proximo_vencimiento', 'estado_vencimiento', 'lotes_activos'}
         super().save(*args, **kwargs)
     descripcion = models.CharField(max_length=200)
     stock = models.IntegerField(default=0, db_index=True)
@@ -93,6 +211,16 @@ class Producto(models.Model):
     # Campos para control de vencimiento
     tiene_vencimiento = models.BooleanField(default=False, verbose_name="¿Tiene fecha de vencimiento?")
     fecha_vencimiento = models.DateField(null=True, blank=True, verbose_name="Fecha de vencimiento")
+    # Resumen desnormalizado de los lotes activos (se actualiza en cada escritura de lotes)
+    proximo_vencimiento = models.DateField(null=True, blank=True, editable=False, verbose_name="Próximo vencimiento")
+    estado_vencimiento = models.CharField(
+        max_length=20,
+        choices=ESTADOS_VENCIMIENTO,
+        default='Sin Vencimiento',
+        editable=False,
+        verbose_name="Estado de vencimiento"
+    )
+    lotes_activos = models.PositiveIntegerField(default=0, editable=False, verbose_name="Lotes activos")
 
     def get_stock_category(self):
         """Clasifica stock: Sin Stock, Bajo, Medio, Alto."""
@@ -116,19 +244,7 @@ class Producto(models.Model):
         """Determina el estado de vencimiento del producto."""
         if not self.tiene_vencimiento or not self.fecha_vencimiento:
             return "Sin Vencimiento"
-        
-        dias_restantes = self.get_dias_para_vencer()
-        
-        if dias_restantes < 0:
-            return "Vencido"
-        elif dias_restantes == 0:
-            return "Vence Hoy"
-        elif dias_restantes <= 7:
-            return "Crítico"
-        elif dias_restantes <= 30:
-            return "Precaución"
-        else:
-            return "Normal"
+        return calcular_estado_vencimiento(self.fecha_vencimiento)
 
     def get_color_estado_vencimiento(self):
         """Retorna el color CSS para el estado de vencimiento."""
@@ -144,14 +260,15 @@ class Producto(models.Model):
         return colores.get(estado, '#6c757d')
 
     def get_proximo_numero_lote(self):
-        """Obtiene el siguiente número de lote automáticamente SIN eliminar lotes."""
+        """Obtiene el siguiente número de lote (sin reservarlo) para mostrarlo al usuario."""
         if not self.tiene_vencimiento:
             return None
-        
-        # SOLUCIÓN CORREGIDA: NO eliminar lotes, solo calcular el próximo número
-        # Obtener el último número de lote usado (incluye lotes con stock=0 para preservar trazabilidad)
-        ultimo_lote = self.lotes.aggregate(max_lote=models.Max('numero_lote'))['max_lote']
-        return (ultimo_lote or 0) + 1
+        # La secuencia parte del mayor número usado, incluidos los lotes con stock=0 (trazabilidad)
+        return Secuencia.consultar_siguiente(Secuencia.nombre_lote(self.pk))
+
+    def reservar_numero_lote(self):
+        """Reserva el siguiente número de lote; llamar dentro de la transacción que crea el lote."""
+        return Secuencia.siguiente(Secuencia.nombre_lote(self.pk))
 
     def marcar_lotes_vencidos(self):
         """Marca lotes vencidos pero NO los elimina (preserva trazabilidad)."""
@@ -185,24 +302,21 @@ class Producto(models.Model):
         if not self.tiene_vencimiento:
             raise ValueError("No se pueden crear lotes para productos sin fecha de vencimiento")
         
-        if numero_lote_personalizado:
-            # Validar que el número de lote personalizado no exista
-            if self.lotes.filter(numero_lote=numero_lote_personalizado).exists():
-                raise ValueError(f"Ya existe un lote con el número {numero_lote_personalizado} para este producto")
-            numero_lote = numero_lote_personalizado
-        else:
-            numero_lote = self.get_proximo_numero_lote()
-            
-        lote = LoteProducto.objects.create(
-            producto=self,
-            numero_lote=numero_lote,
-            fecha_vencimiento=fecha_vencimiento,
-            stock=cantidad
-        )
-        
-        # CRÍTICO: Actualizar el stock del producto de forma sincronizada
-        self.stock += cantidad
-        self.save()
+        with transaction.atomic():
+            numero_lote = self._numero_para_nuevo_lote(numero_lote_personalizado)
+
+            lote = LoteProducto(
+                producto=self,
+                numero_lote=numero_lote,
+                fecha_vencimiento=fecha_vencimiento,
+                stock=cantidad
+            )
+            # El resumen de vencimiento se recalcula en self.save()
+            lote.save(actualizar_producto=False)
+
+            # CRÍTICO: Actualizar el stock del producto de forma sincronizada
+            self.stock += cantidad
+            self.save()
         
         return lote
 
@@ -211,28 +325,69 @@ class Producto(models.Model):
         if not self.tiene_vencimiento:
             raise ValueError("No se pueden crear lotes para productos sin fecha de vencimiento")
         
-        if numero_lote_personalizado:
-            # Validar que el número de lote personalizado no exista
-            if self.lotes.filter(numero_lote=numero_lote_personalizado).exists():
-                raise ValueError(f"Ya existe un lote con el número {numero_lote_personalizado} para este producto")
-            numero_lote = numero_lote_personalizado
-        else:
-            numero_lote = self.get_proximo_numero_lote()
-            
-        # Crear el lote
-        lote = LoteProducto.objects.create(
-            producto=self,
-            numero_lote=numero_lote,
-            fecha_vencimiento=fecha_vencimiento,
-            stock=cantidad
-        )
-        
-        # CRÍTICO: Agregar stock al producto (para productos existentes)
-        self.stock += cantidad
-        self.save()
+        with transaction.atomic():
+            numero_lote = self._numero_para_nuevo_lote(numero_lote_personalizado)
+
+            # Crear el lote (el resumen de vencimiento se recalcula en self.save())
+            lote = LoteProducto(
+                producto=self,
+                numero_lote=numero_lote,
+                fecha_vencimiento=fecha_vencimiento,
+                stock=cantidad
+            )
+            lote.save(actualizar_producto=False)
+
+            # CRÍTICO: Agregar stock al producto (para productos existentes)
+            self.stock += cantidad
+            self.save()
         
         return lote
 
+    def _numero_para_nuevo_lote(self, numero_lote_personalizado=None):
+        """Número del lote a crear: el personalizado (validado) o el siguiente de la secuencia."""
+        if not numero_lote_personalizado:
+            return self.reservar_numero_lote()
+        # Validar que el número de lote personalizado no exista
+        if self.lotes.filter(numero_lote=numero_lote_personalizado).exists():
+            raise ValueError(f"Ya existe un lote con el número {numero_lote_personalizado} para este producto")
+        # Los números automáticos siguientes no deben chocar con el personalizado
+        Secuencia.asegurar_minimo(Secuencia.nombre_lote(self.pk), numero_lote_personalizado)
+        return numero_lote_personalizado
+
+    @staticmethod
+    def prefetch_lotes_activos():
+        """Prefetch de los lotes con stock ordenados FIFO (ver ProductoQuerySet.con_lotes_activos)."""
+        return models.Prefetch(
+            'lotes',
+            queryset=LoteProducto.objects.filter(stock__gt=0).order_by('fecha_vencimiento'),
+            to_attr='lotes_activos_precargados'
+        )
+
+    @staticmethod
+    def prefetch_lotes():
+        """Prefetch de todos los lotes ordenados por vencimiento (ver ProductoQuerySet.con_lotes)."""
+        return models.Prefetch(
+            'lotes',
+            queryset=LoteProducto.objects.order_by('fecha_vencimiento'),
+            to_attr='lotes_precargados'
+        )
+
+    def get_lotes(self):
+        """Obtiene todos los lotes ordenados por vencimiento, usando la precarga si existe."""
+        if hasattr(self, 'lotes_precargados'):
+            return self.lotes_precargados
+        if 'lotes' in getattr(self, '_prefetched_objects_cache', {}):
+            return sorted(self.lotes.all(), key=lambda lote: lote.fecha_vencimiento)
+        return list(self.lotes.all().order_by('fecha_vencimiento'))
+
+    def get_lotes_activos(self):
+        """Obtiene los lotes con stock ordenados FIFO, usando la precarga si existe."""
+        if hasattr(self, 'lotes_activos_precargados'):
+            return self.lotes_activos_precargados
+        if hasattr(self, 'lotes_precargados') or 'lotes' in getattr(self, '_prefetched_objects_cache', {}):
+            return [lote for lote in self.get_lotes() if lote.stock > 0]
+        return list(self.get_lotes_con_stock())
+
     def get_lotes_con_stock(self):
         """Obtiene todos los lotes que tienen stock, ordenados por fecha de vencimiento (FIFO)."""
         return self.lotes.filter(stock__gt=0).order_by('fecha_vencimiento')
@@ -266,13 +421,13 @@ class Producto(models.Model):
             if lote.stock >= cantidad_restante:
                 # Este lote tiene suficiente stock
                 lote.stock -= cantidad_restante
-                lote.save()
+                lote.save(actualizar_producto=False)
                 cantidad_restante = 0
             else:
                 # Usar todo el stock de este lote y continuar con el siguiente
                 cantidad_restante -= lote.stock
                 lote.stock = 0
-                lote.save()
+                lote.save(actualizar_producto=False)
         
         # CORRECCIÓN CRÍTICA: Sincronizar stock total SIN eliminar lotes
         # Esto preserva la trazabilidad para el Bincard
@@ -303,7 +458,8 @@ class Producto(models.Model):
         if not self.tiene_vencimiento:
             return "Sin Vencimiento"
         
-        if not self.lotes.filter(stock__gt=0).exists():
+        lotes_activos = self.get_lotes_activos()
+        if not lotes_activos:
             # Si no hay lotes con stock, usar fecha del producto principal
             return self.get_estado_vencimiento()
         
@@ -312,7 +468,7 @@ class Producto(models.Model):
         estado_mas_critico = 'Normal'
         peso_max = 0
         
-        for lote in self.lotes.filter(stock__gt=0):
+        for lote in lotes_activos:
             estado_lote = lote.get_estado_vencimiento()
             peso_lote = estados_peso.get(estado_lote, 0)
             if peso_lote > peso_max:
@@ -321,76 +477,111 @@ class Producto(models.Model):
         
         return estado_mas_critico
 
+    @staticmethod
+    def _detalle_lote(lote):
+        dias_restantes = lote.get_dias_para_vencer()
+        return {
+            'numero_lote': lote.numero_lote,
+            'fecha_vencimiento': lote.fecha_vencimiento,
+            'stock': lote.stock,
+            'dias_restantes': dias_restantes,
+            'estado': lote.get_estado_vencimiento(),
+            'color': lote.get_color_estado_vencimiento(),
+            'esta_vacio': lote.stock == 0,  # Indica si el lote está vacío
+            'esta_vencido': dias_restantes < 0
+        }
+
     def get_lotes_detalle(self):
         """Obtiene detalle de todos los lotes con información de vencimiento."""
-        lotes_detalle = []
-        for lote in self.lotes.all().order_by('fecha_vencimiento'):  # Incluye TODOS los lotes, incluso con stock=0
-            lotes_detalle.append({
-                'numero_lote': lote.numero_lote,
-                'fecha_vencimiento': lote.fecha_vencimiento,
-                'stock': lote.stock,
-                'dias_restantes': lote.get_dias_para_vencer(),
-                'estado': lote.get_estado_vencimiento(),
-                'color': lote.get_color_estado_vencimiento(),
-                'esta_vacio': lote.stock == 0,  # Indica si el lote está vacío
-                'esta_vencido': lote.get_dias_para_vencer() < 0 if lote.get_dias_para_vencer() is not None else False
-            })
-        return lotes_detalle
+        # Incluye TODOS los lotes, incluso con stock=0
+        return [self._detalle_lote(lote) for lote in self.get_lotes()]
 
     def get_lotes_activos_detalle(self):
         """Obtiene detalle solo de los lotes con stock > 0 para gestión."""
-        lotes_detalle = []
-        for lote in self.lotes.filter(stock__gt=0).order_by('fecha_vencimiento'):  # Solo lotes con stock
-            lotes_detalle.append({
-                'numero_lote': lote.numero_lote,
-                'fecha_vencimiento': lote.fecha_vencimiento,
-                'stock': lote.stock,
-                'dias_restantes': lote.get_dias_para_vencer(),
-                'estado': lote.get_estado_vencimiento(),
-                'color': lote.get_color_estado_vencimiento(),
-                'esta_vacio': False,  # Por definición, estos lotes no están vacíos
-                'esta_vencido': lote.get_dias_para_vencer() < 0 if lote.get_dias_para_vencer() is not None else False
-            })
-        return lotes_detalle
+        return [self._detalle_lote(lote) for lote in self.get_lotes_activos()]
 
     def get_total_lotes_activos(self):
         """Obtiene el número de lotes que tienen stock > 0."""
+        if hasattr(self, 'lotes_activos_precargados') or hasattr(self, 'lotes_precargados'):
+            return len(self.get_lotes_activos())
         return self.lotes.filter(stock__gt=0).count()
 
     def get_estadisticas_lotes(self):
         """Obtiene estadísticas completas de los lotes del producto."""
         if not self.tiene_vencimiento:
             return None
-            
-        total_lotes = self.lotes.count()
-        lotes_con_stock = self.lotes.filter(stock__gt=0).count()
-        lotes_vacios = self.lotes.filter(stock=0).count()
-        lotes_vencidos_con_stock = self.get_lotes_vencidos_con_stock().count()
         
         from datetime import date, timedelta
         hoy = date.today()
-        lotes_criticos = self.lotes.filter(
-            fecha_vencimiento__lte=hoy + timedelta(days=7),
-            fecha_vencimiento__gte=hoy,
-            stock__gt=0
-        ).count()
+        limite_critico = hoy + timedelta(days=7)
+        lotes = self.get_lotes()
+        lotes_con_stock = [lote for lote in lotes if lote.stock > 0]
         
         return {
-            'total_lotes': total_lotes,
-            'lotes_con_stock': lotes_con_stock,
-            'lotes_vacios': lotes_vacios,
-            'lotes_vencidos_con_stock': lotes_vencidos_con_stock,
-            'lotes_criticos': lotes_criticos,
+            'total_lotes': len(lotes),
+            'lotes_con_stock': len(lotes_con_stock),
+            'lotes_vacios': sum(1 for lote in lotes if lote.stock == 0),
+            'lotes_vencidos_con_stock': sum(1 for lote in lotes_con_stock if lote.fecha_vencimiento < hoy),
+            'lotes_criticos': sum(1 for lote in lotes_con_stock if hoy <= lote.fecha_vencimiento <= limite_critico),
             'stock_total': self.stock
         }
 
     def get_proximo_vencimiento(self):
         """Obtiene la fecha de vencimiento más próxima considerando todos los lotes."""
-        if self.tiene_vencimiento and self.lotes.filter(stock__gt=0).exists():
-            lote_proximo = self.lotes.filter(stock__gt=0).order_by('fecha_vencimiento').first()
-            return lote_proximo.fecha_vencimiento if lote_proximo else None
+        if self.tiene_vencimiento:
+            lotes_activos = self.get_lotes_activos()
+            if lotes_activos:
+                return lotes_activos[0].fecha_vencimiento
         return self.fecha_vencimiento
 
+    def calcular_resumen_vencimiento(self):
+        """Calcula próximo vencimiento, estado y lotes activos con una sola consulta agregada."""
+        if not self.tiene_vencimiento:
+            self.proximo_vencimiento = None
+            self.estado_vencimiento = 'Sin Vencimiento'
+            self.lotes_activos = 0
+            return
+
+        proximo, activos = None, 0
+        if self.pk:
+            resumen = self.lotes.filter(stock__gt=0).aggregate(
+                proximo=models.Min('fecha_vencimiento'),
+                activos=models.Count('id')
+            )
+            proximo, activos = resumen['proximo'], resumen['activos']
+
+        # Sin lotes activos se usa la fecha del producto principal (igual que get_proximo_vencimiento)
+        self.proximo_vencimiento = proximo or self.fecha_vencimiento
+        self.estado_vencimiento = calcular_estado_vencimiento(self.proximo_vencimiento)
+        self.lotes_activos = activos
+
+    def actualizar_resumen_vencimiento(self):
+        """Recalcula y persiste el resumen de vencimiento sin volver a guardar todo el producto."""
+        self.calcular_resumen_vencimiento()
+        Producto.objects.filter(pk=self.pk).update(
+            proximo_vencimiento=self.proximo_vencimiento,
+            estado_vencimiento=self.estado_vencimiento,
+            lotes_activos=self.lotes_activos,
+        )
+        # update() no emite señales: invalidar explícitamente los cachés del inventario
+        incrementar_version_inventario()
+
+    @classmethod
+    def actualizar_estados_vencimiento(cls, hoy=None):
+        """Recalcula con un único UPDATE los estados que cambian con la fecha (cambio de día)."""
+        actualizados = cls.objects.filter(tiene_vencimiento=True).update(
+            estado_vencimiento=expresion_estado_vencimiento('proximo_vencimiento', hoy)
+        )
+        incrementar_version_inventario()
+        return actualizados
+
+    @classmethod
+    def asegurar_estados_vigentes(cls):
+        """Ejecuta el recálculo diario una vez por día si el comando programado no lo hizo."""
+        from django.core.cache import cache
+        if cache.add(f'estados_vencimiento_{timezone.localdate().isoformat()}', True, 60 * 60 * 24):
+            cls.actualizar_estados_vencimiento()
+
     def get_info_proximo_lote(self):
         """Obtiene información sobre el próximo lote que se creará."""
         if not self.tiene_vencimiento:
@@ -421,7 +612,11 @@ class Producto(models.Model):
         return f"{self.descripcion} ({self.codigo_barra})"
 
     class Meta:
-        indexes = [models.Index(fields=['stock'], name='idx_producto_stock')]
+        indexes = [
+            models.Index(fields=['stock'], name='idx_producto_stock'),
+            models.Index(fields=['tiene_vencimiento', 'estado_vencimiento'], name='idx_producto_estado_venc'),
+            models.Index(fields=['proximo_vencimiento'], name='idx_producto_prox_venc'),
+        ]
 
 class LoteProducto(models.Model):
     """Modelo para manejar diferentes lotes de un mismo producto con fechas de vencimiento distintas."""
@@ -430,6 +625,18 @@ class LoteProducto(models.Model):
     stock = models.IntegerField(default=0, verbose_name="Stock del lote")
     fecha_ingreso = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de ingreso")
     numero_lote = models.IntegerField(verbose_name="Número de lote")
+
+    def save(self, *args, actualizar_producto=True, **kwargs):
+        """Guarda el lote y actualiza el resumen de vencimiento del producto."""
+        super().save(*args, **kwargs)
+        if actualizar_producto:
+            self.producto.actualizar_resumen_vencimiento()
+
+    def delete(self, *args, **kwargs):
+        producto = self.producto
+        resultado = super().delete(*args, **kwargs)
+        producto.actualizar_resumen_vencimiento()
+        return resultado
     
     def get_dias_para_vencer(self):
         """Calcula los días restantes hasta el vencimiento."""
@@ -443,18 +650,7 @@ class LoteProducto(models.Model):
 
     def get_estado_vencimiento(self):
         """Determina el estado de vencimiento del lote."""
-        dias_restantes = self.get_dias_para_vencer()
-        
-        if dias_restantes < 0:
-            return "Vencido"
-        elif dias_restantes == 0:
-            return "Vence Hoy"
-        elif dias_restantes <= 7:
-            return "Crítico"
-        elif dias_restantes <= 30:
-            return "Precaución"
-        else:
-            return "Normal"
+        return calcular_estado_vencimiento(self.fecha_vencimiento)
 
     def get_color_estado_vencimiento(self):
         """Retorna el color CSS para el estado de vencimiento."""
@@ -513,10 +709,171 @@ class Transaccion(models.Model):
     orden_compra = models.CharField(max_length=50, blank=True)
     observacion = models.TextField(blank=True, null=True)
     acta_entrega = models.ForeignKey('ActaEntrega', on_delete=models.SET_NULL, null=True, blank=True)
+    recepcion = models.ForeignKey(
+        'RecepcionStock',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='transacciones'
+    )
+    saldo = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Saldo del bincard del producto después de este movimiento"
+    )
+
+    # Orden cronológico del bincard (entradas antes que salidas a igual fecha)
+    ORDEN_BINCARD = ('fecha', 'tipo', 'id')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['producto', 'fecha', 'tipo'], name='idx_transaccion_bincard'),
+            models.Index(fields=['fecha'], name='idx_transaccion_fecha'),
+        ]
 
     def __str__(self):
         return f"{self.tipo} - {self.producto.descripcion} - {self.cantidad}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.saldo is None:
+            # El saldo se calcula y se guarda en la misma transacción, con el producto bloqueado
+            with transaction.atomic():
+                Transaccion.asignar_saldos([self])
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+    @staticmethod
+    def variacion_saldo(tipo, cantidad, acta_entrega_id):
+        """Efecto del movimiento en el saldo del bincard (las salidas sin acta no se muestran ni cuentan)."""
+        if tipo == 'entrada':
+            return cantidad
+        return -cantidad if acta_entrega_id else 0
+
+    @classmethod
+    def asignar_saldos(cls, transacciones):
+        """
+        Asigna el saldo a transacciones nuevas (aún sin guardar, en orden de
+        inserción) a partir del último saldo de cada producto. Debe llamarse
+        dentro de la transacción que las inserta: bloquea los productos para que
+        dos movimientos simultáneos no partan del mismo saldo.
+        """
+        ids = {t.producto_id for t in transacciones}
+        if not ids:
+            return
+        bloquear_productos(Producto.objects.filter(pk__in=ids))
+        saldos = cls.ultimos_saldos(ids)
+        for t in transacciones:
+            saldos[t.producto_id] += cls.variacion_saldo(t.tipo, t.cantidad, t.acta_entrega_id)
+            t.saldo = saldos[t.producto_id]
+
+    @classmethod
+    def ultimos_saldos(cls, ids):
+        """
+        Saldo del último movimiento de cada producto en una consulta. Los productos
+        con movimientos anteriores al saldo almacenado se recalculan antes.
+        """
+        ultimo = cls.objects.filter(producto=models.OuterRef('pk')).order_by(*(f'-{campo}' for campo in cls.ORDEN_BINCARD))
+        saldos = {}
+        for pk, tiene_movimientos, saldo in Producto.objects.filter(pk__in=ids).annotate(
+            tiene_movimientos=models.Exists(ultimo),
+            ultimo_saldo=models.Subquery(ultimo.values('saldo')[:1]),
+        ).values_list('pk', 'tiene_movimientos', 'ultimo_saldo'):
+            if tiene_movimientos and saldo is None:
+                saldo = cls.recalcular_saldos(pk)
+            saldos[pk] = saldo or 0
+        return saldos
+
+    @staticmethod
+    def expresion_variacion():
+        """variacion_saldo como expresión SQL, para sumar movimientos en la base de datos."""
+        return models.Case(
+            models.When(tipo='entrada', then=models.F('cantidad')),
+            models.When(acta_entrega__isnull=False, then=-models.F('cantidad')),
+            default=0,
+            output_field=models.IntegerField(),
+        )
+
+    @classmethod
+    def expresion_saldo_acumulado(cls):
+        """
+        Saldo acumulado calculado por la base de datos: suma de ventana de las
+        variaciones (ver variacion_saldo) en el orden del bincard, por producto.
+        """
+        return models.Window(
+            models.Sum(cls.expresion_variacion()),
+            partition_by=[models.F('producto_id')],
+            order_by=[models.F(campo).asc() for campo in cls.ORDEN_BINCARD],
+        )
+
+    @classmethod
+    def recalcular_saldos(cls, producto_id):
+        """
+        Recalcula el saldo de todos los movimientos del producto con la función de
+        ventana, guardando sólo los que cambian. Devuelve el saldo final.
+        """
+        saldo = 0
+        cambios = []
+        movimientos = cls.objects.filter(producto_id=producto_id).annotate(
+            saldo_calculado=cls.expresion_saldo_acumulado()
+        ).order_by(*cls.ORDEN_BINCARD).values_list('pk', 'saldo', 'saldo_calculado')
+        for pk, actual, saldo in movimientos.iterator(chunk_size=2000):
+            if actual != saldo:
+                cambios.append(cls(pk=pk, saldo=saldo))
+        cls.objects.bulk_update(cambios, ['saldo'], batch_size=500)
+        return saldo
+
+class RecepcionStock(models.Model):
+    """
+    Recepción de una entrega de proveedor: los datos del documento se registran
+    una vez y cada línea es una Transaccion de entrada asociada (ver accounts.recepcion).
+    """
+    numero = models.PositiveIntegerField(unique=True, verbose_name="N° de recepción")
+    fecha = models.DateTimeField(auto_now_add=True)
+    rut_proveedor = models.CharField(max_length=12, blank=True)
+    guia_despacho = models.CharField(max_length=50, blank=True)
+    numero_factura = models.CharField(max_length=50, blank=True)
+    orden_compra = models.CharField(max_length=50, blank=True)
+    observacion = models.TextField(blank=True)
+    usuario = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='recepciones'
+    )
+
+    class Meta:
+        verbose_name = "Recepción de Stock"
+        verbose_name_plural = "Recepciones de Stock"
+        ordering = ['-numero']
+
+    def __str__(self):
+        return f"Recepción N°{self.numero} - {self.fecha:%d/%m/%Y}"
+
+class CierreStock(models.Model):
+    """
+    Saldo de un producto al cierre de un mes (ver accounts.cierres). Sólo se
+    guardan productos con saldo distinto de cero o con movimientos en el mes:
+    un producto sin fila en un cierre tenía saldo cero.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='cierres')
+    fecha = models.DateField(verbose_name="Último día del mes")
+    saldo = models.IntegerField()
+    entradas = models.PositiveIntegerField(default=0, verbose_name="Entradas del mes")
+    salidas = models.PositiveIntegerField(default=0, verbose_name="Salidas del mes")
+
+    class Meta:
+        verbose_name = "Cierre de stock"
+        verbose_name_plural = "Cierres de stock"
+        unique_together = ('producto', 'fecha')  # Un cierre por producto y mes
+        indexes = [
+            models.Index(fields=['fecha'], name='idx_cierre_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto.codigo_barra} al {self.fecha}: {self.saldo}"
+
 class Funcionario(models.Model):
     DEPARTAMENTOS = [
         ('Seremi de Salud', 'Seremi de Salud'),
@@ -537,7 +894,53 @@ class Funcionario(models.Model):
     def __str__(self):
         return f"{self.nombre} - {self.departamento}"
 
+class EncabezadoActa(models.Model):
+    """
+    Datos de un acta de entrega (una fila por acta). Las líneas (ActaEntrega,
+    una por producto) cuelgan de aquí; el listado, los filtros y el conteo de
+    actas se hacen sobre esta tabla.
+    """
+    numero_acta = models.IntegerField(unique=True, verbose_name="N° de acta")
+    fecha = models.DateTimeField(default=timezone.now)
+    departamento = models.CharField(max_length=100)
+    responsable = models.ForeignKey(
+        'Responsable',
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='encabezados_acta',
+        verbose_name="Responsable"
+    )
+    generador = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='encabezados_acta_generados',
+        verbose_name="Generador"
+    )
+
+    class Meta:
+        verbose_name = "Acta de entrega"
+        verbose_name_plural = "Actas de entrega"
+        ordering = ['-numero_acta']
+        indexes = [
+            models.Index(fields=['fecha'], name='idx_encabezado_acta_fecha'),
+        ]
+
+    def __str__(self):
+        return f"Acta N°{self.numero_acta} - {self.departamento}"
+
 class ActaEntrega(models.Model):
+    """
+    Línea de un acta de entrega (un producto). Conserva una copia de los datos
+    del acta, que usan el PDF, el bincard y la trazabilidad de lotes.
+    """
+    encabezado = models.ForeignKey(
+        EncabezadoActa,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='lineas',
+        verbose_name="Acta"
+    )
     numero_acta = models.IntegerField()
     departamento = models.CharField(max_length=100)
     responsable = models.ForeignKey(
@@ -561,11 +964,64 @@ class ActaEntrega(models.Model):
     observacion = models.TextField(blank=True, null=True)
 
     class Meta:
+        verbose_name = "Línea de acta"
+        verbose_name_plural = "Líneas de acta"
         unique_together = ('numero_acta', 'producto')
 
     def __str__(self):
         return f"Acta N°{self.numero_acta} - {self.departamento}"
 
+class AsignacionLote(models.Model):
+    """
+    Unidades de un lote entregadas en una línea de acta (asignación FIFO al despachar).
+    Guarda el producto y número de lote para que la trazabilidad se mantenga aunque
+    el lote vacío se elimine después.
+    """
+    acta = models.ForeignKey(ActaEntrega, on_delete=models.CASCADE, related_name='asignaciones_lote')
+    lote = models.ForeignKey(
+        LoteProducto,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='asignaciones'
+    )
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='asignaciones_lote')
+    numero_lote = models.IntegerField(verbose_name="Número de lote")
+    fecha_vencimiento = models.DateField(verbose_name="Fecha de vencimiento del lote")
+    cantidad = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Asignación de lote"
+        verbose_name_plural = "Asignaciones de lotes"
+        indexes = [
+            models.Index(fields=['producto', 'numero_lote'], name='idx_asignacion_lote'),
+        ]
+
+    def __str__(self):
+        return f"Acta N°{self.acta.numero_acta} - Lote {self.numero_lote} ({self.cantidad})"
+
+class LineaCarritoSalida(models.Model):
+    """
+    Producto elegido por un usuario en la pantalla de salida, aún sin acta
+    (ver accounts.carrito). Cada acción de la pantalla inserta, actualiza o
+    borra sólo su línea.
+    """
+    usuario = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='carrito_salida')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='lineas_carrito')
+    numero_siscom = models.CharField(max_length=50, blank=True)
+    cantidad = models.PositiveIntegerField(null=True, blank=True)
+    observacion = models.TextField(blank=True)
+    agregado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Línea del carrito de salida"
+        verbose_name_plural = "Líneas del carrito de salida"
+        unique_together = ('usuario', 'producto')  # Un producto aparece una sola vez en el carrito
+        ordering = ['agregado', 'id']
+
+    def __str__(self):
+        return f"{self.usuario} - {self.producto.codigo_barra}"
+
 class Departamento(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     activo = models.BooleanField(default=True)
@@ -603,4 +1059,211 @@ class Categoria(models.Model):
         verbose_name_plural = "Categorías"
         permissions = [
             ("can_manage_categories", "Can manage categories"),
-        ]
\ No newline at end of file
+        ]
+
+class Trabajo(models.Model):
+    """Trabajo en segundo plano (exportaciones y reportes pesados) ejecutado por accounts.trabajos."""
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+    FORMATOS = [('xlsx', 'Excel'), ('csv', 'CSV'), ('ndjson', 'NDJSON'), ('zip', 'ZIP'), ('pdf', 'PDF')]
+
+    tipo = models.CharField(max_length=50, verbose_name="Tipo de trabajo")
+    formato = models.CharField(max_length=10, choices=FORMATOS, default='xlsx')
+    parametros = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    progreso = models.PositiveIntegerField(default=0, verbose_name="Filas procesadas")  # Actas, en el archivo de actas
+    total = models.PositiveIntegerField(null=True, blank=True, verbose_name="Filas estimadas")
+    archivo = models.CharField(max_length=255, blank=True, verbose_name="Archivo generado")
+    nombre_archivo = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    usuario = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='trabajos'
+    )
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    finalizado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Trabajo en segundo plano"
+        verbose_name_plural = "Trabajos en segundo plano"
+        ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['estado', 'creado'], name='idx_trabajo_estado'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} ({self.formato}) - {self.get_estado_display()}"
+
+    def get_porcentaje(self):
+        """Porcentaje de avance según las filas procesadas y las estimadas."""
+        if self.estado == 'completado':
+            return 100
+        if not self.total:
+            return 0
+        return min(99, int(self.progreso * 100 / self.total))
+
+
+class Secuencia(models.Model):
+    """
+    Contador para numeraciones correlativas: códigos de barra, números de acta
+    y números de lote (una secuencia por producto).
+
+    Cada reserva incrementa el contador con un UPDATE atómico dentro de la
+    transacción de quien usa el número, de modo que la fila queda bloqueada
+    hasta el commit (en SQLite, la base completa): dos procesos nunca obtienen
+    el mismo valor y, si la transacción se revierte, el incremento también, por
+    lo que la numeración no tiene saltos. Reservar es O(1) (búsqueda por clave
+    primaria); el valor inicial se toma de los datos existentes sólo la primera
+    vez que se usa cada secuencia.
+    """
+    CODIGO_BARRA = 'codigo_barra'
+    NUMERO_ACTA = 'numero_acta'
+    NUMERO_RECEPCION = 'numero_recepcion'
+    PREFIJO_LOTE = 'lote_'
+    # Los códigos de barra automáticos parten desde 100000
+    CODIGO_BARRA_INICIAL = 100000
+
+    nombre = models.CharField(max_length=50, primary_key=True)
+    ultimo = models.BigIntegerField(default=0, verbose_name="Último valor asignado")
+
+    class Meta:
+        verbose_name = "Secuencia"
+        verbose_name_plural = "Secuencias"
+
+    def __str__(self):
+        return f"{self.nombre}: {self.ultimo}"
+
+    @classmethod
+    def nombre_lote(cls, producto_id):
+        return f"{cls.PREFIJO_LOTE}{producto_id}"
+
+    @staticmethod
+    def es_codigo_numerico(codigo):
+        # Hasta 18 dígitos para que el valor quepa en un BigIntegerField
+        return codigo.isdigit() and len(codigo) <= 18
+
+    @classmethod
+    def valor_inicial(cls, nombre):
+        """Último valor ya usado en los datos para la secuencia `nombre`."""
+        if nombre == cls.CODIGO_BARRA:
+            # Máximo numérico (ordenar el CharField como texto pondría '99999' sobre '100000')
+            maximo = Producto.objects.filter(codigo_barra__regex=r'^[0-9]{1,18}$').annotate(
+                numero=Cast('codigo_barra', models.BigIntegerField())
+            ).aggregate(maximo=models.Max('numero'))['maximo']
+            return max(maximo or 0, cls.CODIGO_BARRA_INICIAL - 1)
+        if nombre == cls.NUMERO_ACTA:
+            return ActaEntrega.objects.aggregate(maximo=models.Max('numero_acta'))['maximo'] or 0
+        if nombre == cls.NUMERO_RECEPCION:
+            return RecepcionStock.objects.aggregate(maximo=models.Max('numero'))['maximo'] or 0
+        if nombre.startswith(cls.PREFIJO_LOTE):
+            producto_id = int(nombre[len(cls.PREFIJO_LOTE):])
+            return LoteProducto.objects.filter(producto_id=producto_id).aggregate(
+                maximo=models.Max('numero_lote')
+            )['maximo'] or 0
+        return 0
+
+    @classmethod
+    def _crear(cls, nombre):
+        try:
+            with transaction.atomic():
+                cls.objects.create(nombre=nombre, ultimo=cls.valor_inicial(nombre))
+        except IntegrityError:
+            pass  # Otro proceso la creó al mismo tiempo
+
+    @classmethod
+    def reservar(cls, nombre, cantidad=1):
+        """
+        Reserva `cantidad` valores consecutivos de la secuencia y devuelve el
+        range reservado. Debe llamarse dentro de la transacción que guarda los
+        registros numerados para que la reserva se revierta junto con ellos.
+        """
+        if cantidad < 1:
+            raise ValueError("La cantidad a reservar debe ser al menos 1")
+        with transaction.atomic():
+            secuencia = cls.objects.filter(nombre=nombre)
+            if not secuencia.update(ultimo=models.F('ultimo') + cantidad):
+                cls._crear(nombre)
+                secuencia.update(ultimo=models.F('ultimo') + cantidad)
+            ultimo = secuencia.values_list('ultimo', flat=True).get()
+        return range(ultimo - cantidad + 1, ultimo + 1)
+
+    @classmethod
+    def reservar_varias(cls, cantidades):
+        """
+        Reserva rangos en varias secuencias a la vez ({nombre: cantidad}) con un
+        único UPDATE y un SELECT. Devuelve {nombre: range}.
+        """
+        cantidades = {nombre: cantidad for nombre, cantidad in cantidades.items() if cantidad > 0}
+        if not cantidades:
+            return {}
+        incremento = models.Case(
+            *[models.When(nombre=nombre, then=models.Value(cantidad)) for nombre, cantidad in cantidades.items()],
+            output_field=models.BigIntegerField()
+        )
+        with transaction.atomic():
+            secuencias = cls.objects.filter(nombre__in=list(cantidades))
+            if secuencias.update(ultimo=models.F('ultimo') + incremento) < len(cantidades):
+                existentes = set(secuencias.values_list('nombre', flat=True))
+                faltantes = [nombre for nombre in cantidades if nombre not in existentes]
+                for nombre in faltantes:
+                    cls._crear(nombre)
+                cls.objects.filter(nombre__in=faltantes).update(ultimo=models.F('ultimo') + incremento)
+            ultimos = dict(secuencias.values_list('nombre', 'ultimo'))
+        return {
+            nombre: range(ultimos[nombre] - cantidad + 1, ultimos[nombre] + 1)
+            for nombre, cantidad in cantidades.items()
+        }
+
+    @classmethod
+    def siguiente(cls, nombre):
+        """Reserva y devuelve el siguiente valor de la secuencia."""
+        return cls.reservar(nombre)[0]
+
+    @classmethod
+    def consultar_siguiente(cls, nombre):
+        """Valor que entregaría la próxima reserva, sin reservarlo (sólo informativo)."""
+        ultimo = cls.objects.filter(nombre=nombre).values_list('ultimo', flat=True).first()
+        if ultimo is None:
+            ultimo = cls.valor_inicial(nombre)
+        return ultimo + 1
+
+    @classmethod
+    def asegurar_minimo(cls, nombre, valor):
+        """Adelanta la secuencia si `valor` (asignado manualmente) la supera."""
+        secuencia = cls.objects.filter(nombre=nombre)
+        if not secuencia.update(ultimo=Greatest(models.F('ultimo'), valor)):
+            cls._crear(nombre)
+            secuencia.update(ultimo=Greatest(models.F('ultimo'), valor))
+
+    @classmethod
+    def sincronizar(cls):
+        """
+        Adelanta las secuencias existentes hasta el mayor valor presente en los
+        datos (ej. tras restaurar un respaldo o cargar datos por fuera del sistema).
+        Devuelve cuántas se ajustaron.
+        """
+        ajustadas = 0
+        maximos_lote = dict(
+            LoteProducto.objects.values('producto_id').annotate(
+                maximo=models.Max('numero_lote')
+            ).values_list('producto_id', 'maximo')
+        )
+        with transaction.atomic():
+            for secuencia in cls.objects.select_for_update():
+                if secuencia.nombre.startswith(cls.PREFIJO_LOTE):
+                    maximo = maximos_lote.get(int(secuencia.nombre[len(cls.PREFIJO_LOTE):]), 0)
+                else:
+                    maximo = cls.valor_inicial(secuencia.nombre)
+                if maximo > secuencia.ultimo:
+                    secuencia.ultimo = maximo
+                    secuencia.save(update_fields=['ultimo'])
+                    ajustadas += 1
+        return ajustadas
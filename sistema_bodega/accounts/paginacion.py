@@ -0,0 +1,155 @@
+"""Paginación por cursor (keyset) para listados largos.
+
+En lugar de ``OFFSET`` (que obliga a la base a recorrer y descartar todas las
+filas anteriores) cada página se pide a partir de los valores de orden de la
+última fila vista: ``WHERE (fecha, tipo, id) > (cursor) ORDER BY ... LIMIT n``.
+Con un índice sobre las columnas de orden, la página 1 y la página 500 cuestan
+lo mismo. El cursor viaja en la URL (``?despues=`` o ``?antes=``) codificado en
+base64; ``?ultima=1`` lee la última página recorriendo el índice al revés.
+
+Sin ``COUNT(*)`` no hay número de páginas: quien lo pida recibe un total
+aproximado guardado en el caché, que se recalcula cada pocos minutos.
+"""
+import base64
+import binascii
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+
+# Segundos que se reutiliza el total aproximado de un listado
+TIEMPO_TOTAL_APROXIMADO = 5 * 60
+
+
+def _campo(columna):
+    """Nombre del campo de una columna de orden ('-fecha' -> 'fecha')."""
+    return columna.lstrip('-')
+
+
+def codificar_cursor(valores):
+    """Cursor opaco para la URL a partir de los valores de orden de una fila."""
+    # isoformat conserva los microsegundos: el cursor debe coincidir exactamente con la fila
+    valores = [valor.isoformat() if hasattr(valor, 'isoformat') else valor for valor in valores]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, orden, modelo):
+    """
+    Valores de orden del cursor convertidos al tipo de cada campo del modelo
+    (el cursor llega en la URL y puede estar alterado), o None si no viene o no
+    es válido: en ese caso se muestra la primera página.
+    """
+    if not cursor:
+        return None
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(valores, list) or len(valores) != len(orden):
+        return None
+    try:
+        return [
+            modelo._meta.get_field(_campo(columna)).to_python(valor)
+            for columna, valor in zip(orden, valores)
+        ]
+    except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+        return None
+
+
+def filtro_cursor(orden, valores, anteriores=False):
+    """
+    Condición "fila posterior (o anterior) al cursor" para un orden de varias
+    columnas ('-' delante de una columna indica orden descendente). La primera
+    columna se acota además con >= (<=) para que la base recorra el índice
+    como un rango.
+    """
+    def lookup(columna):
+        return 'lt' if columna.startswith('-') != anteriores else 'gt'
+
+    campos = [_campo(columna) for columna in orden]
+    condicion = Q()
+    for posicion, columna in enumerate(orden):
+        iguales = dict(zip(campos[:posicion], valores[:posicion]))
+        condicion |= Q(**iguales, **{f'{campos[posicion]}__{lookup(columna)}': valores[posicion]})
+    return Q(**{f'{campos[0]}__{lookup(orden[0])}e': valores[0]}) & condicion
+
+
+def total_aproximado(queryset, segundos=TIEMPO_TOTAL_APROXIMADO):
+    """
+    Cantidad de filas del queryset, guardada en el caché por consulta: el COUNT
+    se ejecuta a lo sumo una vez cada `segundos`, por lo que puede estar algo
+    desactualizado.
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    clave = 'conteo:' + hashlib.sha1(repr((sql, params)).encode()).hexdigest()
+    total = cache.get(clave)
+    if total is None:
+        total = queryset.count()
+        cache.set(clave, total, segundos)
+    return total
+
+
+class PaginaCursor:
+    """Página de una paginación por cursor, con la interfaz que usan las plantillas."""
+
+    def __init__(self, object_list, orden, has_previous, has_next, total_aproximado=None):
+        self.object_list = object_list
+        self.orden = orden
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.total_aproximado = total_aproximado
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_previous or self.has_next
+
+    def _cursor(self, fila):
+        campos = [_campo(columna) for columna in self.orden]
+        valores = [fila[campo] if isinstance(fila, dict) else getattr(fila, campo) for campo in campos]
+        return codificar_cursor(valores)
+
+    @property
+    def cursor_anterior(self):
+        return self._cursor(self.object_list[0]) if self.object_list else None
+
+    @property
+    def cursor_siguiente(self):
+        return self._cursor(self.object_list[-1]) if self.object_list else None
+
+
+def paginar_por_cursor(request, queryset, orden, items_por_pagina=20, contar=False):
+    """
+    Pagina el queryset por las columnas de `orden` (únicas en conjunto, p. ej.
+    terminando en 'id'; con '-' las descendentes). Las filas deben incluir esas
+    columnas (modelos o diccionarios de values()) y ser campos del modelo. Un
+    cursor inválido lleva a la primera página. No ejecuta COUNT: con
+    `contar` la página trae además `total_aproximado` desde el caché.
+    """
+    orden = list(orden)
+    adelante = [F(_campo(columna)).desc() if columna.startswith('-') else F(columna).asc() for columna in orden]
+    atras = [F(_campo(columna)).asc() if columna.startswith('-') else F(columna).desc() for columna in orden]
+    total = total_aproximado(queryset) if contar else None
+
+    despues = decodificar_cursor(request.GET.get('despues'), orden, queryset.model)
+    antes = decodificar_cursor(request.GET.get('antes'), orden, queryset.model)
+
+    if antes is not None or request.GET.get('ultima'):
+        # Se lee hacia atrás y se invierte la página
+        consulta = queryset.filter(filtro_cursor(orden, antes, anteriores=True)) if antes is not None else queryset
+        filas = list(consulta.order_by(*atras)[:items_por_pagina + 1])
+        hay_mas = len(filas) > items_por_pagina
+        filas = filas[:items_por_pagina][::-1]
+        return PaginaCursor(filas, orden, has_previous=hay_mas, has_next=antes is not None, total_aproximado=total)
+
+    consulta = queryset.filter(filtro_cursor(orden, despues)) if despues is not None else queryset
+    filas = list(consulta.order_by(*adelante)[:items_por_pagina + 1])
+    hay_mas = len(filas) > items_por_pagina
+    return PaginaCursor(filas[:items_por_pagina], orden, has_previous=despues is not None, has_next=hay_mas,
+                        total_aproximado=total)
@@ -0,0 +1,152 @@
+"""Recepción de stock de varias líneas (una entrega de proveedor) en una sola transacción.
+
+Los datos del documento (RUT, guía, factura y orden de compra) se guardan una
+vez en ``RecepcionStock`` y cada línea genera su ``Transaccion`` de entrada y,
+si el producto maneja vencimiento, su ``LoteProducto``. El número de consultas
+no depende del número de líneas:
+
+1. Los productos se leen con una consulta y se validan todas las líneas.
+2. Los números de lote de todos los productos se reservan de una vez en la
+   secuencia (``Secuencia.reservar_varias``).
+3. Lotes y transacciones se crean con ``bulk_create``; el stock de los
+   productos se suma con ``bulk_update`` y expresiones ``F()`` y el resumen de
+   vencimiento se recalcula con una consulta agrupada.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+import pytz
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .cache_inventario import incrementar_version_inventario
+from .models import LoteProducto, Producto, RecepcionStock, Secuencia, Transaccion, calcular_estado_vencimiento
+
+
+def validar_lineas_recepcion(lineas, productos, hoy=None):
+    """
+    Revisa las líneas contra los productos ({codigo_barra: producto}) y devuelve
+    la lista de errores (una cadena por problema, indicando la línea).
+    """
+    hoy = hoy or timezone.localdate()
+    errores = []
+    for numero, linea in enumerate(lineas, start=1):
+        producto = productos.get(linea['codigo_barra'])
+        if producto is None:
+            errores.append(f"Línea {numero}: producto no encontrado ({linea['codigo_barra']}).")
+            continue
+        if linea['cantidad'] < 1:
+            errores.append(f'Línea {numero}: la cantidad debe ser un número positivo.')
+        fecha = linea.get('fecha_vencimiento')
+        if producto.tiene_vencimiento and not fecha:
+            errores.append(f'Línea {numero}: {producto.descripcion} requiere fecha de vencimiento.')
+        elif fecha and fecha <= hoy:
+            errores.append(f'Línea {numero}: la fecha de vencimiento debe ser posterior a la fecha actual.')
+    return errores
+
+
+def registrar_recepcion(lineas, rut_proveedor='', guia_despacho='', numero_factura='', orden_compra='',
+                        observacion='', usuario=None):
+    """
+    Registra la recepción completa o nada.
+
+    `lineas` son diccionarios con codigo_barra, cantidad y fecha_vencimiento
+    (date o None). Una línea con fecha crea un lote nuevo; si el producto aún
+    no manejaba vencimiento pasa a manejarlo (igual que en agregar_stock_detalle).
+    Devuelve la RecepcionStock creada con el atributo `lotes` (lotes creados).
+    Lanza ValidationError con la lista de errores si alguna línea no es válida.
+    """
+    if not lineas:
+        raise ValidationError('La recepción debe tener al menos una línea.')
+
+    with transaction.atomic():
+        productos = {
+            producto.codigo_barra: producto
+            for producto in Producto.objects.filter(codigo_barra__in={linea['codigo_barra'] for linea in lineas})
+        }
+        errores = validar_lineas_recepcion(lineas, productos)
+        if errores:
+            raise ValidationError(errores)
+
+        recepcion = RecepcionStock.objects.create(
+            numero=Secuencia.siguiente(Secuencia.NUMERO_RECEPCION),
+            rut_proveedor=rut_proveedor or '',
+            guia_despacho=guia_despacho or '',
+            numero_factura=numero_factura or '',
+            orden_compra=orden_compra or '',
+            observacion=observacion or '',
+            usuario=usuario if usuario and usuario.is_authenticated else None,
+        )
+
+        # Números de lote de todos los productos reservados en bloque
+        lineas_con_lote = [linea for linea in lineas if linea.get('fecha_vencimiento')]
+        por_secuencia = defaultdict(int)
+        for linea in lineas_con_lote:
+            por_secuencia[Secuencia.nombre_lote(productos[linea['codigo_barra']].pk)] += 1
+        numeros_lote = {nombre: iter(rango) for nombre, rango in Secuencia.reservar_varias(por_secuencia).items()}
+
+        lotes, transacciones = [], []
+        sumas = defaultdict(int)
+        ahora = datetime.now(pytz.UTC)
+        for linea in lineas:
+            producto = productos[linea['codigo_barra']]
+            fecha = linea.get('fecha_vencimiento')
+            sumas[producto.pk] += linea['cantidad']
+            if fecha:
+                if not producto.tiene_vencimiento:
+                    # Convertir producto a uno con vencimiento
+                    producto.tiene_vencimiento = True
+                    producto.fecha_vencimiento = fecha
+                lote = LoteProducto(
+                    producto=producto,
+                    numero_lote=next(numeros_lote[Secuencia.nombre_lote(producto.pk)]),
+                    fecha_vencimiento=fecha,
+                    stock=linea['cantidad'],
+                )
+                lotes.append(lote)
+                detalle = f"Lote #{lote.numero_lote} - Vence: {fecha}"
+            else:
+                detalle = "Stock agregado sin fecha de vencimiento"
+            transacciones.append(Transaccion(
+                producto=producto,
+                tipo='entrada',
+                cantidad=linea['cantidad'],
+                fecha=ahora,
+                rut_proveedor=recepcion.rut_proveedor,
+                guia_despacho=recepcion.guia_despacho,
+                numero_factura=recepcion.numero_factura,
+                orden_compra=recepcion.orden_compra,
+                recepcion=recepcion,
+                observacion=f"Recepción N°{recepcion.numero} - {detalle}",
+            ))
+
+        LoteProducto.objects.bulk_create(lotes)
+        Transaccion.asignar_saldos(transacciones)
+        Transaccion.objects.bulk_create(transacciones)
+
+        # Resumen de vencimiento de los productos con lotes, en una consulta agrupada
+        con_vencimiento = [producto.pk for producto in productos.values() if producto.tiene_vencimiento]
+        resumenes = {
+            fila['producto']: fila
+            for fila in LoteProducto.objects.filter(producto__in=con_vencimiento, stock__gt=0)
+            .values('producto').annotate(proximo=Min('fecha_vencimiento'), activos=Count('id'))
+        }
+        for producto in productos.values():
+            producto.stock = F('stock') + sumas[producto.pk]
+            if producto.tiene_vencimiento:
+                resumen = resumenes.get(producto.pk, {})
+                producto.proximo_vencimiento = resumen.get('proximo') or producto.fecha_vencimiento
+                producto.estado_vencimiento = calcular_estado_vencimiento(producto.proximo_vencimiento)
+                producto.lotes_activos = resumen.get('activos', 0)
+        Producto.objects.bulk_update(
+            list(productos.values()),
+            ['stock', 'tiene_vencimiento', 'fecha_vencimiento', 'proximo_vencimiento', 'estado_vencimiento', 'lotes_activos']
+        )
+
+        # bulk_update/bulk_create no emiten señales
+        incrementar_version_inventario()
+
+    recepcion.lotes = lotes
+    return recepcion
@@ -0,0 +1,235 @@
+"""Definiciones de los reportes exportables.
+
+Cada reporte se describe con un diccionario (nombre de archivo, columnas,
+claves, generador de filas y opciones de Excel) que sirve tanto para la
+descarga directa desde una vista como para un trabajo en segundo plano
+(ver ``accounts.trabajos``). Las filas se leen por bloques con
+``values_list()`` para no instanciar modelos.
+"""
+from datetime import date
+
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+from openpyxl.styles import Alignment, Font, PatternFill
+
+from .cierres import consulta_stock_a_fecha
+from .despacho import consultar_trazabilidad_lote
+from .exportacion import iterar_datos, nombre_con_fecha, respuesta_streaming, respuesta_xlsx
+from .models import LoteProducto, Producto, Transaccion, calcular_estado_vencimiento
+
+COLUMNAS_BINCARD = [
+    'Fecha', 'Guía o Factura', 'N° Acta', 'Proveedor (RUT)', 'Programa/Departamento', 'Entrada', 'Salida', 'Saldo'
+]
+CAMPOS_BINCARD = [
+    'fecha', 'guia_o_factura', 'numero_acta', 'rut_proveedor', 'departamento', 'entrada', 'salida', 'saldo'
+]
+
+COLUMNAS_VENCIMIENTOS = [
+    'Código de Barra', 'Descripción', 'Categoría', 'Stock Total',
+    'N° Lote', 'Stock Lote', 'Fecha Vencimiento Lote', 'Días Restantes', 'Estado Lote', 'Estado Producto'
+]
+CAMPOS_VENCIMIENTOS = [
+    'codigo_barra', 'descripcion', 'categoria', 'stock', 'numero_lote', 'stock_lote',
+    'fecha_vencimiento', 'dias_restantes', 'estado_lote', 'estado_producto'
+]
+
+COLUMNAS_TRAZABILIDAD = [
+    'N° Acta', 'Fecha', 'Departamento', 'Responsable', 'Generador', 'N° Lote', 'Vencimiento Lote', 'Cantidad'
+]
+CAMPOS_TRAZABILIDAD = [
+    'numero_acta', 'fecha', 'departamento', 'responsable', 'generador', 'numero_lote', 'fecha_vencimiento', 'cantidad'
+]
+
+COLUMNAS_STOCK_FECHA = ['Código de Barra', 'Descripción', 'Categoría', 'Stock a la Fecha']
+CAMPOS_STOCK_FECHA = ['codigo_barra', 'descripcion', 'categoria', 'stock_a_fecha']
+
+# Colores de fila según el estado del lote en el Excel de vencimientos
+RELLENOS_VENCIMIENTO = {
+    'Vencido': PatternFill(start_color='ffebee', end_color='ffebee', fill_type='solid'),
+    'Vence Hoy': PatternFill(start_color='fff3e0', end_color='fff3e0', fill_type='solid'),
+    'Crítico': PatternFill(start_color='fff3e0', end_color='fff3e0', fill_type='solid'),
+    'Precaución': PatternFill(start_color='e8f5e8', end_color='e8f5e8', fill_type='solid'),
+}
+
+
+def consulta_movimientos_bincard(producto):
+    """Transacciones que forman el bincard, en orden cronológico (entradas antes que salidas a igual fecha)."""
+    return Transaccion.objects.filter(producto=producto).filter(
+        Q(tipo='entrada') | Q(tipo='salida', acta_entrega__isnull=False)
+    ).order_by(*Transaccion.ORDEN_BINCARD)
+
+
+def asegurar_saldos_bincard(producto):
+    """Calcula los saldos de movimientos registrados antes de que se almacenara el saldo."""
+    if Transaccion.objects.filter(producto=producto, saldo__isnull=True).exists():
+        Transaccion.recalcular_saldos(producto.pk)
+
+
+# Columnas de Transaccion que forman una fila del bincard (argumentos de fila_bincard)
+CAMPOS_CONSULTA_BINCARD = (
+    'tipo', 'fecha', 'cantidad', 'guia_despacho', 'numero_factura', 'rut_proveedor',
+    'acta_entrega__numero_acta', 'acta_entrega__departamento', 'saldo',
+)
+
+
+def valores_movimientos_bincard(movimientos):
+    """Columnas del bincard leídas con values_list() (el saldo viene almacenado en cada transacción)."""
+    return movimientos.values_list(*CAMPOS_CONSULTA_BINCARD)
+
+
+def fila_bincard(tipo, fecha, cantidad, guia, factura, rut, numero_acta, departamento, saldo):
+    """Fila del bincard (fecha, guía o factura, acta, proveedor, departamento, entrada, salida, saldo)."""
+    if tipo == 'entrada':
+        if guia:
+            guia_o_factura = f"Guía: {guia}"
+        elif factura:
+            guia_o_factura = f"Factura: {factura}"
+        else:
+            guia_o_factura = "-"
+        return [fecha, guia_o_factura, None, rut or '-', None, cantidad, 0, saldo]
+    return [fecha, "-", numero_acta, None, departamento, 0, cantidad, saldo]
+
+
+def filas_movimientos_bincard(producto):
+    """Movimientos del bincard como filas, leídos por bloques."""
+    asegurar_saldos_bincard(producto)
+    for movimiento in iterar_datos(valores_movimientos_bincard(consulta_movimientos_bincard(producto))):
+        yield fila_bincard(*movimiento)
+
+
+def filas_trazabilidad_lote(codigo_barra, numero_lote):
+    """Entregas del lote como filas (acta, fecha, departamento, responsable, generador, lote, vencimiento, cantidad)."""
+    return consultar_trazabilidad_lote(codigo_barra, numero_lote).values_list(
+        'acta__numero_acta', 'acta__fecha', 'acta__departamento', 'acta__responsable__nombre',
+        'acta__generador__nombre', 'numero_lote', 'fecha_vencimiento', 'cantidad',
+    )
+
+
+def consulta_control_vencimientos():
+    """Productos con vencimiento unidos (LEFT JOIN) a sus lotes activos, una fila por lote."""
+    return Producto.objects.filter(tiene_vencimiento=True).annotate(
+        lote_activo=FilteredRelation('lotes', condition=Q(lotes__stock__gt=0))
+    ).order_by('descripcion', 'id', 'lote_activo__fecha_vencimiento', 'lote_activo__id')
+
+
+def contar_filas_control_vencimientos():
+    """Filas que tendrá el reporte: lotes activos más productos sin lotes activos."""
+    return (
+        LoteProducto.objects.filter(producto__tiene_vencimiento=True, stock__gt=0).count()
+        + Producto.objects.filter(tiene_vencimiento=True, lotes_activos=0).count()
+    )
+
+
+def filas_control_vencimientos(hoy):
+    """
+    Filas del reporte de vencimientos: una por lote activo, o una con datos del
+    producto si no tiene lotes con stock.
+    """
+    productos = consulta_control_vencimientos().values_list(
+        'codigo_barra', 'descripcion', 'categoria__nombre', 'stock', 'fecha_vencimiento', 'proximo_vencimiento',
+        'lote_activo__numero_lote', 'lote_activo__stock', 'lote_activo__fecha_vencimiento',
+    )
+    for (codigo, descripcion, categoria, stock, fecha_producto, proximo,
+         numero_lote, stock_lote, fecha_lote) in iterar_datos(productos):
+        # El estado del producto es el de su lote más próximo (o de su propia fecha sin lotes activos)
+        estado_producto = calcular_estado_vencimiento(proximo, hoy)
+        fecha = fecha_lote if stock_lote is not None else fecha_producto
+        yield [
+            codigo, descripcion, categoria or 'Sin categoría', stock, numero_lote, stock_lote, fecha,
+            (fecha - hoy).days if fecha else None, calcular_estado_vencimiento(fecha, hoy), estado_producto,
+        ]
+
+
+def reporte_bincard(formato, codigo_barra):
+    """Historial de movimientos de un producto."""
+    producto = Producto.objects.get(codigo_barra=codigo_barra)
+    filas = filas_movimientos_bincard(producto)
+    opciones = {}
+    if formato == 'xlsx':
+        # Mismo formato que exportar_excel: fecha como texto y la primera columna fija
+        filas = ([fila[0].strftime('%d-%m-%Y %H:%M')] + fila[1:] for fila in filas)
+        opciones['anchos'] = [20] + [None] * (len(COLUMNAS_BINCARD) - 1)
+    return {
+        'nombre_base': f"Bincard_{producto.codigo_barra}",
+        'titulo': f"Bincard_{producto.codigo_barra}",
+        'columnas': COLUMNAS_BINCARD,
+        'campos': CAMPOS_BINCARD,
+        'filas': filas,
+        'total': consulta_movimientos_bincard(producto).count,
+        'opciones': opciones,
+    }
+
+
+def reporte_control_vencimientos(formato, fecha=None):
+    """Lotes activos de los productos con vencimiento y su estado a la fecha indicada (hoy por defecto)."""
+    hoy = date.fromisoformat(fecha) if fecha else timezone.localdate()
+    filas = filas_control_vencimientos(hoy)
+    opciones = {}
+    if formato == 'xlsx':
+        def filas_excel(filas):
+            for fila in filas:
+                # En Excel las fechas van como texto dd/mm/aaaa y los datos de lote ausentes como '-'
+                fila[6] = fila[6].strftime('%d/%m/%Y') if fila[6] else None
+                yield ['-' if valor is None else valor for valor in fila]
+
+        filas = filas_excel(filas)
+        opciones = {
+            'anchos': [15, 40, 20, 12, 10, 12, 18, 15, 15, 15],
+            'estilo_encabezado': {
+                'font': Font(bold=True, color='FFFFFF'),
+                'fill': PatternFill(start_color='1a3c5e', end_color='1a3c5e', fill_type='solid'),
+                'alignment': Alignment(horizontal='center', vertical='center'),
+            },
+            'relleno_fila': lambda fila: RELLENOS_VENCIMIENTO.get(fila[8]),
+        }
+    return {
+        'nombre_base': 'control_vencimientos',
+        'titulo': 'Control de Vencimientos',
+        'columnas': COLUMNAS_VENCIMIENTOS,
+        'campos': CAMPOS_VENCIMIENTOS,
+        'filas': filas,
+        'total': contar_filas_control_vencimientos,
+        'opciones': opciones,
+    }
+
+
+def filas_stock_a_fecha(productos):
+    """Productos con su saldo a la fecha como filas (código, descripción, categoría, stock)."""
+    return iterar_datos(productos.values_list('codigo_barra', 'descripcion', 'categoria__nombre', 'stock_a_fecha'))
+
+
+def reporte_stock_a_fecha(formato, fecha):
+    """Stock de todos los productos al final de un día (último cierre mensual más movimientos posteriores)."""
+    fecha = date.fromisoformat(fecha)
+    productos = consulta_stock_a_fecha(fecha).order_by('descripcion', 'id')
+    return {
+        'nombre_base': f"Stock_al_{fecha.isoformat()}",
+        'titulo': f"Stock al {fecha.strftime('%d-%m-%Y')}",
+        'columnas': COLUMNAS_STOCK_FECHA,
+        'campos': CAMPOS_STOCK_FECHA,
+        'filas': filas_stock_a_fecha(productos),
+        'total': productos.count,
+        'opciones': {},
+    }
+
+
+REPORTES = {
+    'bincard': reporte_bincard,
+    'control_vencimientos': reporte_control_vencimientos,
+    'stock_fecha': reporte_stock_a_fecha,
+}
+
+
+def obtener_reporte(tipo, formato, parametros=None):
+    """Construye la definición del reporte `tipo` para el formato pedido."""
+    return REPORTES[tipo](formato, **(parametros or {}))
+
+
+def respuesta_reporte(reporte, formato):
+    """Descarga directa del reporte: XLSX desde archivo temporal, CSV/NDJSON en streaming."""
+    if formato == 'xlsx':
+        return respuesta_xlsx(
+            nombre_con_fecha(reporte['nombre_base'], formato), reporte['titulo'],
+            reporte['columnas'], reporte['filas'], **reporte['opciones']
+        )
+    return respuesta_streaming(formato, reporte['nombre_base'], reporte['columnas'], reporte['campos'], reporte['filas'])
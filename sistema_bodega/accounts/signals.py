@@ -0,0 +1,100 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache_inventario import incrementar_version_catalogo, incrementar_version_inventario
+from .cierres import invalidar_cierres_desde
+from .models import ActaEntrega, EncabezadoActa, LoteProducto, Producto, Transaccion
+
+
+@receiver(post_save, sender=Transaccion)
+@receiver(post_delete, sender=Transaccion)
+@receiver(post_save, sender=LoteProducto)
+@receiver(post_delete, sender=LoteProducto)
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_cache_inventario(sender, **kwargs):
+    """Cualquier movimiento de stock invalida las entradas de caché versionadas."""
+    incrementar_version_inventario()
+
+
+@receiver(pre_save, sender=Producto)
+def recordar_catalogo_anterior(sender, instance, update_fields=None, **kwargs):
+    """Guarda el código y la descripción antes de editar, para saber si cambió el catálogo."""
+    instance._catalogo_anterior = None
+    if instance._state.adding or (update_fields is not None and not {'codigo_barra', 'descripcion'} & set(update_fields)):
+        return
+    instance._catalogo_anterior = sender.objects.filter(pk=instance.pk).values_list('codigo_barra', 'descripcion').first()
+
+
+@receiver(post_save, sender=Producto)
+def invalidar_catalogo_producto_guardado(sender, instance, created, **kwargs):
+    """Un producto nuevo o con otro código o descripción cambia el catálogo (no así su stock)."""
+    anterior = getattr(instance, '_catalogo_anterior', None)
+    if created or (anterior and anterior != (instance.codigo_barra, instance.descripcion)):
+        incrementar_version_catalogo()
+
+
+@receiver(post_delete, sender=Producto)
+def invalidar_catalogo_producto_eliminado(sender, **kwargs):
+    incrementar_version_catalogo()
+
+
+@receiver(post_delete, sender=ActaEntrega)
+def recalcular_saldos_acta_eliminada(sender, instance, **kwargs):
+    """
+    La salida de un acta eliminada deja de contar en el bincard: se recalculan
+    los saldos del producto y se descartan los cierres mensuales desde esa fecha.
+    """
+    Transaccion.recalcular_saldos(instance.producto_id)
+    if instance.fecha:
+        invalidar_cierres_desde(timezone.localtime(instance.fecha).date())
+    # Un acta sin líneas deja de aparecer en el listado
+    if instance.encabezado_id:
+        EncabezadoActa.objects.filter(pk=instance.encabezado_id, lineas__isnull=True).delete()
+
+
+@receiver(pre_save, sender=Transaccion)
+def recordar_transaccion_anterior(sender, instance, **kwargs):
+    """Guarda el producto y la fecha de una transacción editada, para recalcular también los anteriores."""
+    instance._anterior = None
+    if instance.pk and not instance._state.adding:
+        instance._anterior = sender.objects.filter(pk=instance.pk).values('producto_id', 'fecha').first()
+
+
+@receiver(post_save, sender=Transaccion)
+def recalcular_saldos_transaccion_editada(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Una transacción editada (p. ej. desde el administrador) cambia el saldo de
+    los movimientos posteriores y los cierres mensuales desde su fecha (la
+    anterior o la nueva, la que sea menor). Las nuevas ya reciben su saldo en
+    save() o en las cargas masivas (asignar_saldos), por lo que no se
+    recalculan aquí.
+    """
+    if created or (update_fields and set(update_fields) <= {'saldo'}):
+        return
+    productos = {instance.producto_id}
+    fechas = [instance.fecha]
+    anterior = getattr(instance, '_anterior', None)
+    if anterior:
+        productos.add(anterior['producto_id'])
+        fechas.append(anterior['fecha'])
+    for producto_id in productos:
+        Transaccion.recalcular_saldos(producto_id)
+    fechas = [fecha for fecha in fechas if fecha]
+    if fechas:
+        invalidar_cierres_desde(timezone.localtime(min(fechas)).date())
+
+
+@receiver(post_delete, sender=Transaccion)
+def recalcular_saldos_transaccion_eliminada(sender, instance, origin=None, **kwargs):
+    """
+    Quitar un movimiento cambia el saldo de los posteriores del mismo producto
+    y los cierres mensuales desde su fecha.
+    """
+    if isinstance(origin, Producto):
+        # El producto se eliminó junto con todo su bincard
+        return
+    Transaccion.recalcular_saldos(instance.producto_id)
+    if instance.fecha:
+        invalidar_cierres_desde(timezone.localtime(instance.fecha).date())
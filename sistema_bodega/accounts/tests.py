@@ -1,3 +1,461 @@
+from datetime import timedelta
+from io import BytesIO
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Sum
 from django.test import TestCase
+from django.utils import timezone
+
+from .busqueda import buscar_productos, expresion_fts
+from .carrito import (
+    LOTE_EN_PROCESO, LoteEnProceso, actualizar_linea_carrito, agregar_al_carrito, agregar_escaneos, lineas_carrito,
+    tomar_carrito, validar_carrito
+)
+from .cierres import consulta_stock_a_fecha, fin_del_dia, generar_cierres, ultimo_mes_completo
+from .despacho import registrar_salida
+from .importacion import importar_archivo_productos
+from .models import (
+    ActaEntrega, AsignacionLote, Categoria, CierreStock, CustomUser, EncabezadoActa, LineaCarritoSalida, LoteProducto,
+    Producto, RecepcionStock, Transaccion
+)
+from .recepcion import registrar_recepcion
+
+
+def crear_producto(descripcion, stock=0, tiene_vencimiento=False):
+    """Producto con una entrada inicial de `stock` en el bincard."""
+    producto = Producto.objects.create(descripcion=descripcion, tiene_vencimiento=tiene_vencimiento)
+    if stock and not tiene_vencimiento:
+        producto.stock = stock
+        producto.save()
+    if stock:
+        Transaccion.objects.create(producto=producto, tipo='entrada', cantidad=stock)
+    return producto
+
+
+def linea(producto, cantidad):
+    return {'codigo_barra': producto.codigo_barra, 'cantidad': cantidad, 'numero_siscom': '1', 'observacion': ''}
+
+
+class RegistrarSalidaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = CustomUser.objects.create(rut='11111111-1', nombre='Bodeguero')
+
+    def salida(self, lineas):
+        return registrar_salida(lineas, 'Informática', None, self.usuario)
+
+    def test_descuenta_lotes_en_orden_fifo(self):
+        producto = crear_producto('Suero', tiene_vencimiento=True)
+        hoy = timezone.localdate()
+        primero = producto.crear_lote_automatico(3, hoy + timedelta(days=10))
+        segundo = producto.crear_lote_automatico(5, hoy + timedelta(days=40))
+        Transaccion.objects.create(producto=producto, tipo='entrada', cantidad=8)
+
+        resultado = self.salida([linea(producto, 6)])
+
+        primero.refresh_from_db()
+        segundo.refresh_from_db()
+        producto.refresh_from_db()
+        self.assertEqual((primero.stock, segundo.stock, producto.stock), (0, 2, 2))
+        self.assertEqual(
+            list(AsignacionLote.objects.order_by('fecha_vencimiento').values_list('lote_id', 'cantidad')),
+            [(primero.pk, 3), (segundo.pk, 3)],
+        )
+        salida = Transaccion.objects.get(producto=producto, tipo='salida')
+        self.assertEqual(salida.acta_entrega.numero_acta, resultado['numero_acta'])
+        self.assertEqual(salida.saldo, 2)
+
+    def test_producto_sin_vencimiento(self):
+        producto = crear_producto('Resma', stock=10)
+
+        self.salida([linea(producto, 4)])
+
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock, 6)
+        self.assertEqual(Transaccion.objects.get(producto=producto, tipo='salida').saldo, 6)
+
+    def test_revierte_toda_la_salida_si_una_linea_falla(self):
+        resma = crear_producto('Resma', stock=10)
+        lapiz = crear_producto('Lápiz', stock=2)
+
+        with self.assertRaises(ValidationError):
+            self.salida([linea(resma, 4), linea(lapiz, 3)])
+
+        resma.refresh_from_db()
+        lapiz.refresh_from_db()
+        self.assertEqual((resma.stock, lapiz.stock), (10, 2))
+        self.assertFalse(EncabezadoActa.objects.exists())
+        self.assertFalse(ActaEntrega.objects.exists())
+        self.assertFalse(Transaccion.objects.filter(tipo='salida').exists())
+
+    def test_no_deja_stock_negativo(self):
+        producto = crear_producto('Suero', tiene_vencimiento=True)
+        lote = producto.crear_lote_automatico(2, timezone.localdate() + timedelta(days=10))
+
+        with self.assertRaises(ValidationError):
+            self.salida([linea(producto, 3)])
+
+        lote.refresh_from_db()
+        producto.refresh_from_db()
+        self.assertEqual((lote.stock, producto.stock), (2, 2))
+        self.assertFalse(LoteProducto.objects.filter(stock__lt=0).exists())
+
+    def test_rechaza_cantidades_no_positivas(self):
+        producto = crear_producto('Resma', stock=10)
+
+        for cantidad in (0, -1, '', None, 'dos'):
+            with self.subTest(cantidad=cantidad), self.assertRaises(ValidationError):
+                self.salida([linea(producto, cantidad)])
+
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock, 10)
+
+
+class SaldosBincardTests(TestCase):
+
+    def saldos(self, producto):
+        return list(
+            Transaccion.objects.filter(producto=producto).order_by(*Transaccion.ORDEN_BINCARD)
+            .values_list('saldo', flat=True)
+        )
+
+    def test_asignar_saldos_continua_desde_el_ultimo_saldo(self):
+        resma = crear_producto('Resma', stock=10)
+        lapiz = crear_producto('Lápiz', stock=3)
+        nuevas = [
+            Transaccion(producto=resma, tipo='entrada', cantidad=5),
+            Transaccion(producto=lapiz, tipo='entrada', cantidad=1),
+            Transaccion(producto=resma, tipo='entrada', cantidad=2),
+            # Una salida sin acta no cuenta en el bincard
+            Transaccion(producto=resma, tipo='salida', cantidad=4),
+        ]
+
+        Transaccion.asignar_saldos(nuevas)
+
+        self.assertEqual([t.saldo for t in nuevas], [15, 4, 17, 17])
+
+    def test_recalcular_saldos_corrige_los_guardados(self):
+        producto = crear_producto('Resma', stock=10)
+        for cantidad in (5, 2):
+            Transaccion.objects.create(producto=producto, tipo='entrada', cantidad=cantidad)
+        Transaccion.objects.filter(producto=producto).update(saldo=99)
+
+        self.assertEqual(Transaccion.recalcular_saldos(producto.pk), 17)
+        self.assertEqual(self.saldos(producto), [10, 15, 17])
+
+    def test_editar_o_eliminar_recalcula_los_posteriores(self):
+        producto = crear_producto('Resma', stock=10)
+        Transaccion.objects.create(producto=producto, tipo='entrada', cantidad=5)
+        primera = Transaccion.objects.filter(producto=producto).order_by(*Transaccion.ORDEN_BINCARD).first()
+
+        primera.cantidad = 4
+        primera.save()
+        self.assertEqual(self.saldos(producto), [4, 9])
+
+        primera.delete()
+        self.assertEqual(self.saldos(producto), [5])
+
+
+class CierresTests(TestCase):
+
+    def mover(self, producto, tipo, cantidad, dias_atras):
+        transaccion = Transaccion.objects.create(producto=producto, tipo=tipo, cantidad=cantidad)
+        Transaccion.objects.filter(pk=transaccion.pk).update(fecha=timezone.now() - timedelta(days=dias_atras))
+
+    def historia_completa(self, producto, hasta):
+        """Saldo al final del día `hasta` sumando todos los movimientos del producto."""
+        return Transaccion.objects.filter(producto=producto, fecha__lt=fin_del_dia(hasta)).aggregate(
+            saldo=Sum(Transaccion.expresion_variacion())
+        )['saldo'] or 0
+
+    def test_cierres_coinciden_con_la_suma_de_toda_la_historia(self):
+        usuario = CustomUser.objects.create(rut='11111111-1', nombre='Bodeguero')
+        resma = crear_producto('Resma')
+        lapiz = crear_producto('Lápiz')
+        self.mover(resma, 'entrada', 20, 100)
+        self.mover(lapiz, 'entrada', 7, 95)
+        self.mover(resma, 'entrada', 5, 65)
+        self.mover(lapiz, 'salida', 3, 35)  # Sin acta: no cuenta
+        self.mover(resma, 'entrada', 1, 0)
+        resma.stock, lapiz.stock = 26, 7
+        resma.save()
+        lapiz.save()
+        registrar_salida([linea(resma, 8), linea(lapiz, 2)], 'Informática', None, usuario)
+        Transaccion.objects.filter(tipo='salida', acta_entrega__isnull=False).update(
+            fecha=timezone.now() - timedelta(days=40)
+        )
+
+        generados = generar_cierres()
+
+        self.assertTrue(generados)
+        ultimo = ultimo_mes_completo()
+        for producto in (resma, lapiz):
+            for cierre in CierreStock.objects.filter(producto=producto):
+                with self.subTest(producto=producto.descripcion, fecha=cierre.fecha):
+                    self.assertEqual(cierre.saldo, self.historia_completa(producto, cierre.fecha))
+            with self.subTest(producto=producto.descripcion, fecha=ultimo):
+                stock = consulta_stock_a_fecha(ultimo).filter(pk=producto.pk).values_list('stock_a_fecha', flat=True)
+                self.assertEqual(stock.first() or 0, self.historia_completa(producto, ultimo))
+
+
+class CarritoSalidaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = CustomUser.objects.create(rut='11111111-1', nombre='Bodeguero')
+        cls.resma = crear_producto('Resma', stock=10)
+
+    def test_agregar_rechaza_repetidos_y_sin_stock(self):
+        agregar_al_carrito(self.usuario, self.resma)
+        with self.assertRaisesMessage(ValidationError, 'ya está en la lista'):
+            agregar_al_carrito(self.usuario, self.resma)
+        with self.assertRaisesMessage(ValidationError, 'no tiene stock'):
+            agregar_al_carrito(self.usuario, crear_producto('Lápiz'))
+        self.assertEqual(LineaCarritoSalida.objects.filter(usuario=self.usuario).count(), 1)
+
+    def test_actualizar_linea_valida_los_datos(self):
+        agregar_al_carrito(self.usuario, self.resma)
+        codigo = self.resma.codigo_barra
+        for siscom, cantidad in (('abc', '1'), ('1', 'dos'), ('1', '0'), ('1', '11')):
+            with self.subTest(siscom=siscom, cantidad=cantidad), self.assertRaises(ValidationError):
+                actualizar_linea_carrito(self.usuario, codigo, siscom, cantidad, '')
+        with self.assertRaises(ValidationError):
+            actualizar_linea_carrito(self.usuario, 'no-existe', '1', '1', '')
+
+        actualizar_linea_carrito(self.usuario, codigo, '123', '4', 'Para oficina')
+
+        linea = LineaCarritoSalida.objects.get(usuario=self.usuario)
+        self.assertEqual((linea.numero_siscom, linea.cantidad, linea.observacion), ('123', 4, 'Para oficina'))
+
+    def test_validar_carrito_contra_el_stock(self):
+        with self.assertRaises(ValidationError):
+            validar_carrito(lineas_carrito(self.usuario))
+        agregar_al_carrito(self.usuario, self.resma)
+        with self.assertRaisesMessage(ValidationError, 'no puede estar vacío'):
+            validar_carrito(lineas_carrito(self.usuario))
+        actualizar_linea_carrito(self.usuario, self.resma.codigo_barra, '123', '8', '')
+        validar_carrito(lineas_carrito(self.usuario))
+
+        # El stock se lee junto con las líneas: otra salida lo bajó mientras tanto
+        Producto.objects.filter(pk=self.resma.pk).update(stock=5)
+        with self.assertRaisesMessage(ValidationError, 'no puede superar el stock actual (5)'):
+            validar_carrito(lineas_carrito(self.usuario))
+
+    def test_tomar_carrito_rechaza_el_segundo_envio(self):
+        agregar_al_carrito(self.usuario, self.resma)
+        actualizar_linea_carrito(self.usuario, self.resma.codigo_barra, '123', '3', '')
+
+        lineas = tomar_carrito(self.usuario)
+
+        self.assertEqual([(linea['codigo_barra'], linea['cantidad']) for linea in lineas], [(self.resma.codigo_barra, 3)])
+        self.assertFalse(LineaCarritoSalida.objects.filter(usuario=self.usuario).exists())
+        with self.assertRaises(ValidationError):
+            tomar_carrito(self.usuario)
+
+    def test_escaneos_suman_sin_superar_el_stock(self):
+        lapiz = crear_producto('Lápiz', stock=2)
+
+        resultados = agregar_escaneos(
+            self.usuario, [(self.resma.codigo_barra, None), (self.resma.codigo_barra, 3), (lapiz.codigo_barra, 3),
+                           ('no-existe', None)]
+        )
+
+        self.assertEqual(resultados[self.resma.codigo_barra], {'success': True, 'cantidad': 4})
+        self.assertFalse(resultados[lapiz.codigo_barra]['success'])
+        self.assertFalse(resultados['no-existe']['success'])
+        # Las lecturas siguientes se suman a la línea existente, también contra el stock
+        resultados = agregar_escaneos(self.usuario, [(self.resma.codigo_barra, 7)])
+        self.assertFalse(resultados[self.resma.codigo_barra]['success'])
+        agregar_escaneos(self.usuario, [(self.resma.codigo_barra, 6)])
+        self.assertEqual(
+            list(LineaCarritoSalida.objects.filter(usuario=self.usuario).values_list('producto_id', 'cantidad')),
+            [(self.resma.pk, 10)],
+        )
+
+    def test_lote_de_escaneos_repetido_se_aplica_una_vez(self):
+        lote = uuid4().hex
+        escaneos = [(self.resma.codigo_barra, 2)]
+
+        primero = agregar_escaneos(self.usuario, escaneos, lote=lote)
+        reenvio = agregar_escaneos(self.usuario, escaneos, lote=lote)
+
+        self.assertEqual(primero, reenvio)
+        self.assertEqual(LineaCarritoSalida.objects.get(usuario=self.usuario).cantidad, 2)
+        agregar_escaneos(self.usuario, escaneos, lote=uuid4().hex)
+        self.assertEqual(LineaCarritoSalida.objects.get(usuario=self.usuario).cantidad, 4)
+
+    def test_lote_de_escaneos_en_proceso_no_se_da_por_aplicado(self):
+        lote = uuid4().hex
+        clave = f'escaneos:{self.usuario.pk}:{lote}'
+        cache.set(clave, LOTE_EN_PROCESO)
+        self.addCleanup(cache.delete, clave)
+
+        with self.assertRaises(LoteEnProceso):
+            agregar_escaneos(self.usuario, [(self.resma.codigo_barra, 2)], lote=lote)
+        self.assertFalse(LineaCarritoSalida.objects.filter(usuario=self.usuario).exists())
+
+        # El original falló y liberó el lote: el reenvío lo aplica
+        cache.delete(clave)
+        agregar_escaneos(self.usuario, [(self.resma.codigo_barra, 2)], lote=lote)
+        self.assertEqual(LineaCarritoSalida.objects.get(usuario=self.usuario).cantidad, 2)
+
+
+class ImportacionProductosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Insumos')
+        crear_producto('Existente', stock=1)
+
+    def importar(self, filas, simular=False, codificacion='utf-8'):
+        contenido = '\n'.join(
+            ['codigo_barra;descripcion;categoria;stock;fecha_vencimiento;rut_proveedor'] + filas
+        ).encode(codificacion)
+        return importar_archivo_productos(BytesIO(contenido), 'productos.csv', simular=simular)
+
+    def test_importa_productos_lotes_y_stock_inicial(self):
+        vence = (timezone.localdate() + timedelta(days=60)).strftime('%d/%m/%Y')
+        vence_antes = (timezone.localdate() + timedelta(days=20)).strftime('%d/%m/%Y')
+
+        resultado = self.importar([
+            ';Algodón;insumos;5;;11.111.111-1',
+            f'A-1;Suero;Insumos;4;{vence};',
+            f'A-1;Suero;Insumos;3;{vence_antes};',
+        ])
+
+        self.assertTrue(resultado['guardado'], resultado['errores'])
+        self.assertEqual((resultado['productos'], resultado['lotes']), (2, 2))
+        algodon = Producto.objects.get(descripcion='Algodón')
+        self.assertEqual((algodon.stock, algodon.rut_proveedor, algodon.categoria), (5, '11111111-1', self.categoria))
+        suero = Producto.objects.get(codigo_barra='A-1')
+        self.assertEqual((suero.stock, suero.lotes_activos), (7, 2))
+        self.assertEqual(suero.proximo_vencimiento, timezone.localdate() + timedelta(days=20))
+        self.assertEqual(
+            sorted(LoteProducto.objects.filter(producto=suero).values_list('numero_lote', 'stock')), [(1, 4), (2, 3)]
+        )
+        for producto in (algodon, suero):
+            transaccion = Transaccion.objects.get(producto=producto)
+            self.assertEqual((transaccion.tipo, transaccion.cantidad, transaccion.saldo), ('entrada', producto.stock, producto.stock))
+
+    def test_simular_no_guarda(self):
+        resultado = self.importar([';Algodón;Insumos;5;;'], simular=True)
+
+        self.assertEqual((resultado['productos'], resultado['guardado'], resultado['errores']), (1, False, []))
+        self.assertFalse(Producto.objects.filter(descripcion='Algodón').exists())
+
+    def test_con_errores_no_guarda_nada(self):
+        existente = Producto.objects.get(descripcion='Existente')
+
+        resultado = self.importar([
+            ';Algodón;Insumos;5;;',
+            ';Gasa;Insumos;2;;11111111-2',
+            f'{existente.codigo_barra};Otro;Insumos;1;;',
+            ';Venda;Inexistente;1;;',
+            'B-1;Jeringa;Insumos;1;;',
+            'B-1;Jeringa;Insumos;1;;',
+        ])
+
+        self.assertFalse(resultado['guardado'])
+        self.assertEqual([error['fila'] for error in resultado['errores']], [3, 4, 5, 6, 7])
+        self.assertIn('dígito verificador', resultado['errores'][0]['mensaje'])
+        self.assertIn('ya está registrado', resultado['errores'][1]['mensaje'])
+        self.assertEqual(Producto.objects.count(), 1)
+        self.assertEqual(Transaccion.objects.count(), 1)
+        self.assertFalse(LoteProducto.objects.exists())
+
+    def test_acepta_csv_de_excel_en_windows_1252(self):
+        resultado = self.importar([';Algodón;Insumos;5;;'], codificacion='cp1252')
+
+        self.assertTrue(resultado['guardado'], resultado['errores'])
+        self.assertTrue(Producto.objects.filter(descripcion='Algodón').exists())
+
+
+class RecepcionStockTests(TestCase):
+
+    def test_registra_todas_las_lineas(self):
+        resma = crear_producto('Resma', stock=10)
+        suero = crear_producto('Suero')
+        vence = timezone.localdate() + timedelta(days=90)
+
+        recepcion = registrar_recepcion(
+            [
+                {'codigo_barra': resma.codigo_barra, 'cantidad': 5, 'fecha_vencimiento': None},
+                {'codigo_barra': suero.codigo_barra, 'cantidad': 4, 'fecha_vencimiento': vence},
+                {'codigo_barra': resma.codigo_barra, 'cantidad': 2, 'fecha_vencimiento': None},
+            ],
+            rut_proveedor='11111111-1',
+        )
+
+        resma.refresh_from_db()
+        suero.refresh_from_db()
+        self.assertEqual(resma.stock, 17)
+        self.assertEqual((suero.stock, suero.tiene_vencimiento, suero.proximo_vencimiento, suero.lotes_activos),
+                         (4, True, vence, 1))
+        self.assertEqual(list(LoteProducto.objects.filter(producto=suero).values_list('numero_lote', 'stock')), [(1, 4)])
+        self.assertEqual(
+            list(recepcion.transacciones.order_by('id').values_list('producto_id', 'cantidad', 'saldo')),
+            [(resma.pk, 5, 15), (suero.pk, 4, 4), (resma.pk, 2, 17)],
+        )
+
+    def test_revierte_toda_la_recepcion_si_una_linea_falla(self):
+        resma = crear_producto('Resma', stock=10)
+        suero = crear_producto('Suero', tiene_vencimiento=True)
+
+        for lineas in (
+            [{'codigo_barra': resma.codigo_barra, 'cantidad': 5}, {'codigo_barra': 'no-existe', 'cantidad': 1}],
+            [{'codigo_barra': resma.codigo_barra, 'cantidad': 5}, {'codigo_barra': suero.codigo_barra, 'cantidad': 1}],
+            [{'codigo_barra': resma.codigo_barra, 'cantidad': 0}],
+        ):
+            with self.subTest(lineas=lineas), self.assertRaises(ValidationError):
+                registrar_recepcion(lineas)
+
+        resma.refresh_from_db()
+        self.assertEqual(resma.stock, 10)
+        self.assertFalse(RecepcionStock.objects.exists())
+        self.assertFalse(LoteProducto.objects.exists())
+        self.assertEqual(list(Transaccion.objects.values_list('producto_id', 'saldo')), [(resma.pk, 10)])
+
+
+class BusquedaProductosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nombre='Curaciones')
+        cls.algodon = Producto.objects.create(descripcion='Algodón hidrófilo', categoria=cls.categoria)
+        cls.jeringa = Producto.objects.create(descripcion='Jeringas 5 ml')
+
+    def buscar(self, texto):
+        return list(buscar_productos(Producto.objects.all(), texto))
+
+    def test_expresion_por_prefijo_sin_tildes_ni_plural(self):
+        self.assertEqual(expresion_fts('Jeringas de Algodón'), '"jeringa"* "algodon"*')
+        self.assertEqual(expresion_fts('"*'), '')
+
+    def test_prefijo_sin_tildes(self):
+        for texto in ('algod', 'ALGODON', 'hidrófilo algod'):
+            with self.subTest(texto=texto):
+                self.assertEqual(self.buscar(texto), [self.algodon])
+
+    def test_singular_y_plural(self):
+        for texto in ('jeringa', 'jeringas'):
+            with self.subTest(texto=texto):
+                self.assertEqual(self.buscar(texto), [self.jeringa])
+
+    def test_codigo_de_barra(self):
+        self.assertEqual(self.buscar(self.jeringa.codigo_barra), [self.jeringa])
+
+    def test_indice_sigue_los_cambios(self):
+        self.categoria.nombre = 'Apósitos'
+        self.categoria.save()
+        self.assertEqual(self.buscar('aposito'), [self.algodon])
+        self.assertEqual(self.buscar('curaciones'), [])
+
+        Producto.objects.filter(pk=self.jeringa.pk).update(descripcion='Aguja hipodérmica')
+        self.assertEqual(self.buscar('jeringa'), [])
+        self.assertEqual(self.buscar('hipoderm'), [self.jeringa])
 
-# Create your tests here.
+        self.algodon.delete()
+        self.assertEqual(self.buscar('algod'), [])
@@ -0,0 +1,209 @@
+"""Cola de trabajos en segundo plano sobre la base de datos.
+
+Los trabajos se guardan en el modelo ``Trabajo`` y se ejecutan fuera del
+proceso web, con el comando ``procesar_trabajos`` como worker dedicado (en
+desarrollo, ``TRABAJOS_EN_HILO`` los ejecuta en un hilo del propio proceso).
+Cada trabajo se reclama con un UPDATE condicional (pendiente -> en_proceso),
+por lo que ambos mecanismos pueden convivir sin ejecutar dos veces el mismo
+trabajo. Los que quedaron en proceso por un reinicio vuelven a la cola al
+iniciar el worker. Sólo requiere SQLite y el sistema de archivos local.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .archivo_actas import generar_archivo_actas
+from .exportacion import escribir_archivo, nombre_con_fecha
+from .models import Trabajo
+from .reportes import obtener_reporte
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántas filas (o actas) se guarda el avance del trabajo
+INTERVALO_PROGRESO = 1000
+INTERVALO_PROGRESO_ACTAS = 20
+
+# Trabajo que no es un reporte tabular: archivo de PDF de actas (ver archivo_actas)
+TIPO_ARCHIVO_ACTAS = 'archivo_actas'
+
+_ejecutor = None
+
+
+def _obtener_ejecutor():
+    global _ejecutor
+    if _ejecutor is None:
+        # Un solo hilo: los trabajos se ejecutan en orden y no compiten por la escritura en SQLite
+        _ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trabajos')
+    return _ejecutor
+
+
+def directorio_trabajos():
+    directorio = settings.TRABAJOS_DIR
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def encolar_trabajo(tipo, formato='xlsx', parametros=None, usuario=None):
+    """Registra un trabajo pendiente y, si corresponde, lo envía al hilo del proceso al confirmar la transacción."""
+    trabajo = Trabajo.objects.create(
+        tipo=tipo,
+        formato=formato,
+        parametros=parametros or {},
+        usuario=usuario if usuario and usuario.is_authenticated else None,
+    )
+    if getattr(settings, 'TRABAJOS_EN_HILO', False):
+        transaction.on_commit(lambda: _obtener_ejecutor().submit(_ejecutar_en_hilo, trabajo.pk))
+    return trabajo
+
+
+def reclamar_trabajo(pk=None):
+    """
+    Marca como en proceso un trabajo pendiente (el indicado o el más antiguo)
+    y lo devuelve; None si otro proceso ya lo tomó o no hay pendientes.
+    """
+    pendientes = Trabajo.objects.filter(estado='pendiente')
+    if pk is not None:
+        candidatos = [pk]
+    else:
+        candidatos = list(pendientes.order_by('creado', 'id').values_list('pk', flat=True)[:10])
+    for candidato in candidatos:
+        if pendientes.filter(pk=candidato).update(estado='en_proceso', iniciado=timezone.now()):
+            return Trabajo.objects.get(pk=candidato)
+    return None
+
+
+def _registrar_archivo(trabajo):
+    """
+    Asigna el archivo del trabajo y lo guarda antes de escribirlo, para que un
+    reinicio a mitad del trabajo sepa qué archivo incompleto eliminar.
+    """
+    trabajo.archivo = f"{trabajo.pk}_{trabajo.nombre_archivo}"
+    Trabajo.objects.filter(pk=trabajo.pk).update(archivo=trabajo.archivo, nombre_archivo=trabajo.nombre_archivo)
+    return os.path.join(directorio_trabajos(), trabajo.archivo)
+
+
+def _contar_filas(trabajo, filas):
+    procesadas = 0
+    for fila in filas:
+        yield fila
+        procesadas += 1
+        if procesadas % INTERVALO_PROGRESO == 0:
+            Trabajo.objects.filter(pk=trabajo.pk).update(progreso=procesadas)
+    trabajo.progreso = procesadas
+
+
+def _generar_reporte(trabajo):
+    reporte = obtener_reporte(trabajo.tipo, trabajo.formato, trabajo.parametros)
+    trabajo.total = reporte['total']()
+    Trabajo.objects.filter(pk=trabajo.pk).update(total=trabajo.total)
+
+    trabajo.nombre_archivo = nombre_con_fecha(reporte['nombre_base'], trabajo.formato)
+    ruta = _registrar_archivo(trabajo)
+    with open(ruta, 'wb') as destino:
+        escribir_archivo(
+            trabajo.formato, destino, reporte['titulo'], reporte['columnas'], reporte['campos'],
+            _contar_filas(trabajo, reporte['filas']), **reporte['opciones']
+        )
+
+
+def _generar_archivo_actas(trabajo):
+    """Trabajo 'archivo_actas': ZIP o PDF único con las actas de parametros['numeros']."""
+    numeros = trabajo.parametros.get('numeros', [])
+    trabajo.total = len(numeros)
+    Trabajo.objects.filter(pk=trabajo.pk).update(total=trabajo.total)
+
+    def avance(terminadas, total):
+        # El avance se guarda cada INTERVALO_PROGRESO_ACTAS actas
+        if terminadas - trabajo.progreso >= INTERVALO_PROGRESO_ACTAS:
+            trabajo.progreso = terminadas
+            Trabajo.objects.filter(pk=trabajo.pk).update(progreso=terminadas)
+
+    trabajo.nombre_archivo = nombre_con_fecha('Actas', trabajo.formato)
+    ruta = _registrar_archivo(trabajo)
+    trabajo.progreso = 0
+    trabajo.progreso = generar_archivo_actas(numeros, ruta, trabajo.formato, progreso=avance)
+
+
+def ejecutar_trabajo(trabajo):
+    """Genera el archivo del trabajo ya reclamado y registra el resultado."""
+    try:
+        if trabajo.tipo == TIPO_ARCHIVO_ACTAS:
+            _generar_archivo_actas(trabajo)
+        else:
+            _generar_reporte(trabajo)
+        trabajo.estado = 'completado'
+    except Exception as e:
+        logger.exception(f"Error al ejecutar el trabajo {trabajo.pk}")
+        trabajo.estado = 'error'
+        trabajo.error = str(e)
+        # El archivo a medio escribir no sirve: no debe quedar en TRABAJOS_DIR
+        eliminar_archivo(trabajo)
+    trabajo.finalizado = timezone.now()
+    trabajo.save(update_fields=['estado', 'progreso', 'total', 'archivo', 'nombre_archivo', 'error', 'finalizado'])
+    return trabajo
+
+
+def _ejecutar_en_hilo(pk):
+    close_old_connections()
+    try:
+        trabajo = reclamar_trabajo(pk)
+        if trabajo:
+            ejecutar_trabajo(trabajo)
+    finally:
+        # El hilo tiene su propia conexión; se cierra al terminar cada trabajo
+        connection.close()
+
+
+def reiniciar_trabajos_interrumpidos(iniciados_antes=None):
+    """
+    Devuelve a la cola los trabajos en proceso iniciados antes de
+    `iniciados_antes` (por defecto, hace más de TRABAJOS_TIEMPO_MAXIMO segundos)
+    y elimina sus archivos incompletos. Devuelve cuántos se reiniciaron.
+    """
+    if iniciados_antes is None:
+        iniciados_antes = timezone.now() - timedelta(seconds=getattr(settings, 'TRABAJOS_TIEMPO_MAXIMO', 2 * 60 * 60))
+    interrumpidos = Trabajo.objects.filter(estado='en_proceso', iniciado__lt=iniciados_antes)
+    for trabajo in interrumpidos.only('archivo'):
+        eliminar_archivo(trabajo)
+    return interrumpidos.update(estado='pendiente', progreso=0, iniciado=None, archivo='')
+
+
+def procesar_pendientes(limite=None):
+    """Ejecuta trabajos pendientes en orden de llegada. Devuelve cuántos se procesaron."""
+    procesados = 0
+    while limite is None or procesados < limite:
+        trabajo = reclamar_trabajo()
+        if trabajo is None:
+            break
+        ejecutar_trabajo(trabajo)
+        procesados += 1
+    return procesados
+
+
+def ruta_archivo(trabajo):
+    """Ruta en disco del archivo generado por el trabajo."""
+    return os.path.join(settings.TRABAJOS_DIR, trabajo.archivo)
+
+
+def eliminar_archivo(trabajo):
+    """Borra el archivo del trabajo si llegó a crearse."""
+    if trabajo.archivo:
+        try:
+            os.remove(ruta_archivo(trabajo))
+        except FileNotFoundError:
+            pass
+        trabajo.archivo = ''
+
+
+def eliminar_trabajos_antiguos(dias):
+    """Borra los trabajos terminados hace más de `dias` días junto con sus archivos."""
+    limite = timezone.now() - timedelta(days=dias)
+    antiguos = Trabajo.objects.filter(estado__in=['completado', 'error'], finalizado__lt=limite)
+    for trabajo in antiguos.only('archivo'):
+        eliminar_archivo(trabajo)
+    return antiguos.delete()[0]
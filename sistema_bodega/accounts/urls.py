@@ -14,8 +14,10 @@ urlpatterns = [
 
     # Rutas de Gestión de Productos
     path('registrar-producto/', views.registrar_producto, name='registrar-producto'),  # Registrar un nuevo producto
+    path('importar-productos/', views.importar_productos, name='importar-productos'),  # Importación masiva de productos y lotes desde Excel/CSV
     path('listar-productos/', views.listar_productos, name='listar-productos'),  # Listar todos los productos
     path('agregar-stock/', views.agregar_stock, name='agregar-stock'),  # Vista para agregar stock (selección de producto)
+    path('recepcion-stock/', views.recepcion_stock, name='recepcion-stock'),  # Recepción de una entrega con varios productos
     path('agregar-stock/<str:codigo_barra>/', views.agregar_stock_detalle, name='agregar-stock-detalle'),  # Detalle para agregar stock a un producto específico
 
     # Rutas de Salida de Productos
@@ -31,6 +33,7 @@ urlpatterns = [
     path('bincard/buscar/', views.bincard_buscar, name='bincard-buscar'),  # Buscar productos para ver historial
     path('bincard/historial/<str:codigo_barra>/', views.bincard_historial, name='bincard-historial'),  # Ver historial de transacciones de un producto
     path('bincard/buscar-codigos/', views.buscar_codigos_barra, name='buscar-codigos-barra'),  # Búsqueda de códigos de barra (autocompletado)
+    path('stock-a-fecha/', views.stock_a_fecha, name='stock-a-fecha'),  # Stock de todos los productos a una fecha (inventarios)
 
     # Rutas de Gestión de Departamentos
     path('agregar-departamento/', views.agregar_departamento, name='agregar-departamento'),  # Agregar un nuevo departamento
@@ -46,6 +49,7 @@ urlpatterns = [
     path('control-vencimientos/', views.control_vencimientos, name='control-vencimientos'),  # Vista principal de control de vencimientos
     path('control-vencimientos/exportar/', views.exportar_vencimientos_excel, name='exportar-vencimientos-excel'),  # Exportar control de vencimientos a Excel
     path('detalle-lotes/<str:codigo_barra>/', views.detalle_lotes_producto, name='detalle-lotes-producto'),  # Ver detalle de lotes de un producto
+    path('detalle-lotes/<str:codigo_barra>/lote/<int:numero_lote>/', views.trazabilidad_lote, name='trazabilidad-lote'),  # Actas y departamentos que recibieron un lote
     path('agregar-vencimiento/', views.agregar_vencimiento_producto, name='agregar-vencimiento'),  # Gestión de vencimientos de productos y lotes
     
     # Rutas AJAX para gestión de vencimientos
@@ -55,6 +59,11 @@ urlpatterns = [
     path('ajax/obtener-lotes-producto/', views.obtener_lotes_producto_ajax, name='obtener-lotes-producto-ajax'),  # AJAX para obtener lotes de un producto
     path('ajax/obtener-datos-producto/', views.obtener_datos_producto_ajax, name='obtener-datos-producto-ajax'),  # AJAX para obtener datos actualizados de producto
 
+    # Rutas de Trabajos en segundo plano (exportaciones pesadas)
+    path('trabajos/<int:pk>/', views.estado_trabajo, name='estado-trabajo'),  # Avance de un trabajo y enlace de descarga
+    path('ajax/trabajos/<int:pk>/', views.estado_trabajo_ajax, name='estado-trabajo-ajax'),  # AJAX con el estado del trabajo
+    path('trabajos/<int:pk>/descargar/', views.descargar_trabajo, name='descargar-trabajo'),  # Descargar el archivo generado
+
     # Rutas de Gestión de Usuarios
     path('listar-usuarios/', views.listar_usuarios, name='listar-usuarios'),  # Listar todos los usuarios
     path('agregar-usuario/', views.agregar_usuario, name='agregar-usuario'),  # Agregar un nuevo usuario
@@ -2,35 +2,43 @@
 from datetime import datetime
 import json
 import os
-import urllib.parse
 import logging
-import base64
-from io import BytesIO
 
 # Módulos de bibliotecas de terceros
-import openpyxl
 import pytz
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm, inch
-from reportlab.pdfgen import canvas
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
 
 # Módulos de Django
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.views import LoginView
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db import models
-from django.db.models import Q
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.db import models, transaction
+from django.db.models import Q, prefetch_related_objects
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.text import slugify
 
 # Módulos locales del proyecto
+from .actas_pdf import huella_acta, lineas_acta, obtener_pdf_acta
+from .busqueda import INDICE_AUTOCOMPLETADO, buscar_productos
+from .carrito import (
+    LoteEnProceso, actualizar_linea_carrito, agregar_al_carrito, agregar_escaneos, interpretar_escaneos, lineas_carrito,
+    quitar_del_carrito, tomar_carrito, validar_carrito, vaciar_carrito
+)
+from .cache_inventario import obtener_version_catalogo
+from .cierres import cierre_anterior, consulta_stock_a_fecha
+from .dashboard import obtener_snapshot_dashboard
+from .despacho import registrar_salida
+from .exportacion import FORMATOS_STREAMING, iterar_datos, nombre_con_fecha, respuesta_streaming, respuesta_xlsx
+from .importacion import COLUMNAS_IMPORTACION, importar_archivo_productos
+from .recepcion import registrar_recepcion
 from .forms import (
     ActaEntregaForm,
     AgregarStockConVencimientoForm,
@@ -46,33 +54,49 @@ from .forms import (
     CategoriaForm,  # Añadido para manejar categorías
     ModificarCategoriaForm,  # Añadido para modificar categorías
     EliminarCategoriaForm,  # Añadido para deshabilitar categorías
+    ImportarProductosForm,
+    LineaRecepcionFormSet,
+    RecepcionStockForm,
 )
 from .models import (
     ActaEntrega,
     CustomUser,
     Departamento,
+    EncabezadoActa,
     Funcionario,
     LoteProducto,
     Producto,
     Responsable,
     Transaccion,
     Categoria,  # Añadido para manejar categorías dinámicas
+    Trabajo,
+    filtro_estado_vencimiento,
+)
+from .reportes import (
+    CAMPOS_BINCARD, CAMPOS_CONSULTA_BINCARD, COLUMNAS_TRAZABILIDAD, CAMPOS_TRAZABILIDAD, asegurar_saldos_bincard,
+    consulta_movimientos_bincard, fila_bincard, filas_trazabilidad_lote, obtener_reporte, respuesta_reporte
 )
+from .paginacion import paginar_por_cursor
+from .trabajos import encolar_trabajo, ruta_archivo
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Funciones auxiliares
-def limpiar_sesion_productos_salida(request):
-    """Limpia la variable de sesión productos_salida si existe"""
-    if 'productos_salida' in request.session:
-        logger.info("Limpiando variable de sesión 'productos_salida'.")
-        del request.session['productos_salida']
-        request.session.modified = True
-
-def paginar_resultados(request, objetos, items_por_pagina=20):
-    """Aplica paginación a una lista de objetos"""
+def vaciar_carrito_salida(request):
+    """Descarta el carrito de salida del usuario al salir de la pantalla de salidas"""
+    if request.user.is_authenticated:
+        vaciar_carrito(request.user)
+
+def paginar_resultados(request, objetos, items_por_pagina=20, orden=None, contar=False):
+    """
+    Aplica paginación a una lista de objetos. Con `orden` (columnas únicas en
+    conjunto) la vista opta por la paginación por cursor: sin COUNT ni OFFSET,
+    con "anterior/siguiente" y, si `contar`, un total aproximado en caché.
+    """
+    if orden:
+        return paginar_por_cursor(request, objetos, orden, items_por_pagina, contar=contar)
     paginator = Paginator(objetos, items_por_pagina)
     page = request.GET.get('page')
     try:
@@ -83,6 +107,23 @@ def paginar_resultados(request, objetos, items_por_pagina=20):
         page_obj = paginator.page(paginator.num_pages)
     return page_obj
 
+def filtro_prefijo_numero(campo, prefijo, digitos=10):
+    """
+    Condición "el número empieza con `prefijo`" como unión de rangos (12 ->
+    12, 120-129, 1200-1299, ...), que la base resuelve sobre el índice del campo
+    en lugar de convertir cada número a texto.
+    """
+    if prefijo <= 0:
+        return Q(**{campo: prefijo})
+    if len(str(prefijo)) > digitos:
+        # Ningún número del campo tiene tantas cifras (un Q() vacío coincidiría con todo)
+        return Q(pk__in=[])
+    condicion = Q()
+    for ceros in range(digitos - len(str(prefijo)) + 1):
+        escala = 10 ** ceros
+        condicion |= Q(**{f'{campo}__range': (prefijo * escala, (prefijo + 1) * escala - 1)})
+    return condicion
+
 def paginar_resultados_dinamico(request, objetos, items_por_pagina=20):
     """
     Aplica paginación con numeración dinámica limitada
@@ -135,372 +176,65 @@ def paginar_resultados_dinamico(request, objetos, items_por_pagina=20):
     
     return page_obj
 
-def generar_pdf_acta(actas, disposition='attachment'):
-    """Genera un PDF para un acta de entrega con límite de 100 caracteres y texto ajustado."""
-    try:
-        logger.info("Generando PDF para las actas...")
-        acta = actas.first()
-        if not acta:
-            raise ValueError("No se encontraron actas para generar el PDF.")
-
-        productos_salida = [
-            {
-                'codigo_barra': item.producto.codigo_barra,
-                'descripcion': item.producto.descripcion[:100],  # Límite de 100 caracteres
-                'numero_siscom': str(item.numero_siscom or '')[:100],  # Límite de 100 caracteres
-                'cantidad': item.cantidad,
-                # Permitir observaciones largas, sin truncar, y respetar saltos de línea
-                'observacion': str(item.observacion or ''),
-            } for item in actas
-        ]
-        logger.info(f"Productos para el PDF (con límite de 100 caracteres): {productos_salida}")
-
-        # Usar un buffer para generar el PDF
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, leftMargin=0.75*inch, rightMargin=0.75*inch,
-                                topMargin=0.5*inch, bottomMargin=0.5*inch,
-                                title=f"Acta N°{acta.numero_acta}")  # Establecer el título del PDF
-        styles = getSampleStyleSheet()
-
-        # Definir estilos personalizados
-        custom_styles = {
-            'TitleCustom': ParagraphStyle(name='TitleCustom', fontName='Helvetica-Bold', fontSize=14, alignment=1, spaceAfter=10, leading=16),
-            'NormalBold': ParagraphStyle(name='NormalBold', fontName='Helvetica-Bold', fontSize=10, spaceAfter=4, leading=12),
-            'NormalCustom': ParagraphStyle(name='NormalCustom', fontName='Helvetica-Bold', fontSize=10, spaceAfter=4, leading=12),
-            'ActaNumber': ParagraphStyle(name='ActaNumber', fontName='Helvetica-Bold', fontSize=20, alignment=1, textColor=colors.black, spaceAfter=0, leading=24),
-            'Signature': ParagraphStyle(name='Signature', fontName='Times-Roman', fontSize=10, alignment=1, spaceBefore=10, spaceAfter=4, leading=12),
-            'SignatureTitle': ParagraphStyle(name='SignatureTitle', fontName='Times-Bold', fontSize=10, alignment=1, spaceBefore=4, spaceAfter=4, leading=12),
-            'SignatureCargo': ParagraphStyle(name='SignatureCargo', fontName='Times-Italic', fontSize=9, alignment=1, spaceBefore=2, spaceAfter=2, leading=11),
-            'TableCell': ParagraphStyle(name='TableCell', fontName='Helvetica', fontSize=9, leading=11, wordWrap='CJK', alignment=0),  # Ajuste para envolver texto
-        }
-
-        elements = []
-        # --- Encabezado profesional con logo y textos ---
-        logo_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'images', 'seremi_logo.png')
-        logger.info(f"Ruta del logo: {logo_path}")
-        if os.path.exists(logo_path):
-            logo = Image(logo_path, width=3*cm, height=3*cm)
-            logger.info("Logo cargado correctamente.")
-        else:
-            logger.warning("Logo no encontrado, usando texto alternativo.")
-            logo = Paragraph("Logo no encontrado", custom_styles['NormalCustom'])
-        logo.hAlign = 'LEFT'
-
-        encabezado_seremi = Paragraph("<b>SEREMI DE SALUD</b>", ParagraphStyle(name='EncabezadoSeremi', fontName='Helvetica-Bold', fontSize=16, alignment=0, textColor=colors.HexColor('#1a3c5e'), spaceAfter=0, leading=18))
-        encabezado_region = Paragraph("REGIÓN DE LA ARAUCANÍA", ParagraphStyle(name='EncabezadoRegion', fontName='Helvetica', fontSize=13, alignment=0, textColor=colors.HexColor('#1a3c5e'), spaceAfter=10, leading=15))
-
-        encabezado_tabla = Table(
-            [
-                [logo, Table([[encabezado_seremi], [encabezado_region]], colWidths=[10*cm])]
-            ],
-            colWidths=[3*cm, 13.5*cm], hAlign='LEFT'
-        )
-        encabezado_tabla.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-            ('ALIGN', (1, 0), (1, 0), 'LEFT'),
-            ('LEFTPADDING', (1, 0), (1, 0), 10),
-        ]))
-
-        acta_number = Paragraph(f"N° {acta.numero_acta}", custom_styles['ActaNumber'])
-        acta_number_table = Table([[acta_number]], colWidths=[1.5*inch], rowHeights=[0.5*inch])
-        acta_number_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 20),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ]))
-
-        header_table = Table([[encabezado_tabla, acta_number_table]], colWidths=[13.5*cm, 4.5*cm])
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-            ('ALIGN', (1, 0), (1, 0), 'RIGHT')
-        ]))
-
-        # Asegurarse de que los textos estén codificados correctamente y truncados
-        departamento_text = acta.departamento.encode('utf-8').decode('utf-8')[:100]
-        responsable_text = (acta.responsable.nombre.encode('utf-8').decode('utf-8') if acta.responsable else 'No especificado')[:100]
-        generador_text = (acta.generador.nombre.encode('utf-8').decode('utf-8') if acta.generador else 'No especificado')[:100]
-        fecha_text = acta.fecha.strftime('%d-%m-%Y')
-        logger.info(f"Textos para el PDF - Departamento: {departamento_text}, Responsable: {responsable_text}, Generador: {generador_text}, Fecha: {fecha_text}")
-
-        elements.extend([
-            header_table,
-            Spacer(1, 0.2*cm),
-            Paragraph("ACTA DE ENTREGA MATERIALES O INSUMOS", custom_styles['TitleCustom']),
-            Spacer(1, 0.3*cm),
-            Paragraph(f"En Temuco con fecha {fecha_text} se procede a realizar la entrega de los siguientes artículos a:", custom_styles['NormalCustom']),
-            Spacer(1, 0.2*cm),
-            Paragraph(f"Sección: {departamento_text}", custom_styles['NormalCustom']),
-            Spacer(1, 0.1*cm),
-            Paragraph(f"Responsable: {responsable_text}", custom_styles['NormalCustom']),
-            Spacer(1, 0.5*cm),
-            Paragraph("Datos de Productos", custom_styles['NormalBold']),
-            Spacer(1, 0.2*cm)
-        ])
-
-        # Crear la tabla con ajuste de texto
-        data = [['Descripción', 'Nro. SISCOM', 'Cantidad', 'Observación']]
-        for item in productos_salida:
-            descripcion_text = item['descripcion'].encode('utf-8').decode('utf-8')
-            numero_siscom_text = item['numero_siscom'].encode('utf-8').decode('utf-8')
-            # Permitir observaciones largas y saltos de línea reales
-            observacion_text = (item['observacion'] or '-').replace('\n', '<br/>').encode('utf-8').decode('utf-8')
-            data.append([
-                Paragraph(descripcion_text, custom_styles['TableCell']),
-                Paragraph(numero_siscom_text, custom_styles['TableCell']),
-                Paragraph(str(item['cantidad']), custom_styles['TableCell']),
-                Paragraph(observacion_text, ParagraphStyle(name='ObsCell', fontName='Helvetica', fontSize=9, leading=11, wordWrap='CJK', alignment=0, allowWidows=1, allowOrphans=1))
-            ])
-            logger.info(f"Fila de la tabla: {descripcion_text}, {numero_siscom_text}, {item['cantidad']}, {observacion_text}")
-
-        # Ajustar anchos de columnas para evitar desbordamiento
-        table = Table(data, colWidths=[2.2*inch, 1.8*inch, 0.8*inch, 2.2*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BOX', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 1), (-1, -1), 'TOP'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 4),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 4),
-        ]))
-
-        responsable_lower = responsable_text.lower()
-        cargo = ("SECRETARIA DEL DEPARTAMENTO" if 'secretaria' in responsable_lower 
-                else "JEFE DEL DEPARTAMENTO" if 'jefe' in responsable_lower or 'jefatura' in responsable_lower 
-                else "RESPONSABLE DEL DEPARTAMENTO")
-
-        # Pie de firmas profesional y alineado
-        firma_table = Table([
-            [
-                Paragraph('<b>' + generador_text + '</b>', ParagraphStyle(name='FirmaNombre', fontName='Helvetica-Bold', fontSize=11, alignment=1, textColor=colors.HexColor('#1a3c5e'))),
-                Paragraph('<b>' + responsable_text + '</b>', ParagraphStyle(name='FirmaNombre', fontName='Helvetica-Bold', fontSize=11, alignment=1, textColor=colors.HexColor('#1a3c5e')))
-            ],
-            [
-                Paragraph('<b>ENCARGADO DE BODEGA</b>', ParagraphStyle(name='FirmaTitulo', fontName='Helvetica-Bold', fontSize=10, alignment=1, textColor=colors.HexColor('#1a3c5e'))),
-                Paragraph('<b>RECEPCIONA CONFORME</b>', ParagraphStyle(name='FirmaTitulo', fontName='Helvetica-Bold', fontSize=10, alignment=1, textColor=colors.HexColor('#1a3c5e')))
-            ],
-            [
-                Paragraph('SEREMI DE SALUD ARAUCANÍA', ParagraphStyle(name='FirmaSub', fontName='Helvetica', fontSize=9, alignment=1, textColor=colors.HexColor('#64748b'))),
-                Paragraph(cargo, ParagraphStyle(name='FirmaSub', fontName='Helvetica', fontSize=9, alignment=1, textColor=colors.HexColor('#64748b')))
-            ],
-            [
-                Paragraph('<u>_____________________________</u>', ParagraphStyle(name='FirmaLinea', fontName='Helvetica', fontSize=12, alignment=1, textColor=colors.black)),
-                Paragraph('<u>_____________________________</u>', ParagraphStyle(name='FirmaLinea', fontName='Helvetica', fontSize=12, alignment=1, textColor=colors.black))
-            ]
-        ], colWidths=[8*cm, 8*cm], hAlign='CENTER')
-        firma_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('TOPPADDING', (0, 0), (-1, -1), 2),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
-        ]))
-
-        from reportlab.platypus import KeepTogether
-        
-        # Estrategia simple y efectiva: spacer adaptativo según cantidad de productos
-        num_productos = len(productos_salida)
-        
-        # Calcular spacer inteligente que empuje las firmas hacia abajo
-        # pero sin crear páginas innecesarias
-        if num_productos <= 3:
-            # Pocos productos: usar spacer grande para empujar hacia abajo
-            spacer_firmas = Spacer(1, 6*cm)
-        elif num_productos <= 8:
-            # Productos medios: spacer moderado  
-            spacer_firmas = Spacer(1, 3*cm)
-        else:
-            # Muchos productos: spacer mínimo para evitar nueva página
-            spacer_firmas = Spacer(1, 0.8*cm)
-        
-        # KeepTogether asegura que las firmas no se corten
-        firmas_completas = KeepTogether([
-            spacer_firmas,
-            firma_table
-        ])
-        
-        elements.extend([table, firmas_completas])
-        logger.info("Construyendo el PDF...")
-        doc.build(elements)
-        logger.info("PDF generado correctamente.")
-
-        # Obtener el contenido del buffer y codificarlo en base64
-        pdf_content = buffer.getvalue()
-        pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
-        buffer.close()
-
-        # Devolver el PDF como base64 junto con el número del acta
-        return {
-            'pdf_base64': pdf_base64,
-            'numero_acta': str(acta.numero_acta),
-            'filename': f"Acta_N°{acta.numero_acta}.pdf"  # Mantener el nombre del archivo consistente
-        }
-
-    except Exception as e:
-        logger.error(f"Error al generar el PDF: {str(e)}")
-        return {'error': f"Error al generar el PDF: {str(e)}"}
+def detallar_pagina_productos(page_obj, construir_item):
+    """
+    Precarga los lotes activos sólo de los productos de la página y reemplaza
+    cada producto por el diccionario que devuelve construir_item.
+    """
+    productos_pagina = list(page_obj.object_list)
+    prefetch_related_objects(productos_pagina, Producto.prefetch_lotes_activos())
+    page_obj.object_list = [construir_item(producto) for producto in productos_pagina]
+    return page_obj
 
 def exportar_excel(request, datos, nombre_base, columnas, campos):
-    """Genera y devuelve un archivo Excel"""
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = nombre_base
-    ws.append(columnas)
-
-    for col in range(1, len(columnas) + 1):
-        cell = ws.cell(row=1, column=col)
-        cell.font = openpyxl.styles.Font(bold=True)
-        cell.fill = openpyxl.styles.PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-        cell.alignment = openpyxl.styles.Alignment(horizontal='center')
-
-    for idx, item in enumerate(datos, start=2):
-        fila = []
-        for campo in campos:
-            valor = getattr(item, campo) if hasattr(item, campo) else item.get(campo, '-')
-            # Si el campo es 'categoria', mostramos el nombre de la categoría
-            if campo == 'categoria' and valor:
-                valor = valor.nombre if hasattr(valor, 'nombre') else str(valor)
-            if campo == 'fecha' and isinstance(valor, datetime):
-                valor = valor.strftime('%d-%m-%Y %H:%M')
-            fila.append(valor)
-        ws.append(fila)
-
-    for col in ws.columns:
-        max_length = max(len(str(cell.value)) for cell in col if cell.value)
-        column_letter = col[0].column_letter
-        if column_letter == 'A':
-            ws.column_dimensions[column_letter].width = 20
-        else:
-            ws.column_dimensions[column_letter].width = max_length + 2
-
-    fecha = datetime.now().strftime('%Y-%m-%d')
-    filename = f"{nombre_base}_{fecha}.xlsx"
-    encoded_filename = urllib.parse.quote(filename)
+    """Genera y devuelve un archivo Excel (streaming, sin cargar todas las filas en memoria)"""
+    def filas():
+        for item in iterar_datos(datos):
+            fila = []
+            for campo in campos:
+                valor = getattr(item, campo) if hasattr(item, campo) else item.get(campo, '-')
+                # Si el campo es 'categoria', mostramos el nombre de la categoría
+                if campo == 'categoria' and valor:
+                    valor = valor.nombre if hasattr(valor, 'nombre') else str(valor)
+                if campo == 'fecha' and isinstance(valor, datetime):
+                    valor = valor.strftime('%d-%m-%Y %H:%M')
+                fila.append(valor)
+            yield fila
+
+    return respuesta_xlsx(
+        nombre_con_fecha(nombre_base, 'xlsx'), nombre_base, columnas, filas(),
+        anchos=[20] + [None] * (len(columnas) - 1)
+    )
 
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="{encoded_filename}"'
-    wb.save(response)
-    return response
+def formato_exportacion(request):
+    """
+    Formato de exportación solicitado: 'xlsx', 'csv', 'ndjson' o None.
+    Se acepta el botón del formulario (exportar_excel, exportar_csv, exportar_ndjson)
+    o el parámetro ?exportar=csv|ndjson|xlsx para descargas desde scripts.
+    """
+    if request.method == 'POST':
+        for formato, boton in (('xlsx', 'exportar_excel'), ('csv', 'exportar_csv'), ('ndjson', 'exportar_ndjson')):
+            if boton in request.POST:
+                return formato
+    formato = request.GET.get('exportar')
+    if formato == 'xlsx' or formato in FORMATOS_STREAMING:
+        return formato
+    return None
 
 # Vistas
 @login_required
 def home(request):
     """Vista para la página de inicio con métricas de stock"""
-    limpiar_sesion_productos_salida(request)
-
-    total_productos = Producto.objects.filter(stock__gt=0).count()
-    
-    if total_productos > 0:
-        stock_bajo = Producto.objects.filter(stock__gte=1, stock__lte=10).count()
-        stock_medio = Producto.objects.filter(stock__gt=10, stock__lte=50).count()
-        stock_alto = Producto.objects.filter(stock__gt=50).count()
-
-        porcentaje_bajo = (stock_bajo / total_productos * 100) if total_productos > 0 else 0
-        porcentaje_medio = (stock_medio / total_productos * 100) if total_productos > 0 else 0
-        porcentaje_alto = (stock_alto / total_productos * 100) if total_productos > 0 else 0
-
-        porcentaje_bajo = round(porcentaje_bajo, 2)
-        porcentaje_medio = round(porcentaje_medio, 2)
-        porcentaje_alto = round(porcentaje_alto, 2)
-
-        suma_porcentajes = porcentaje_bajo + porcentaje_medio + porcentaje_alto
-        if suma_porcentajes != 100.0:
-            if porcentaje_bajo >= porcentaje_medio and porcentaje_bajo >= porcentaje_alto:
-                porcentaje_bajo = round(porcentaje_bajo + (100.0 - suma_porcentajes), 2)
-            elif porcentaje_medio >= porcentaje_bajo and porcentaje_medio >= porcentaje_alto:
-                porcentaje_medio = round(porcentaje_medio + (100.0 - suma_porcentajes), 2)
-            else:
-                porcentaje_alto = round(porcentaje_alto + (100.0 - suma_porcentajes), 2)
-    else:
-        stock_bajo = stock_medio = stock_alto = 0
-        porcentaje_bajo = porcentaje_medio = porcentaje_alto = 0
+    vaciar_carrito_salida(request)
 
-    # Calcular métricas de vencimiento usando el sistema de lotes
-    from datetime import date, timedelta
-    hoy = date.today()
-    
-    # Productos con vencimiento que tienen stock
-    productos_con_vencimiento = Producto.objects.filter(
-        tiene_vencimiento=True,
-        stock__gt=0
-    ).prefetch_related('lotes')
-    
-    # Contar productos por estado de vencimiento usando el estado completo de lotes
-    vencidos = criticos = precaucion = normal = 0
-    for producto in productos_con_vencimiento:
-        estado = producto.get_estado_vencimiento_completo()
-        if estado == 'Vencido':
-            vencidos += 1
-        elif estado in ['Vence Hoy', 'Crítico']:
-            criticos += 1
-        elif estado == 'Precaución':
-            precaucion += 1
-        else:
-            normal += 1
-    
-    total_con_vencimiento = productos_con_vencimiento.count()
-    
-    # Obtener productos más críticos para mostrar en el dashboard
-    productos_criticos_list = []
-    for producto in productos_con_vencimiento:
-        estado = producto.get_estado_vencimiento_completo()
-        if estado in ['Vencido', 'Vence Hoy', 'Crítico']:
-            proximo_vencimiento = producto.get_proximo_vencimiento()
-            dias_restantes = (proximo_vencimiento - hoy).days if proximo_vencimiento else None
-            productos_criticos_list.append({
-                'producto': producto,
-                'estado': estado,
-                'dias_restantes': dias_restantes,
-                'fecha_vencimiento': proximo_vencimiento
-            })
-    
-    # Ordenar por criticidad (vencidos primero, luego por días restantes)
-    productos_criticos_list.sort(key=lambda x: (
-        0 if x['dias_restantes'] is None or x['dias_restantes'] < 0 else x['dias_restantes'],
-        x['producto'].descripcion
-    ))
-    
-    # Tomar solo los 5 más críticos para el dashboard
-    productos_criticos_top = productos_criticos_list[:5]
+    # Métricas de stock y vencimiento (snapshot en caché invalidado por movimientos de stock)
+    context = dict(obtener_snapshot_dashboard())
 
     chart_data = {
-        'totalProductos': total_productos,
-        'porcentajes': [porcentaje_bajo, porcentaje_medio, porcentaje_alto]
-    }
-
-    context = {
-        'total_productos': total_productos,
-        'stock_bajo': stock_bajo,
-        'stock_medio': stock_medio,
-        'stock_alto': stock_alto,
-        'porcentaje_bajo': porcentaje_bajo,
-        'porcentaje_medio': porcentaje_medio,
-        'porcentaje_alto': porcentaje_alto,
-        'chart_data_json': mark_safe(json.dumps(chart_data)),
-        # Control de vencimientos con información de lotes
-        'productos_con_vencimiento': total_con_vencimiento > 0,
-        'productos_vencidos': vencidos,
-        'productos_criticos': criticos,
-        'productos_precaucion': precaucion,
-        'productos_normal': normal,
-        'total_con_vencimiento': total_con_vencimiento,
-        'productos_criticos_top': productos_criticos_top,
+        'totalProductos': context['total_productos'],
+        'porcentajes': [context['porcentaje_bajo'], context['porcentaje_medio'], context['porcentaje_alto']]
     }
+    context['chart_data_json'] = mark_safe(json.dumps(chart_data))
     return render(request, 'accounts/home.html', context)
 
 class CustomLoginView(LoginView):
@@ -523,7 +257,7 @@ class CustomLoginView(LoginView):
 @login_required
 def registrar_producto(request):
     """Vista para registrar un nuevo producto"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_edit'):
         messages.error(request, 'No tienes permiso para registrar productos.')
         return redirect('home')
@@ -550,10 +284,54 @@ def registrar_producto(request):
         form = ProductoForm()
     return render(request, 'accounts/registrar_producto.html', {'form': form})
 
+# Máximo de errores de importación que se muestran en pantalla
+MAX_ERRORES_IMPORTACION = 500
+
+@login_required
+def importar_productos(request):
+    """Vista para importar productos y lotes en forma masiva desde un archivo Excel o CSV"""
+    vaciar_carrito_salida(request)
+    if not request.user.has_perm('accounts.can_edit'):
+        messages.error(request, 'No tienes permiso para importar productos.')
+        return redirect('home')
+    if request.GET.get('plantilla'):
+        return respuesta_xlsx('plantilla_productos.xlsx', 'Productos', COLUMNAS_IMPORTACION, [])
+
+    resultado = None
+    if request.method == 'POST':
+        form = ImportarProductosForm(request.POST, request.FILES)
+        if form.is_valid():
+            archivo = form.cleaned_data['archivo']
+            try:
+                resultado = importar_archivo_productos(archivo, archivo.name, simular=form.cleaned_data['simular'])
+            except Exception as e:
+                logger.error(f"Error al leer el archivo de importación {archivo.name}: {str(e)}")
+                messages.error(request, f'No se pudo leer el archivo: {str(e)}')
+            else:
+                if resultado['errores']:
+                    messages.error(request, f"Se encontraron {len(resultado['errores'])} errores. No se importó ningún producto.")
+                elif resultado['guardado']:
+                    messages.success(request, f"Se importaron {resultado['productos']} productos y {resultado['lotes']} lotes.")
+                    return redirect('listar-productos')
+                elif resultado['productos']:
+                    messages.info(request, f"Archivo válido: {resultado['productos']} productos y {resultado['lotes']} lotes listos para importar.")
+                else:
+                    messages.warning(request, 'El archivo no contiene productos.')
+    else:
+        form = ImportarProductosForm()
+
+    context = {
+        'form': form,
+        'resultado': resultado,
+        'errores': resultado['errores'][:MAX_ERRORES_IMPORTACION] if resultado else [],
+        'columnas': COLUMNAS_IMPORTACION,
+    }
+    return render(request, 'accounts/importar_productos.html', context)
+
 @login_required
 def listar_productos(request):
     """Vista para listar productos con filtros y exportación a Excel"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     params = request.POST if request.method == 'POST' else request.GET
     query_codigo = params.get('codigo_barra', '')
     query_descripcion = params.get('descripcion', '')
@@ -563,22 +341,32 @@ def listar_productos(request):
     if query_codigo:
         productos = productos.filter(codigo_barra=query_codigo)
     if query_descripcion:
-        productos = productos.filter(descripcion__icontains=query_descripcion)
+        productos = buscar_productos(productos, query_descripcion)
     if query_categoria and query_categoria != 'Todas':
         # Filtramos por el nombre de la categoría en el modelo Categoria
         productos = productos.filter(categoria__nombre=query_categoria)
 
-    if request.method == 'POST' and 'exportar_excel' in request.POST:
+    formato = formato_exportacion(request)
+    if formato:
         columnas = ['Código de Barra', 'Nombre del Producto', 'Categoría', 'Stock Actual']
         campos = ['codigo_barra', 'descripcion', 'categoria', 'stock']
-        return exportar_excel(request, productos, "Productos", columnas, campos)
+        if formato == 'xlsx':
+            return exportar_excel(request, productos.select_related('categoria'), "Productos", columnas, campos)
+        filas = productos.values_list('codigo_barra', 'descripcion', 'categoria__nombre', 'stock')
+        return respuesta_streaming(formato, "Productos", columnas, campos, iterar_datos(filas))
 
     # Obtener todas las categorías activas para el filtro
     categorias = Categoria.objects.filter(activo=True).order_by('nombre')
     # Crear la lista de categorías para el dropdown, incluyendo la opción "Todas"
     lista_categorias = [('', 'Todas')] + [(cat.nombre, cat.nombre) for cat in categorias]
 
-    page_obj = paginar_resultados(request, productos)
+    productos = productos.select_related('categoria')
+    if query_descripcion:
+        # Los resultados de una búsqueda van por relevancia: páginas numeradas
+        page_obj = paginar_resultados(request, productos)
+    else:
+        # Catálogo completo: por cursor sobre el código, la página 500 cuesta lo mismo que la 1
+        page_obj = paginar_resultados(request, productos, orden=('codigo_barra', 'id'), contar=True)
     context = {
         'page_obj': page_obj,
         'query_codigo': query_codigo,
@@ -591,7 +379,7 @@ def listar_productos(request):
 @login_required
 def agregar_stock(request):
     """Vista para listar productos y agregar stock"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_edit'):
         messages.error(request, 'No tienes permiso para agregar stock.')
         return redirect('home')
@@ -602,7 +390,7 @@ def agregar_stock(request):
     if query_codigo:
         productos = productos.filter(codigo_barra=query_codigo)
     if query_descripcion:
-        productos = productos.filter(descripcion__icontains=query_descripcion)
+        productos = buscar_productos(productos, query_descripcion)
 
     page_obj = paginar_resultados(request, productos)
     return render(request, 'accounts/agregar_stock.html', {
@@ -614,7 +402,7 @@ def agregar_stock(request):
 @login_required
 def agregar_stock_detalle(request, codigo_barra):
     """Vista para agregar stock a un producto específico con manejo automático de lotes"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_edit'):
         messages.error(request, 'No tienes permiso para agregar stock.')
         return redirect('home')
@@ -673,245 +461,132 @@ def agregar_stock_detalle(request, codigo_barra):
     return render(request, 'accounts/agregar_stock_detalle.html', context)
 
 @login_required
-def salida_productos(request):
-    """Vista para gestionar la salida de productos"""
+def recepcion_stock(request):
+    """Vista para registrar una entrega de proveedor con varias líneas de productos en una sola recepción"""
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_edit'):
-        messages.error(request, 'No tienes permiso para realizar salidas de productos.')
+        messages.error(request, 'No tienes permiso para agregar stock.')
         return redirect('home')
 
-    # Inicializar o cargar productos_salida desde la sesión
-    if 'productos_salida' not in request.session:
-        logger.info("Inicializando productos_salida en la sesión como lista vacía.")
-        request.session['productos_salida'] = []
-        request.session.modified = True  # Forzar sincronización de la sesión
-
-    productos_salida = request.session.get('productos_salida', [])
-    logger.info(f"Contenido inicial de productos_salida en la sesión: {productos_salida}")
-
-    # Preparar la lista de productos para mostrar
-    productos = Producto.objects.all().order_by('codigo_barra')
-    query_codigo = request.GET.get('codigo_barra', '')
-    query_descripcion = request.GET.get('descripcion', '')
+    if request.method == 'POST':
+        form = RecepcionStockForm(request.POST)
+        formset = LineaRecepcionFormSet(request.POST, prefix='lineas')
+        if form.is_valid() and formset.is_valid():
+            lineas = [linea.cleaned_data for linea in formset if linea.cleaned_data.get('codigo_barra')]
+            try:
+                recepcion = registrar_recepcion(lineas, usuario=request.user, **form.cleaned_data)
+            except ValidationError as e:
+                for mensaje in e.messages:
+                    messages.error(request, mensaje)
+            else:
+                messages.success(request,
+                    f'Recepción N°{recepcion.numero} registrada: {len(lineas)} líneas, '
+                    f'{sum(linea["cantidad"] for linea in lineas)} unidades y {len(recepcion.lotes)} lotes nuevos.'
+                )
+                return redirect('agregar-stock')
+        else:
+            messages.error(request, 'Error al registrar la recepción. Verifica los datos.')
+    else:
+        form = RecepcionStockForm()
+        formset = LineaRecepcionFormSet(prefix='lineas')
 
-    if query_codigo:
-        productos = productos.filter(codigo_barra=query_codigo)
-    if query_descripcion:
-        productos = productos.filter(descripcion__icontains=query_descripcion)
+    return render(request, 'accounts/recepcion_stock.html', {'form': form, 'formset': formset})
 
-    page_obj = paginar_resultados(request, productos)
+@login_required
+def salida_productos(request):
+    """Vista para gestionar la salida de productos (el carrito se guarda por usuario en la base)"""
+    if not request.user.has_perm('accounts.can_edit'):
+        messages.error(request, 'No tienes permiso para realizar salidas de productos.')
+        return redirect('home')
 
     # Manejar solicitud AJAX para obtener datos de salida
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' and request.GET.get('action') == 'get_salida_data':
-        logger.info("Solicitud AJAX para obtener datos de salida.")
-        productos_salida = request.session.get('productos_salida', [])  # Volver a cargar desde la sesión
-        logger.info(f"Enviando productos_salida en respuesta AJAX: {productos_salida}")
-        return JsonResponse({'success': True, 'productos_salida': productos_salida})
+        return JsonResponse({'success': True, 'productos_salida': lineas_carrito(request.user)})
 
     if request.method == 'POST':
-        logger.info(f"POST recibido en salida_productos: {request.POST}")
-
-        # Manejar solicitudes AJAX
+        # Manejar solicitudes AJAX: cada acción modifica sólo la línea del producto
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            # Acción para agregar un producto
-            if 'agregar_producto' in request.POST:
-                codigo_barra = request.POST.get('codigo_barra')
-                logger.info(f"Intentando agregar producto con código de barra: {codigo_barra}")
-                try:
-                    producto = Producto.objects.get(codigo_barra=codigo_barra)
-                    productos_salida = request.session.get('productos_salida', [])  # Recargar desde la sesión
-                    logger.info(f"Lista actual de productos_salida antes de agregar: {productos_salida}")
-
-                    if any(item['codigo_barra'] == codigo_barra for item in productos_salida):
-                        logger.warning(f"El producto {codigo_barra} ya está en la lista de salida.")
-                        return JsonResponse({'success': False, 'error': 'Este producto ya está en la lista de salida.'})
-                    if producto.stock == 0:
-                        logger.warning(f"No se puede retirar el producto {codigo_barra} porque no tiene stock.")
-                        return JsonResponse({'success': False, 'error': 'No se puede retirar este producto porque no tiene stock.'})
-
-                    productos_salida.append({
-                        'codigo_barra': producto.codigo_barra,
-                        'descripcion': producto.descripcion,
-                        'stock': producto.stock,
-                        'numero_siscom': '',
-                        'cantidad': '',  # Inicialmente vacío
-                        'observacion': '',
-                    })
-                    request.session['productos_salida'] = productos_salida
-                    request.session.modified = True
-                    logger.info(f"Producto agregado a la lista de salida: {producto.codigo_barra}")
-                    logger.info(f"Lista actualizada de productos_salida: {productos_salida}")
+            codigo_barra = request.POST.get('codigo_barra')
+            try:
+                # Acción para agregar un producto
+                if 'agregar_producto' in request.POST:
+                    try:
+                        producto = Producto.objects.get(codigo_barra=codigo_barra)
+                    except Producto.DoesNotExist:
+                        logger.error(f"Producto con código {codigo_barra} no encontrado.")
+                        return JsonResponse({'success': False, 'error': 'Producto no encontrado.'})
+                    agregar_al_carrito(request.user, producto)
+                    logger.info(f"Producto agregado a la lista de salida: {codigo_barra}")
                     return JsonResponse({'success': True})
 
-                except Producto.DoesNotExist:
-                    logger.error(f"Producto con código {codigo_barra} no encontrado.")
-                    return JsonResponse({'success': False, 'error': 'Producto no encontrado.'})
-
-            # Acción para eliminar un producto
-            elif 'eliminar_producto' in request.POST:
-                codigo_barra = request.POST.get('codigo_barra')
-                logger.info(f"Intentando eliminar producto con código de barra: {codigo_barra}")
-                productos_salida = request.session.get('productos_salida', [])  # Recargar desde la sesión
-                logger.info(f"Lista actual de productos_salida antes de eliminar: {productos_salida}")
-                productos_salida = [item for item in productos_salida if item['codigo_barra'] != codigo_barra]
-                request.session['productos_salida'] = productos_salida
-                request.session.modified = True
-                logger.info(f"Producto eliminado de la lista de salida: {codigo_barra}")
-                logger.info(f"Lista actualizada de productos_salida: {productos_salida}")
-                return JsonResponse({'success': True})
-
-            # Acción para actualizar datos de un producto
-            elif request.POST.get('action') == 'update_data':
-                codigo_barra = request.POST.get('codigo_barra')
-                numero_siscom = request.POST.get('numero_siscom', '').strip()
-                cantidad = request.POST.get('cantidad', '').strip()
-                observacion = request.POST.get('observacion', '').strip()
-
-                logger.info(f"Actualizando datos del producto {codigo_barra}: SISCOM={numero_siscom}, Cantidad={cantidad}, Observación={observacion}")
+                # Ráfaga de lecturas del escáner: todo el lote en una sola solicitud
+                if request.POST.get('action') == 'agregar_escaneos':
+                    try:
+                        resultados = agregar_escaneos(
+                            request.user,
+                            interpretar_escaneos(request.POST.get('escaneos', '')),
+                            lote=request.POST.get('lote') or None,
+                        )
+                    except LoteEnProceso:
+                        # La pantalla conserva el lote y lo reenvía con el mismo identificador
+                        return JsonResponse(
+                            {'success': False, 'en_proceso': True, 'error': 'El lote de lecturas aún se está procesando.'},
+                            status=409
+                        )
+                    logger.info(f"Lecturas del escáner agregadas: {sum(r['success'] for r in resultados.values())} "
+                                f"de {len(resultados)} productos")
+                    return JsonResponse({'success': True, 'resultados': resultados})
+
+                # Acción para eliminar un producto
+                if 'eliminar_producto' in request.POST:
+                    quitar_del_carrito(request.user, codigo_barra)
+                    logger.info(f"Producto eliminado de la lista de salida: {codigo_barra}")
+                    return JsonResponse({'success': True})
 
-                try:
-                    producto = Producto.objects.get(codigo_barra=codigo_barra)
-                    productos_salida = request.session.get('productos_salida', [])  # Recargar desde la sesión
-                    logger.info(f"Lista actual de productos_salida antes de actualizar: {productos_salida}")
-
-                    # Validar número SISCOM
-                    if numero_siscom and not numero_siscom.isdigit():
-                        logger.warning(f"Número SISCOM inválido para el producto {codigo_barra}: {numero_siscom}")
-                        return JsonResponse({'success': False, 'error': f'El Número de SISCOM para el producto {codigo_barra} debe ser un número entero.'})
-
-                    # Validar cantidad solo si no está vacía
-                    if cantidad:
-                        if not cantidad.isdigit():
-                            logger.warning(f"Cantidad inválida para el producto {codigo_barra}: {cantidad}")
-                            return JsonResponse({'success': False, 'error': f'La cantidad para el producto {codigo_barra} debe ser un número entero.'})
-                        cantidad_int = int(cantidad)
-                        if cantidad_int <= 0:
-                            logger.warning(f"Cantidad no positiva para el producto {codigo_barra}: {cantidad_int}")
-                            return JsonResponse({'success': False, 'error': f'La cantidad para el producto {codigo_barra} debe ser mayor que 0.'})
-                        if cantidad_int > producto.stock:
-                            logger.warning(f"Cantidad excede el stock para el producto {codigo_barra}. Cantidad: {cantidad_int}, Stock: {producto.stock}")
-                            return JsonResponse({'success': False, 'error': f'La cantidad para el producto {codigo_barra} no puede superar el stock ({producto.stock}).'})
-
-                    # Actualizar el producto en la lista
-                    updated = False
-                    for item in productos_salida:
-                        if item['codigo_barra'] == codigo_barra:
-                            item.update({
-                                'numero_siscom': numero_siscom,
-                                'cantidad': cantidad,  # Mantener el valor de cantidad
-                                'observacion': observacion,
-                                'stock': producto.stock,
-                            })
-                            updated = True
-                            logger.info(f"Datos actualizados para el producto {codigo_barra}: {item}")
-                            break
-
-                    if updated:
-                        request.session['productos_salida'] = productos_salida
-                        request.session.modified = True
-                        logger.info(f"Lista actualizada de productos_salida después de actualizar: {productos_salida}")
-                        return JsonResponse({'success': True})
-                    else:
-                        logger.warning(f"No se encontró el producto {codigo_barra} en la lista de salida.")
-                        return JsonResponse({'success': False, 'error': f'No se encontró el producto {codigo_barra} en la lista de salida.'})
-
-                except Producto.DoesNotExist:
-                    logger.error(f"Producto con código {codigo_barra} no encontrado.")
-                    return JsonResponse({'success': False, 'error': 'Producto no encontrado.'})
+                # Acción para actualizar datos de un producto
+                if request.POST.get('action') == 'update_data':
+                    actualizar_linea_carrito(
+                        request.user,
+                        codigo_barra,
+                        numero_siscom=request.POST.get('numero_siscom', '').strip(),
+                        cantidad=request.POST.get('cantidad', '').strip(),
+                        observacion=request.POST.get('observacion', '').strip(),
+                    )
+                    return JsonResponse({'success': True})
+            except ValidationError as e:
+                logger.warning(f"Acción rechazada para el producto {codigo_barra}: {e.message}")
+                return JsonResponse({'success': False, 'error': e.message})
 
         # Manejar el formulario de salida de productos (botón "Siguiente")
         if 'siguiente' in request.POST:
-            logger.info("Procesando formulario de salida de productos (botón 'Siguiente')")
-            productos_salida = request.session.get('productos_salida', [])  # Recargar desde la sesión
-            logger.info(f"Productos en la sesión antes de validar: {productos_salida}")
-
-            # Verificar si hay productos en la lista de salida
-            if not productos_salida:
-                logger.warning("No hay productos en la lista de salida.")
-                messages.error(request, 'Debes agregar al menos un producto para continuar.')
+            # Las líneas traen el stock actual: se validan todas con una sola consulta
+            try:
+                validar_carrito(lineas_carrito(request.user))
+            except ValidationError as e:
+                logger.warning(f"Carrito de salida no válido: {e.message}")
+                messages.error(request, e.message)
                 return redirect('salida-productos')
+            return redirect('salida-productos-seleccion')
 
-            # Validar cada producto en la lista de salida
-            for item in productos_salida:
-                logger.info(f"Validando producto: {item}")
-
-                # Validar número SISCOM
-                numero_siscom = str(item.get('numero_siscom', '')).strip()
-                if not numero_siscom:
-                    logger.warning(f"Número SISCOM vacío para el producto {item['codigo_barra']}")
-                    messages.error(request, f"El Número de SISCOM para el producto {item['codigo_barra']} no puede estar vacío.")
-                    return redirect('salida-productos')
-                if not numero_siscom.isdigit():
-                    logger.warning(f"Número SISCOM inválido para el producto {item['codigo_barra']}: {numero_siscom}")
-                    messages.error(request, f"El Número de SISCOM para el producto {item['codigo_barra']} debe ser un número entero válido (valor recibido: '{numero_siscom}').")
-                    return redirect('salida-productos')
-
-                # Validar cantidad
-                cantidad_str = str(item.get('cantidad', '')).strip()
-                if not cantidad_str:
-                    logger.warning(f"Cantidad vacía para el producto {item['codigo_barra']}")
-                    messages.error(request, f"La cantidad para el producto {item['codigo_barra']} no puede estar vacía.")
-                    return redirect('salida-productos')
-
-                try:
-                    cantidad = int(cantidad_str)
-                    logger.info(f"Cantidad convertida para el producto {item['codigo_barra']}: {cantidad}")
-
-                    # Validar que la cantidad sea positiva
-                    if cantidad <= 0:
-                        logger.warning(f"Cantidad no positiva para el producto {item['codigo_barra']}: {cantidad}")
-                        messages.error(request, f"La cantidad para el producto {item['codigo_barra']} debe ser mayor que 0 (valor recibido: {cantidad}).")
-                        return redirect('salida-productos')
+        logger.warning("Acción POST no reconocida en salida_productos.")
+        messages.error(request, "Acción no reconocida. Por favor, intenta de nuevo.")
 
-                    # Validar que la cantidad no supere el stock
-                    try:
-                        producto = Producto.objects.get(codigo_barra=item['codigo_barra'])
-                        if cantidad > producto.stock:
-                            logger.warning(f"Cantidad excede el stock para el producto {item['codigo_barra']}. Cantidad: {cantidad}, Stock: {producto.stock}")
-                            messages.error(request, f"La cantidad a retirar ({cantidad}) para el producto {item['codigo_barra']} no puede superar el stock actual ({producto.stock}).")
-                            return redirect('salida-productos')
-                        item['stock'] = producto.stock  # Actualizar el stock en la sesión
-                    except Producto.DoesNotExist:
-                        logger.error(f"Producto con código {item['codigo_barra']} no encontrado durante la validación.")
-                        messages.error(request, f"El producto con código {item['codigo_barra']} no existe.")
-                        return redirect('salida-productos')
-
-                    # Actualizar cantidad en el producto
-                    item['cantidad'] = cantidad
-
-                except ValueError:
-                    logger.warning(f"Cantidad no convertible a entero para el producto {item['codigo_barra']}: {cantidad_str}")
-                    messages.error(request, f"La cantidad para el producto {item['codigo_barra']} debe ser un número entero (valor recibido: '{cantidad_str}').")
-                    return redirect('salida-productos')
-
-            # Si todas las validaciones pasaron, redirigir a la siguiente etapa
-            logger.info("Todas las validaciones pasaron. Redirigiendo a salida-productos-seleccion")
-            request.session['productos_salida'] = productos_salida
-            request.session.modified = True
-            logger.info(f"Productos guardados en la sesión antes de redirigir: {request.session['productos_salida']}")
-            return redirect('salida-productos-seleccion')
+    # Preparar la lista de productos para mostrar
+    productos = Producto.objects.all().order_by('codigo_barra')
+    query_codigo = request.GET.get('codigo_barra', '')
+    query_descripcion = request.GET.get('descripcion', '')
 
-        else:
-            logger.warning("Acción POST no reconocida en salida_productos.")
-            messages.error(request, "Acción no reconocida. Por favor, intenta de nuevo.")
-
-    # Manejar solicitud AJAX para renderizar la tabla de productos disponibles
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest' and request.method == 'GET':
-        productos_salida = request.session.get('productos_salida', [])  # Volver a cargar desde la sesión
-        logger.info(f"Renderizando tabla de productos disponibles con productos_salida: {productos_salida}")
-        context = {
-            'page_obj': page_obj,
-            'query_codigo': query_codigo,
-            'query_descripcion': query_descripcion,
-            'productos_salida': productos_salida,  # Asegurarse de pasar la lista actualizada
-        }
-        return render(request, 'accounts/salida_productos.html', context)
+    if query_codigo:
+        productos = productos.filter(codigo_barra=query_codigo)
+    if query_descripcion:
+        productos = buscar_productos(productos, query_descripcion)
 
-    logger.info(f"Renderizando salida_productos.html con productos_salida: {productos_salida}")
+    # La misma plantilla responde a la carga normal y a la tabla pedida por AJAX
     return render(request, 'accounts/salida_productos.html', {
-        'page_obj': page_obj,
+        'page_obj': paginar_resultados(request, productos),
         'query_codigo': query_codigo,
         'query_descripcion': query_descripcion,
-        'productos_salida': productos_salida,
+        'productos_salida': lineas_carrito(request.user),
     })
 
 @login_required
@@ -921,103 +596,33 @@ def salida_productos_seleccion(request):
         messages.error(request, 'No tienes permiso para realizar salidas de productos.')
         return redirect('home')
 
-    # Verificar si hay productos en la sesión
-    productos_salida = request.session.get('productos_salida', [])
-    if not productos_salida:
-        logger.warning("No hay productos seleccionados para la salida en salida_productos_seleccion.")
-        messages.error(request, 'No hay productos seleccionados para la salida.')
-        return redirect('salida-productos')
-
-    # Verificar si el acta ya fue generada para evitar duplicados
-    if 'acta_generada' in request.session and request.session['acta_generada']:
-        logger.info("Acta ya generada, redirigiendo a salida-productos.")
-        messages.info(request, 'El acta ya ha sido generada. Por favor, inicia una nueva salida.')
-        return redirect('salida-productos')
-
     if request.method == 'POST':
-        # Manejar el botón "Cancelar"
+        # Manejar el botón "Cancelar": el carrito se conserva
         if 'cancelar' in request.POST:
-            logger.info("Botón 'Cancelar' presionado en salida_productos_seleccion. Redirigiendo a salida_productos.")
-            # No limpiamos productos_salida, simplemente redirigimos
             return redirect('salida-productos')
 
         form = ActaEntregaForm(request.POST)
-        logger.info(f"Formulario recibido en salida_productos_seleccion: {request.POST}")
         if form.is_valid():
-            logger.info("Formulario válido. Procesando la salida...")
-            logger.info(f"Datos limpiados - Departamento: {form.cleaned_data['departamento']}, Responsable: {form.cleaned_data['responsable']}")
             try:
-                # Validar el stock disponible directamente del producto (ya sincronizado)
-                for item in productos_salida:
-                    logger.info(f"Validando stock para el producto: {item}")
-                    producto = Producto.objects.get(codigo_barra=item['codigo_barra'])
-                    cantidad = int(item['cantidad'] or 0)
-
-                    # Usar stock del producto directamente (ya está sincronizado con lotes)
-                    stock_disponible = producto.stock
-                    
-                    logger.info(f"Producto: {producto.descripcion}, Stock disponible: {stock_disponible}, Cantidad solicitada: {cantidad}")
-                    if stock_disponible < cantidad:
-                        logger.warning(f"No hay suficiente stock para {producto.descripcion} (Código: {producto.codigo_barra}). Stock disponible: {stock_disponible}, Solicitado: {cantidad}.")
-                        messages.error(request, f'No hay suficiente stock para {producto.descripcion} (Código: {producto.codigo_barra}). Stock disponible: {stock_disponible}, Solicitado: {cantidad}.')
-                        return redirect('salida-productos-seleccion')
-
-                ultimo_acta = ActaEntrega.objects.order_by('-numero_acta').first()
-                numero_acta = 1 if not ultimo_acta else ultimo_acta.numero_acta + 1
-                logger.info(f"Nuevo número de acta: {numero_acta}")
-
-                responsable = form.cleaned_data['responsable']
-
-                for item in productos_salida:
-                    logger.info(f"Creando acta para el producto: {item}")
-                    producto = Producto.objects.get(codigo_barra=item['codigo_barra'])
-                    cantidad = int(item['cantidad'])
-                    acta = ActaEntrega(
-                        numero_acta=numero_acta,
-                        departamento=form.cleaned_data['departamento'],
-                        responsable=responsable,
-                        generador=request.user,
-                        producto=producto,
-                        cantidad=cantidad,
-                        numero_siscom=item['numero_siscom'],
-                        observacion=item['observacion'],
-                    )
-                    acta.save()
-                    logger.info(f"Acta creada: N°{acta.numero_acta}, Producto: {producto.descripcion}, Cantidad: {cantidad}")
-
-                    Transaccion.objects.create(
-                        producto=producto,
-                        tipo='salida',
-                        cantidad=cantidad,
-                        acta_entrega=acta,
-                        fecha=datetime.now(pytz.UTC),
-                        observacion=f"Salida asociada al Acta N°{numero_acta}"
-                    )
-                    logger.info(f"Transacción creada: Tipo: salida, Cantidad: {cantidad}")
-
-                    # Usar sistema FIFO automático para reducir stock
-                    if producto.tiene_vencimiento:
-                        exito = producto.reducir_stock_fifo(cantidad)
-                        if not exito:
-                            logger.error(f"Error al reducir stock FIFO para {producto.descripcion}")
-                            messages.error(request, f'Error al reducir stock para {producto.descripcion}')
-                            return JsonResponse({'success': False, 'error': f'Error al reducir stock para {producto.descripcion}'})
-                        logger.info(f"Stock reducido usando FIFO: {producto.descripcion}, Nuevo stock: {producto.stock}")
-                    else:
-                        # Para productos sin vencimiento, reducir del stock principal
-                        producto.stock -= cantidad
-                        producto.save()
-                        logger.info(f"Stock reducido directamente: {producto.descripcion}, Nuevo stock: {producto.stock}")
-
-                actas = ActaEntrega.objects.filter(numero_acta=numero_acta)
-                logger.info(f"Actas para el PDF: {list(actas)}")
-
-                # Marcar el acta como generada para evitar duplicados
-                request.session['acta_generada'] = True
-                request.session.modified = True
-
-                # Generar el PDF y obtener el resultado
-                pdf_result = generar_pdf_acta(actas)
+                # Tomar el carrito, validar, descontar FIFO y crear el acta en una sola transacción:
+                # un segundo envío del formulario encuentra el carrito vacío
+                try:
+                    with transaction.atomic():
+                        salida = registrar_salida(
+                            tomar_carrito(request.user),
+                            departamento=form.cleaned_data['departamento'],
+                            responsable=form.cleaned_data['responsable'],
+                            generador=request.user,
+                        )
+                except ValidationError as e:
+                    logger.warning(f"Salida rechazada: {e.message}")
+                    messages.error(request, e.message)
+                    return redirect('salida-productos-seleccion')
+                numero_acta = salida['numero_acta']
+                logger.info(f"Acta N°{numero_acta} registrada con {len(salida['actas'])} productos")
+
+                # Generar el PDF en la caché en disco: la previsualización lo servirá sin volver a generarlo
+                pdf_result = obtener_pdf_acta(numero_acta)
 
                 # Verificar si hubo un error al generar el PDF
                 if 'error' in pdf_result:
@@ -1025,22 +630,13 @@ def salida_productos_seleccion(request):
                     messages.error(request, pdf_result['error'])
                     return redirect('salida-productos-seleccion')
 
-                # Preparar la respuesta JSON
-                response_data = {
+                return JsonResponse({
                     'success': True,
-                    'pdf_base64': pdf_result['pdf_base64'],
                     'numero_acta': pdf_result['numero_acta'],
                     'filename': pdf_result['filename'],
+                    'pdf_url': reverse('ver-acta-pdf', args=[numero_acta, 'inline']),
                     'message': f'Acta de entrega N°{numero_acta} generada correctamente.'
-                }
-
-                # Limpiar la sesión después de generar el PDF
-                limpiar_sesion_productos_salida(request)
-                if 'acta_generada' in request.session:
-                    del request.session['acta_generada']
-                    request.session.modified = True
-
-                return JsonResponse(response_data)
+                })
 
             except Exception as e:
                 logger.error(f"Error al procesar el acta: {str(e)}")
@@ -1052,34 +648,48 @@ def salida_productos_seleccion(request):
             for field, error_list in form.errors.items():
                 errors[field] = [str(error) for error in error_list]
             return JsonResponse({'success': False, 'errors': errors})
-    else:
-        form = ActaEntregaForm()
-        # Asegurar que la bandera de acta generada esté inicializada
-        request.session['acta_generada'] = False
-        request.session.modified = True
 
+    # Verificar si hay productos en el carrito
+    productos_salida = lineas_carrito(request.user)
+    if not productos_salida:
+        logger.warning("No hay productos seleccionados para la salida en salida_productos_seleccion.")
+        messages.error(request, 'No hay productos seleccionados para la salida.')
+        return redirect('salida-productos')
+
+    form = ActaEntregaForm()
     return render(request, 'accounts/salida_productos_seleccion.html', {'form': form, 'productos_salida': productos_salida})
 
 @login_required
 def listar_actas(request):
-    """Vista para listar las actas de entrega"""
-    limpiar_sesion_productos_salida(request)
-    actas = ActaEntrega.objects.all().order_by('-numero_acta')
+    """Vista para listar las actas de entrega (una fila por acta, paginada en la base)"""
+    vaciar_carrito_salida(request)
+    actas = EncabezadoActa.objects.select_related('responsable__departamento').order_by('-numero_acta')
     query_numero_acta = request.GET.get('numero_acta', '')
     query_responsable = request.GET.get('responsable', '')
 
     if query_numero_acta:
         try:
-            actas = actas.filter(numero_acta__startswith=int(query_numero_acta))
+            actas = actas.filter(filtro_prefijo_numero('numero_acta', int(query_numero_acta)))
         except ValueError:
             messages.error(request, 'El número de acta debe ser un valor numérico.')
     if query_responsable:
         actas = actas.filter(responsable__nombre__icontains=query_responsable)
 
-    actas_dict = {acta.numero_acta: acta for acta in actas}
-    actas_lista = sorted(actas_dict.values(), key=lambda x: x.numero_acta, reverse=True)
+    formato = formato_exportacion(request)
+    if formato in FORMATOS_STREAMING:
+        # Una fila por producto entregado
+        columnas = ['N° Acta', 'Fecha', 'Departamento', 'Responsable', 'Generador', 'Código de Barra',
+                    'Producto', 'Cantidad', 'N° SISCOM', 'Observación']
+        campos = ['numero_acta', 'fecha', 'departamento', 'responsable', 'generador', 'codigo_barra',
+                  'producto', 'cantidad', 'numero_siscom', 'observacion']
+        filas = ActaEntrega.objects.filter(encabezado__in=actas.values('pk')).order_by('-numero_acta', 'id').values_list(
+            'numero_acta', 'fecha', 'departamento', 'responsable__nombre', 'generador__nombre',
+            'producto__codigo_barra', 'producto__descripcion', 'cantidad', 'numero_siscom', 'observacion'
+        )
+        return respuesta_streaming(formato, "Actas", columnas, campos, iterar_datos(filas))
 
-    page_obj = paginar_resultados(request, actas_lista, items_por_pagina=20)
+    # Por cursor sobre el número (índice único): sin COUNT ni OFFSET en cada página
+    page_obj = paginar_resultados(request, actas, items_por_pagina=20, orden=('-numero_acta',), contar=True)
 
     return render(request, 'accounts/listar_actas.html', {
         'actas': page_obj,
@@ -1089,31 +699,47 @@ def listar_actas(request):
 
 @login_required
 def ver_acta_pdf(request, numero_acta, disposition):
-    """Vista para visualizar un acta de entrega en PDF"""
-    actas = ActaEntrega.objects.filter(numero_acta=numero_acta)
-    if not actas.exists():
+    """
+    Vista para visualizar o descargar un acta de entrega en PDF. El archivo se
+    sirve desde la caché en disco; la huella del contenido es el ETag, por lo que
+    una revisita sin cambios en el acta se responde con 304.
+    """
+    actas = lineas_acta(numero_acta)
+    if not actas:
         return HttpResponse("Acta no encontrada.", status=404)
 
-    pdf_result = generar_pdf_acta(actas, disposition)
-    if 'error' in pdf_result:
-        return HttpResponse(pdf_result['error'], status=500)
-
-    # Crear una respuesta HTTP para el PDF
-    response = HttpResponse(content_type='application/pdf')
-    filename = f"Acta_N°{numero_acta}.pdf"  # Cambiado para incluir "Acta_N°" en el nombre
-    encoded_filename = urllib.parse.quote(filename)
-    response['Content-Disposition'] = f'{disposition}; filename="{encoded_filename}"'
-    response['Content-Type'] = 'application/pdf; charset=utf-8'
-
-    # Decodificar el PDF desde base64 y escribirlo en la respuesta
-    pdf_content = base64.b64decode(pdf_result['pdf_base64'])
-    response.write(pdf_content)
+    etag = quote_etag(huella_acta(actas))
+    # Revisita sin cambios en el acta (If-None-Match): se responde sin leer ni generar el PDF
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None:
+        no_modificado['ETag'] = etag
+        return no_modificado
+
+    pdf = obtener_pdf_acta(numero_acta, actas)
+    if 'error' in pdf:
+        return HttpResponse(pdf['error'], status=500)
+    ultima_modificacion = int(os.path.getmtime(pdf['ruta']))
+    no_modificado = get_conditional_response(request, etag=etag, last_modified=ultima_modificacion)
+    if no_modificado is not None:
+        no_modificado['ETag'] = etag
+        return no_modificado
+
+    response = FileResponse(
+        open(pdf['ruta'], 'rb'),
+        as_attachment=disposition == 'attachment',
+        filename=pdf['filename'],
+        content_type='application/pdf',
+    )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(ultima_modificacion)
+    # El navegador puede guardar el PDF pero debe revalidarlo (If-None-Match) antes de usarlo
+    response['Cache-Control'] = 'private, no-cache'
     return response
 
 @login_required
 def bincard_buscar(request):
     """Vista para buscar un producto por código de barra y ver su historial"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if request.method == 'POST':
         codigo_barra = request.POST.get('codigo_barra', '').strip()
         if not codigo_barra:
@@ -1132,18 +758,35 @@ def bincard_buscar(request):
 
 @login_required
 def buscar_codigos_barra(request):
-    """Vista para buscar códigos de barra mediante autocompletado"""
+    """
+    Vista de autocompletado por prefijo de código de barra o de descripción.
+    Se responde desde el índice en memoria, sin consultar la base; el ETag es la
+    versión del catálogo, por lo que una revalidación sin cambios recibe 304.
+    """
     term = request.GET.get('term', '').strip()
     if not term:
         return JsonResponse([], safe=False)
-    productos = Producto.objects.filter(codigo_barra__startswith=term).order_by('codigo_barra')[:10]
-    codigos = [{'label': f"{p.codigo_barra} - {p.descripcion}", 'value': p.codigo_barra} for p in productos]
-    return JsonResponse(codigos, safe=False)
+
+    etag = quote_etag(str(obtener_version_catalogo()))
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None:
+        no_modificado['ETag'] = etag
+        return no_modificado
+
+    codigos = [
+        {'label': f"{codigo_barra} - {descripcion}", 'value': codigo_barra}
+        for codigo_barra, descripcion in INDICE_AUTOCOMPLETADO.sugerencias(term)
+    ]
+    response = JsonResponse(codigos, safe=False)
+    response['ETag'] = etag
+    # Al borrar y volver a escribir, el navegador reutiliza las sugerencias un minuto sin consultar
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
 
 @login_required
 def bincard_historial(request, codigo_barra):
     """Vista para mostrar el historial de transacciones de un producto"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not codigo_barra.isdigit():
         messages.error(request, 'El código de barra debe contener solo números.')
         return redirect('bincard-buscar')
@@ -1154,60 +797,27 @@ def bincard_historial(request, codigo_barra):
         messages.error(request, 'Producto no encontrado.')
         return redirect('bincard-buscar')
 
-    transacciones = Transaccion.objects.filter(producto=producto).order_by('fecha')
-    actas = ActaEntrega.objects.filter(producto=producto).order_by('fecha')
-
-    eventos = []
-    for transaccion in transacciones.filter(tipo='entrada'):
-        guia_o_factura = transaccion.guia_despacho or transaccion.numero_factura or "-"
-        if transaccion.guia_despacho:
-            guia_o_factura = f"Guía: {transaccion.guia_despacho}"
-        elif transaccion.numero_factura:
-            guia_o_factura = f"Factura: {transaccion.numero_factura}"
-
-        eventos.append({
-            'tipo': 'entrada',
-            'fecha': transaccion.fecha or datetime.now(pytz.UTC),
-            'guia_o_factura': guia_o_factura,
-            'numero_acta': None,
-            'rut_proveedor': transaccion.rut_proveedor or '-',
-            'departamento': None,
-            'entrada': transaccion.cantidad,
-            'salida': 0,
-        })
-
-    for transaccion in transacciones.filter(tipo='salida'):
-        if transaccion.acta_entrega:
-            eventos.append({
-                'tipo': 'salida',
-                'fecha': transaccion.fecha or transaccion.acta_entrega.fecha or datetime.now(pytz.UTC),
-                'guia_o_factura': "-",
-                'numero_acta': transaccion.acta_entrega.numero_acta,
-                'rut_proveedor': None,
-                'departamento': transaccion.acta_entrega.departamento,
-                'entrada': 0,
-                'salida': transaccion.cantidad,
-            })
-
-    eventos.sort(key=lambda x: x['fecha'] or datetime.now(pytz.UTC))
+    formato = formato_exportacion(request)
+    if formato in FORMATOS_STREAMING:
+        return respuesta_reporte(obtener_reporte('bincard', formato, {'codigo_barra': producto.codigo_barra}), formato)
 
-    saldo = 0
-    movimientos = []
-    for evento in eventos:
-        if evento['tipo'] == 'entrada':
-            saldo += evento['entrada']
-        else:
-            saldo -= evento['salida']
-
-        if saldo < 0:
-            messages.error(request, f'Error: El saldo no puede ser negativo en la fecha {evento["fecha"]}. Contacte al administrador.')
-            return redirect('bincard-buscar')
+    # El saldo está almacenado en cada transacción: sólo se leen los totales y la página pedida
+    asegurar_saldos_bincard(producto)
+    movimientos = consulta_movimientos_bincard(producto)
 
-        evento['saldo'] = saldo
-        movimientos.append(evento)
+    fecha_negativa = movimientos.filter(saldo__lt=0).values_list('fecha', flat=True).first()
+    if fecha_negativa:
+        messages.error(request, f'Error: El saldo no puede ser negativo en la fecha {fecha_negativa}. Contacte al administrador.')
+        return redirect('bincard-buscar')
 
-    total_entradas = sum(m['entrada'] for m in movimientos)
-    total_salidas = sum(m['salida'] for m in movimientos)
+    totales = movimientos.aggregate(
+        total_entradas=models.Sum('cantidad', filter=Q(tipo='entrada')),
+        total_salidas=models.Sum('cantidad', filter=Q(tipo='salida')),
+        total_movimientos=models.Count('id'),
+    )
+    total_entradas = totales['total_entradas'] or 0
+    total_salidas = totales['total_salidas'] or 0
+    saldo = total_entradas - total_salidas
 
     # CORRECCIÓN DEFINITIVA: Manejo diferenciado para productos con/sin vencimiento
     if producto.tiene_vencimiento:
@@ -1234,23 +844,69 @@ def bincard_historial(request, codigo_barra):
             producto.save()
             messages.info(request, f'El stock del producto ha sido corregido a {saldo} para que coincida con el saldo calculado.')
 
-    if request.method == 'POST' and 'exportar_excel' in request.POST:
-        columnas = ['Fecha', 'Guía o Factura', 'N° Acta', 'Proveedor (RUT)', 'Programa/Departamento', 'Entrada', 'Salida', 'Saldo']
-        campos = ['fecha', 'guia_o_factura', 'numero_acta', 'rut_proveedor', 'departamento', 'entrada', 'salida', 'saldo']
-        return exportar_excel(request, movimientos, f"Bincard_{producto.codigo_barra}", columnas, campos)
+    if formato == 'xlsx':
+        # El Excel de productos con muchos movimientos se genera en segundo plano
+        trabajo = encolar_trabajo('bincard', 'xlsx', {'codigo_barra': producto.codigo_barra}, request.user)
+        return redirect('estado-trabajo', pk=trabajo.pk)
 
-    page_obj = paginar_resultados(request, movimientos)
+    # Paginación por cursor sobre el índice (producto, fecha, tipo): cada página cuesta lo mismo
+    page_obj = paginar_por_cursor(
+        request, movimientos.values('id', *CAMPOS_CONSULTA_BINCARD), Transaccion.ORDEN_BINCARD
+    )
+    page_obj.object_list = [
+        dict(zip(CAMPOS_BINCARD, fila_bincard(*(fila[campo] for campo in CAMPOS_CONSULTA_BINCARD))),
+             id=fila['id'], tipo=fila['tipo'])
+        for fila in page_obj.object_list
+    ]
     return render(request, 'accounts/bincard_historial.html', {
         'producto': producto,
         'page_obj': page_obj,
         'total_entradas': total_entradas,
         'total_salidas': total_salidas,
+        'total_movimientos': totales['total_movimientos'],
+    })
+
+@login_required
+def stock_a_fecha(request):
+    """
+    Vista del stock de todos los productos al final de un día (inventarios de
+    cierre y auditorías): último cierre mensual más los movimientos posteriores.
+    """
+    vaciar_carrito_salida(request)
+    hoy = timezone.localdate()
+    fecha = hoy
+    if request.GET.get('fecha'):
+        try:
+            fecha = datetime.strptime(request.GET['fecha'], '%Y-%m-%d').date()
+        except ValueError:
+            messages.error(request, 'La fecha no es válida.')
+    if fecha > hoy:
+        messages.error(request, 'La fecha no puede ser posterior a hoy.')
+        fecha = hoy
+
+    formato = formato_exportacion(request)
+    if formato in FORMATOS_STREAMING:
+        return respuesta_reporte(obtener_reporte('stock_fecha', formato, {'fecha': fecha.isoformat()}), formato)
+    if formato == 'xlsx':
+        trabajo = encolar_trabajo('stock_fecha', 'xlsx', {'fecha': fecha.isoformat()}, request.user)
+        return redirect('estado-trabajo', pk=trabajo.pk)
+
+    cierre = cierre_anterior(fecha)
+    productos = consulta_stock_a_fecha(fecha, cierre)
+    totales = productos.aggregate(total_productos=models.Count('id'), total_unidades=models.Sum('stock_a_fecha'))
+    page_obj = paginar_por_cursor(request, productos.select_related('categoria'), ('descripcion', 'id'))
+    return render(request, 'accounts/stock_a_fecha.html', {
+        'fecha': fecha,
+        'cierre': cierre,
+        'page_obj': page_obj,
+        'total_productos': totales['total_productos'],
+        'total_unidades': totales['total_unidades'] or 0,
     })
 
 @login_required
 def agregar_departamento(request):
     """Vista para agregar un nuevo departamento"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_manage_departments'):
         messages.error(request, 'No tienes permiso para agregar departamentos.')
         return redirect('home')
@@ -1308,10 +964,34 @@ def detalle_lotes_producto(request, codigo_barra):
     
     return render(request, 'accounts/detalle_lotes_producto.html', context)
 
+@login_required
+def trazabilidad_lote(request, codigo_barra, numero_lote):
+    """Vista para ver a qué actas, departamentos y responsables se entregó un lote (retiro de lotes)."""
+    producto = get_object_or_404(Producto, codigo_barra=codigo_barra)
+    entregas = filas_trazabilidad_lote(codigo_barra, numero_lote)
+
+    formato = formato_exportacion(request)
+    if formato in FORMATOS_STREAMING:
+        return respuesta_streaming(
+            formato, f"Trazabilidad_{codigo_barra}_lote_{numero_lote}",
+            COLUMNAS_TRAZABILIDAD, CAMPOS_TRAZABILIDAD, iterar_datos(entregas)
+        )
+
+    entregas = [dict(zip(CAMPOS_TRAZABILIDAD, fila)) for fila in entregas]
+    context = {
+        'producto': producto,
+        'numero_lote': numero_lote,
+        'lote': producto.lotes.filter(numero_lote=numero_lote).first(),
+        'entregas': entregas,
+        'total_entregado': sum(entrega['cantidad'] for entrega in entregas),
+        'total_actas': len({entrega['numero_acta'] for entrega in entregas}),
+    }
+    return render(request, 'accounts/trazabilidad_lote.html', context)
+
 @login_required
 def modificar_departamento(request):
     """Vista para modificar un departamento existente"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_manage_departments'):
         messages.error(request, 'No tienes permiso para modificar departamentos.')
         return redirect('home')
@@ -1374,7 +1054,7 @@ def modificar_departamento(request):
 @login_required
 def eliminar_departamento(request):
     """Vista para deshabilitar un departamento"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_manage_departments'):
         messages.error(request, 'No tienes permiso para deshabilitar departamentos.')
         return redirect('home')
@@ -1417,7 +1097,7 @@ def funcionarios_por_departamento(request):
 @permission_required('accounts.can_manage_users', raise_exception=True)
 def listar_usuarios(request):
     """Vista para listar usuarios con búsqueda y paginación"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     
     usuarios = CustomUser.objects.all().order_by('rut')
     form = SearchUserForm(request.GET or None)
@@ -1465,7 +1145,7 @@ def listar_usuarios(request):
 @permission_required('accounts.can_manage_users', raise_exception=True)
 def agregar_usuario(request):
     """Vista para agregar un nuevo usuario"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
@@ -1484,7 +1164,7 @@ def agregar_usuario(request):
 @permission_required('accounts.can_manage_users', raise_exception=True)
 def editar_usuario(request, rut):
     """Vista para editar un usuario existente"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     
     usuario = get_object_or_404(CustomUser, rut=rut)
     
@@ -1532,7 +1212,7 @@ def editar_usuario(request, rut):
 @permission_required('accounts.can_manage_users', raise_exception=True)
 def deshabilitar_usuario(request, rut):
     """Vista para deshabilitar o habilitar un usuario"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     
     usuario = get_object_or_404(CustomUser, rut=rut)
     
@@ -1581,7 +1261,7 @@ def verify_password(request):
 @permission_required('accounts.can_edit', raise_exception=True)
 def agregar_categoria(request):
     """Vista para agregar una nueva categoría"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_edit'):
 
         messages.error(request, 'No tienes permiso para agregar categorías.')
@@ -1606,7 +1286,7 @@ def agregar_categoria(request):
 @permission_required('accounts.can_edit', raise_exception=True)
 def modificar_categoria(request):
     """Vista para modificar una categoría existente"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_edit'):
         messages.error(request, 'No tienes permiso para modificar categorías.')
         return redirect('home')
@@ -1635,7 +1315,7 @@ def modificar_categoria(request):
 @permission_required('accounts.can_edit', raise_exception=True)
 def eliminar_categoria(request):
     """Vista para deshabilitar una categoría existente"""
-    limpiar_sesion_productos_salida(request)
+    vaciar_carrito_salida(request)
     if not request.user.has_perm('accounts.can_edit'):
         messages.error(request, 'No tienes permiso para deshabilitar categorías.')
         return redirect('home')
@@ -1669,83 +1349,65 @@ def control_vencimientos(request):
     from datetime import date, timedelta
     hoy = date.today()
     
-    # Obtener productos con vencimiento que tienen stock > 0 Y que tienen lotes activos
+    # Obtener productos con vencimiento que tienen stock > 0 Y que tienen lotes activos.
+    # El estado se calcula en SQL desde el próximo vencimiento (mínimo de los lotes activos)
     productos_base = Producto.objects.filter(
         tiene_vencimiento=True,
-        stock__gt=0
-    ).select_related('categoria').prefetch_related('lotes')
-    
-    # FILTRO ADICIONAL: Solo incluir productos que tienen al menos un lote con stock > 0
-    productos_con_lotes_activos = []
-    for producto in productos_base:
-        if producto.get_total_lotes_activos() > 0:  # Solo productos con lotes activos
-            productos_con_lotes_activos.append(producto)
+        stock__gt=0,
+        lotes_activos__gt=0
+    )
     
-    productos_base = productos_con_lotes_activos
+    # Calcular estadísticas con una sola consulta usando rangos de fecha
+    estadisticas = productos_base.aggregate(
+        vencidos=models.Count('id', filter=filtro_estado_vencimiento('Vencido', 'proximo_vencimiento', hoy)),
+        criticos=models.Count('id', filter=(
+            filtro_estado_vencimiento('Vence Hoy', 'proximo_vencimiento', hoy)
+            | filtro_estado_vencimiento('Crítico', 'proximo_vencimiento', hoy)
+        )),
+        precaucion=models.Count('id', filter=filtro_estado_vencimiento('Precaución', 'proximo_vencimiento', hoy)),
+        total=models.Count('id'),
+    )
+    estadisticas['normal'] = (
+        estadisticas['total'] - estadisticas['vencidos'] - estadisticas['criticos'] - estadisticas['precaucion']
+    )
     
     # Filtrado por estado
     estado_filtro = request.GET.get('estado', 'todos')
     busqueda = request.GET.get('busqueda', '')
     
-    # Crear lista de productos con información de lotes para filtrado
-    productos_info = []
-    for producto in productos_base:
-        # Usar el estado de vencimiento completo que considera todos los lotes
-        estado_vencimiento = producto.get_estado_vencimiento_completo()
-        proximo_vencimiento = producto.get_proximo_vencimiento()
-        lotes_detalle = producto.get_lotes_activos_detalle()  # Solo lotes activos para el control
-        
-        # Calcular días restantes del lote más próximo a vencer
-        dias_restantes = None
-        if proximo_vencimiento:
-            dias_restantes = (proximo_vencimiento - hoy).days
-        
-        productos_info.append({
-            'producto': producto,
-            'estado_vencimiento': estado_vencimiento,
-            'proximo_vencimiento': proximo_vencimiento,
-            'dias_restantes': dias_restantes,
-            'lotes_detalle': lotes_detalle,
-            'total_lotes': len(lotes_detalle)
-        })
-    
-    # Filtrar por estado
+    productos_filtrados = productos_base
     if estado_filtro == 'vencidos':
-        productos_info = [p for p in productos_info if p['estado_vencimiento'] == 'Vencido']
+        productos_filtrados = productos_filtrados.por_estado_vencimiento(['Vencido'], hoy)
     elif estado_filtro == 'criticos':
-        productos_info = [p for p in productos_info if p['estado_vencimiento'] in ['Vence Hoy', 'Crítico']]
+        productos_filtrados = productos_filtrados.por_estado_vencimiento(['Vence Hoy', 'Crítico'], hoy)
     elif estado_filtro == 'precaucion':
-        productos_info = [p for p in productos_info if p['estado_vencimiento'] == 'Precaución']
+        productos_filtrados = productos_filtrados.por_estado_vencimiento(['Precaución'], hoy)
     
     # Búsqueda por código o descripción
     if busqueda:
-        productos_info = [
-            p for p in productos_info 
-            if (busqueda.lower() in p['producto'].codigo_barra.lower() or 
-                busqueda.lower() in p['producto'].descripcion.lower())
-        ]
+        # El orden por urgencia de vencimiento se mantiene
+        productos_filtrados = buscar_productos(productos_filtrados, busqueda, ordenar_por_relevancia=False)
     
-    # Ordenar por días restantes (más críticos primero)
-    productos_info.sort(key=lambda x: (
-        0 if x['dias_restantes'] is None or x['dias_restantes'] < 0 else x['dias_restantes'],
-        x['producto'].descripcion
-    ))
+    # Ordenar por días restantes (más críticos primero) y paginar en la base de datos
+    productos_filtrados = productos_filtrados.select_related('categoria').con_estado_vencimiento(hoy).order_by(
+        'orden_vencimiento', 'descripcion', 'id'
+    )
+    productos_paginados = paginar_resultados_dinamico(request, productos_filtrados, 10)
     
-    # Paginación con numeración dinámica
-    productos_paginados = paginar_resultados_dinamico(request, productos_info, 10)
+    # Información de lotes sólo para los productos de la página visible
+    def construir_item(producto):
+        lotes_detalle = producto.get_lotes_activos_detalle()  # Solo lotes activos para el control
+        proximo_vencimiento = producto.proximo_vencimiento
+        return {
+            'producto': producto,
+            'estado_vencimiento': producto.estado_vencimiento_actual,
+            'proximo_vencimiento': proximo_vencimiento,
+            'dias_restantes': (proximo_vencimiento - hoy).days if proximo_vencimiento else None,
+            'lotes_detalle': lotes_detalle,
+            'total_lotes': len(lotes_detalle)
+        }
     
-    # Calcular estadísticas usando el estado completo de lotes
-    estadisticas = {'vencidos': 0, 'criticos': 0, 'precaucion': 0, 'normal': 0}
-    for producto in productos_base:
-        estado = producto.get_estado_vencimiento_completo()
-        if estado == 'Vencido':
-            estadisticas['vencidos'] += 1
-        elif estado in ['Vence Hoy', 'Crítico']:
-            estadisticas['criticos'] += 1
-        elif estado == 'Precaución':
-            estadisticas['precaucion'] += 1
-        else:
-            estadisticas['normal'] += 1
+    detallar_pagina_productos(productos_paginados, construir_item)
     
     context = {
         'productos': productos_paginados,
@@ -1755,7 +1417,7 @@ def control_vencimientos(request):
         'productos_criticos': estadisticas['criticos'],
         'productos_precaucion': estadisticas['precaucion'],
         'productos_normal': estadisticas['normal'],
-        'total_con_vencimiento': len(productos_info),
+        'total_con_vencimiento': productos_paginados.paginator.count,
         'hoy': hoy,
         'mostrar_lotes': True,  # Flag para mostrar información de lotes en template
     }
@@ -1764,112 +1426,20 @@ def control_vencimientos(request):
 
 @login_required
 def exportar_vencimientos_excel(request):
-    """Exporta el control de vencimientos a Excel."""
-    from datetime import date, timedelta
-    import openpyxl
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from django.http import HttpResponse
-    
+    """
+    Exporta el control de vencimientos. El Excel se genera en segundo plano y
+    se redirige al estado del trabajo; CSV/NDJSON (?exportar=csv|ndjson) se
+    descargan directamente en streaming.
+    """
+    from datetime import date
     hoy = date.today()
-    # Obtener productos con vencimiento y stock > 0
-    productos = Producto.objects.filter(
-        tiene_vencimiento=True
-    ).select_related('categoria').prefetch_related('lotes').order_by('descripcion')
-
-    # Crear libro de Excel
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Control de Vencimientos"
-
-    # Encabezados principales
-    headers = [
-        'Código de Barra', 'Descripción', 'Categoría', 'Stock Total',
-        'N° Lote', 'Stock Lote', 'Fecha Vencimiento Lote', 'Días Restantes', 'Estado Lote', 'Estado Producto'
-    ]
 
-    # Estilo para encabezados
-    header_font = Font(bold=True, color='FFFFFF')
-    header_fill = PatternFill(start_color='1a3c5e', end_color='1a3c5e', fill_type='solid')
-    center_alignment = Alignment(horizontal='center', vertical='center')
-
-    # Escribir encabezados
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = center_alignment
-
-    row = 2
-    for producto in productos:
-        lotes = list(producto.lotes.filter(stock__gt=0).order_by('fecha_vencimiento'))
-        estado_producto = producto.get_estado_vencimiento_completo()
-        # Si tiene lotes con stock, mostrar cada lote
-        if lotes:
-            for lote in lotes:
-                ws.cell(row=row, column=1, value=producto.codigo_barra)
-                ws.cell(row=row, column=2, value=producto.descripcion)
-                ws.cell(row=row, column=3, value=producto.categoria.nombre if producto.categoria else 'Sin categoría')
-                ws.cell(row=row, column=4, value=producto.stock)
-                ws.cell(row=row, column=5, value=lote.numero_lote)
-                ws.cell(row=row, column=6, value=lote.stock)
-                ws.cell(row=row, column=7, value=lote.fecha_vencimiento.strftime('%d/%m/%Y'))
-                ws.cell(row=row, column=8, value=lote.get_dias_para_vencer())
-                ws.cell(row=row, column=9, value=lote.get_estado_vencimiento())
-                ws.cell(row=row, column=10, value=estado_producto)
-                # Colorear según el estado del lote
-                color_fill = None
-                estado_lote = lote.get_estado_vencimiento()
-                if estado_lote == 'Vencido':
-                    color_fill = PatternFill(start_color='ffebee', end_color='ffebee', fill_type='solid')
-                elif estado_lote in ['Vence Hoy', 'Crítico']:
-                    color_fill = PatternFill(start_color='fff3e0', end_color='fff3e0', fill_type='solid')
-                elif estado_lote == 'Precaución':
-                    color_fill = PatternFill(start_color='e8f5e8', end_color='e8f5e8', fill_type='solid')
-                if color_fill:
-                    for col in range(1, 11):
-                        ws.cell(row=row, column=col).fill = color_fill
-                row += 1
-        else:
-            # Producto sin lotes activos pero con vencimiento
-            ws.cell(row=row, column=1, value=producto.codigo_barra)
-            ws.cell(row=row, column=2, value=producto.descripcion)
-            ws.cell(row=row, column=3, value=producto.categoria.nombre if producto.categoria else 'Sin categoría')
-            ws.cell(row=row, column=4, value=producto.stock)
-            ws.cell(row=row, column=5, value='-')
-            ws.cell(row=row, column=6, value='-')
-            fecha_venc = producto.fecha_vencimiento.strftime('%d/%m/%Y') if producto.fecha_vencimiento else '-'
-            ws.cell(row=row, column=7, value=fecha_venc)
-            dias_rest = producto.get_dias_para_vencer() if producto.fecha_vencimiento else '-'
-            ws.cell(row=row, column=8, value=dias_rest)
-            ws.cell(row=row, column=9, value=producto.get_estado_vencimiento())
-            ws.cell(row=row, column=10, value=estado_producto)
-            # Colorear según el estado del producto
-            color_fill = None
-            estado = producto.get_estado_vencimiento()
-            if estado == 'Vencido':
-                color_fill = PatternFill(start_color='ffebee', end_color='ffebee', fill_type='solid')
-            elif estado in ['Vence Hoy', 'Crítico']:
-                color_fill = PatternFill(start_color='fff3e0', end_color='fff3e0', fill_type='solid')
-            elif estado == 'Precaución':
-                color_fill = PatternFill(start_color='e8f5e8', end_color='e8f5e8', fill_type='solid')
-            if color_fill:
-                for col in range(1, 11):
-                    ws.cell(row=row, column=col).fill = color_fill
-            row += 1
-
-    # Ajustar ancho de columnas
-    column_widths = [15, 40, 20, 12, 10, 12, 18, 15, 15, 15]
-    for col, width in enumerate(column_widths, 1):
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = width
-
-    # Respuesta HTTP
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-      
-    response['Content-Disposition'] = f'attachment; filename="control_vencimientos_{hoy.strftime("%Y%m%d")}.xlsx"'   
-    wb.save(response)
-    return response
+    formato = formato_exportacion(request) or 'xlsx'
+    if formato in FORMATOS_STREAMING:
+        return respuesta_reporte(obtener_reporte('control_vencimientos', formato), formato)
+
+    trabajo = encolar_trabajo('control_vencimientos', 'xlsx', {'fecha': hoy.isoformat()}, request.user)
+    return redirect('estado-trabajo', pk=trabajo.pk)
 
 @login_required 
 def agregar_vencimiento_producto(request):
@@ -1878,8 +1448,11 @@ def agregar_vencimiento_producto(request):
         messages.error(request, 'No tienes permiso para agregar o modificar vencimientos.')
         return redirect('home')
     
+    from datetime import date
+    hoy = timezone.localdate()
+    
     # Obtener todos los productos para mostrar en la vista
-    productos = Producto.objects.all().select_related('categoria').prefetch_related('lotes').order_by('descripcion')
+    productos = Producto.objects.all()
     
     # Filtros
     query_codigo = request.GET.get('codigo_barra', '').strip()
@@ -1891,7 +1464,8 @@ def agregar_vencimiento_producto(request):
     if query_codigo:
         productos = productos.filter(codigo_barra__icontains=query_codigo)
     if query_descripcion:
-        productos = productos.filter(descripcion__icontains=query_descripcion)
+        # Se mantiene el orden por descripción de la vista
+        productos = buscar_productos(productos, query_descripcion, ordenar_por_relevancia=False)
     if query_categoria:
         productos = productos.filter(categoria__nombre__icontains=query_categoria)
     
@@ -1901,9 +1475,19 @@ def agregar_vencimiento_producto(request):
     elif tipo_filtro == 'con_vencimiento':
         productos = productos.filter(tiene_vencimiento=True)
     
-    # Preparar información adicional para cada producto
-    productos_info = []
-    for producto in productos:
+    # Totales por tipo en una sola consulta
+    totales = productos.aggregate(
+        total_productos=models.Count('id'),
+        productos_sin_vencimiento=models.Count('id', filter=Q(tiene_vencimiento=False)),
+        productos_con_vencimiento=models.Count('id', filter=Q(tiene_vencimiento=True)),
+    )
+    
+    # Paginación en la base de datos
+    productos = productos.select_related('categoria').con_estado_vencimiento(hoy).order_by('descripcion', 'id')
+    page_obj = paginar_resultados(request, productos, 20)
+    
+    # Preparar información adicional sólo para los productos de la página
+    def construir_item(producto):
         info = {
             'producto': producto,
             'lotes_detalle': [],
@@ -1915,13 +1499,12 @@ def agregar_vencimiento_producto(request):
         if producto.tiene_vencimiento:
             info['lotes_detalle'] = producto.get_lotes_activos_detalle()  # Solo lotes activos para gestión
             info['total_lotes'] = len(info['lotes_detalle'])  # Solo contar lotes activos
-            info['proximo_vencimiento'] = producto.get_proximo_vencimiento()
-            info['estado_vencimiento'] = producto.get_estado_vencimiento_completo()
+            info['proximo_vencimiento'] = producto.proximo_vencimiento
+            info['estado_vencimiento'] = producto.estado_vencimiento_actual
         
-        productos_info.append(info)
+        return info
     
-    # Paginación
-    page_obj = paginar_resultados(request, productos_info, 20)
+    detallar_pagina_productos(page_obj, construir_item)
     
     # Obtener categorías para el filtro
     from .models import Categoria
@@ -1934,9 +1517,7 @@ def agregar_vencimiento_producto(request):
         'query_categoria': query_categoria,
         'tipo_filtro': tipo_filtro,
         'categorias': categorias,
-        'total_productos': productos.count(),
-        'productos_sin_vencimiento': productos.filter(tiene_vencimiento=False).count(),
-        'productos_con_vencimiento': productos.filter(tiene_vencimiento=True).count(),
+        **totales,
     }
     
     return render(request, 'accounts/agregar_vencimiento.html', context)
@@ -1975,24 +1556,27 @@ def agregar_vencimiento_ajax(request):
         except ValueError:
             return JsonResponse({'success': False, 'error': 'Formato de fecha inválido.'})
         
-        # Activar vencimiento en el producto
-        producto.tiene_vencimiento = True
-        producto.fecha_vencimiento = fecha_obj
-        producto.save()
-        
-        # Si el producto tiene stock, crear un lote inicial
-        if producto.stock > 0:
-            stock_inicial = producto.stock  # Guardar el stock actual
-            lote = LoteProducto.objects.create(
-                producto=producto,
-                numero_lote=producto.get_proximo_numero_lote(),
-                fecha_vencimiento=fecha_obj,
-                stock=stock_inicial
-            )
-            # No cambiar el stock del producto, ya está correcto
-            # Solo sincronizar para asegurar consistencia
-            producto.sincronizar_stock_con_lotes()
-            
+        with transaction.atomic():
+            # Activar vencimiento en el producto
+            producto.tiene_vencimiento = True
+            producto.fecha_vencimiento = fecha_obj
+            producto.save()
+
+            # Si el producto tiene stock, crear un lote inicial
+            lote = None
+            if producto.stock > 0:
+                stock_inicial = producto.stock  # Guardar el stock actual
+                lote = LoteProducto.objects.create(
+                    producto=producto,
+                    numero_lote=producto.reservar_numero_lote(),
+                    fecha_vencimiento=fecha_obj,
+                    stock=stock_inicial
+                )
+                # No cambiar el stock del producto, ya está correcto
+                # Solo sincronizar para asegurar consistencia
+                producto.sincronizar_stock_con_lotes()
+
+        if lote:
             return JsonResponse({
                 'success': True, 
                 'message': f'Vencimiento agregado exitosamente. Se creó el Lote #{lote.numero_lote} con {lote.stock} unidades.',
@@ -2053,6 +1637,8 @@ def modificar_vencimiento_producto_ajax(request):
         lotes_actualizados = 0
         if producto.lotes.exists():
             lotes_actualizados = producto.lotes.update(fecha_vencimiento=fecha_obj)
+            # update() no pasa por LoteProducto.save(): refrescar el resumen de vencimiento
+            producto.actualizar_resumen_vencimiento()
         
         return JsonResponse({
             'success': True, 
@@ -2182,10 +1768,10 @@ def obtener_datos_producto_ajax(request):
             
             producto = Producto.objects.get(codigo_barra=codigo_barra)
             
-            # Calcular datos actualizados
-            estado_vencimiento = producto.get_estado_vencimiento_completo()
-            proximo_vencimiento = producto.get_proximo_vencimiento()
-            total_lotes = producto.lotes.filter(stock__gt=0).count()
+            # Datos actualizados desde el resumen de vencimiento del producto
+            estado_vencimiento = producto.estado_vencimiento
+            proximo_vencimiento = producto.proximo_vencimiento
+            total_lotes = producto.lotes_activos
             
             data = {
                 'success': True,
@@ -2208,3 +1794,40 @@ def obtener_datos_producto_ajax(request):
             return JsonResponse({'success': False, 'error': f'Error interno: {str(e)}'})
     
     return JsonResponse({'success': False, 'error': 'Método no permitido.'})
+
+def obtener_trabajo_usuario(request, pk):
+    """Trabajo del usuario actual (los superusuarios pueden ver todos)."""
+    trabajos = Trabajo.objects.all()
+    if not request.user.is_superuser:
+        trabajos = trabajos.filter(usuario=request.user)
+    return get_object_or_404(trabajos, pk=pk)
+
+@login_required
+def estado_trabajo(request, pk):
+    """Vista con el avance de un trabajo en segundo plano y el enlace de descarga al terminar."""
+    trabajo = obtener_trabajo_usuario(request, pk)
+    return render(request, 'accounts/estado_trabajo.html', {'trabajo': trabajo})
+
+@login_required
+def estado_trabajo_ajax(request, pk):
+    """Vista AJAX con el estado y avance de un trabajo."""
+    trabajo = obtener_trabajo_usuario(request, pk)
+    return JsonResponse({
+        'estado': trabajo.estado,
+        'estado_display': trabajo.get_estado_display(),
+        'progreso': trabajo.progreso,
+        'total': trabajo.total,
+        'porcentaje': trabajo.get_porcentaje(),
+        'error': trabajo.error,
+        'url_descarga': reverse('descargar-trabajo', args=[trabajo.pk]) if trabajo.estado == 'completado' else None,
+    })
+
+@login_required
+def descargar_trabajo(request, pk):
+    """Descarga el archivo generado por un trabajo completado."""
+    trabajo = obtener_trabajo_usuario(request, pk)
+    ruta = ruta_archivo(trabajo) if trabajo.archivo else None
+    if trabajo.estado != 'completado' or not ruta or not os.path.exists(ruta):
+        messages.error(request, 'El archivo del trabajo no está disponible.')
+        return redirect('estado-trabajo', pk=trabajo.pk)
+    return FileResponse(open(ruta, 'rb'), as_attachment=True, filename=trabajo.nombre_archivo)
@@ -78,6 +78,29 @@ DATABASES = {
         'NAME': '/app/db/db.sqlite3',
     }
 }
+# Cache
+# Caché en disco compartido entre los workers de gunicorn (snapshots del dashboard,
+# versión del inventario). No requiere servicios adicionales.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'TIMEOUT': 60 * 60 * 24,
+    }
+}
+
+# Trabajos en segundo plano (exportaciones pesadas)
+# Los archivos generados se guardan en disco local. Los ejecuta el comando
+# procesar_trabajos como worker dedicado, fuera del proceso web. TRABAJOS_EN_HILO
+# los ejecuta en un hilo del propio proceso web (sólo para desarrollo, sin worker).
+TRABAJOS_DIR = os.path.join(BASE_DIR, 'trabajos')
+TRABAJOS_EN_HILO = False
+# Segundos tras los cuales un trabajo en proceso se considera interrumpido y vuelve a la cola
+TRABAJOS_TIEMPO_MAXIMO = 2 * 60 * 60
+
+# Caché en disco de las actas de entrega en PDF (ver accounts.actas_pdf)
+ACTAS_PDF_DIR = os.path.join(BASE_DIR, 'actas_pdf')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 